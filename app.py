@@ -1,17 +1,29 @@
+import time
+STARTED_AT = time.perf_counter()  # cold start is measured from here, before the heavy imports
+
+import functools
 import logging
 from flask import Flask, send_from_directory, request, jsonify
 from flask_socketio import SocketIO, emit
 from werkzeug.utils import secure_filename
 import os
 from transcribe import Transcriber
+from transcription_cache import TranscriptionCache, audio_digest
+from transcription_worker import TranscriptionWorker
+from vad import EnergyVAD
 from chatbot import ChatBot
+from inference_worker import RemoteChatBot
+from readiness import Readiness, WarmingUp
+from sessions import SessionManager
+from streaming import SizedJSON
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='./frontend/build')
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Handlers block on the BatchScheduler's token queues, so every client needs a real thread
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', json=SizedJSON)
 
 # Configuration for file uploads
 UPLOAD_FOLDER = 'uploads'
@@ -19,140 +31,313 @@ ALLOWED_EXTENSIONS = {'wav', 'mp3', 'ogg', 'webm'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+UPLOAD_MAX_AGE = 10 * 60  # seconds an upload is kept for (retried) transcription requests
+TRANSCRIPTION_CACHE_FOLDER = 'transcription_cache'
+TRANSCRIBE_BATCH_SIZE = 8  # 30 s windows decoded per Whisper generate call
+TRANSCRIBE_MAX_WAIT_MS = 10  # how long the transcription worker waits for concurrent uploads to batch with
+TRANSCRIBE_VAD = False  # cut silence out of recordings before Whisper sees them
+# CUDA_VISIBLE_DEVICES of each inference worker process (None shares this process's GPUs);
+# an empty list runs the models inside the web process
+INFERENCE_WORKER_DEVICES = [None]
+
 # Ensure the upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Initialize the transcriber and chatbot when starting the app
-transcriber = Transcriber('openai/whisper-base')
-chatbot = ChatBot()
+# The server binds right away; the chatbot's model and the transcriber load concurrently
+# in the background, and handlers that need one answer "warming up" until it is ready
+readiness = Readiness(started=STARTED_AT)
+if INFERENCE_WORKER_DEVICES:
+    # Generation runs in worker processes, so it never stalls heartbeats, uploads or static files
+    chatbot = RemoteChatBot(lazy=True, devices=INFERENCE_WORKER_DEVICES)
+else:
+    chatbot = ChatBot(lazy=True)
+readiness.listeners.append(lambda status: socketio.emit('model_status', status))
+readiness.load('llm', chatbot.load)
+# Concurrent transcriptions are batched together by a single worker
+readiness.load('whisper', lambda: TranscriptionWorker(
+    Transcriber('openai/whisper-base', batch_size=TRANSCRIBE_BATCH_SIZE, vad=EnergyVAD() if TRANSCRIBE_VAD else None),
+    max_batch_size=TRANSCRIBE_BATCH_SIZE,
+    max_wait_ms=TRANSCRIBE_MAX_WAIT_MS,
+))
+# Retried or repeated uploads of the same audio are answered from here
+transcription_cache = TranscriptionCache(TRANSCRIPTION_CACHE_FOLDER)
+
+# Every socket connection gets its own chat tree on top of the shared model
+sessions = SessionManager(chatbot)
+# Model changes load in the background; tell every client when the new one takes over
+chatbot.on_model_switch = lambda model_name: socketio.emit('model_switched', {'model_name': model_name})
+SESSION_SWEEP_INTERVAL = 60  # seconds between idle-session sweeps
+MAX_REGENERATE_SAMPLES = 8  # alternatives one regenerate request may sample at once
+
+
+def evict_idle_sessions():
+    while True:
+        socketio.sleep(SESSION_SWEEP_INTERVAL)
+        sessions.evict_idle()
+
+
+socketio.start_background_task(evict_idle_sessions)
+
+
+def remove_stale_uploads():
+    while True:
+        socketio.sleep(UPLOAD_MAX_AGE)
+        cutoff = time.time() - UPLOAD_MAX_AGE
+        for filename in os.listdir(UPLOAD_FOLDER):
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            try:
+                if os.path.getmtime(filepath) < cutoff:
+                    os.remove(filepath)
+                    logger.info(f"Removed stale upload: {filename}")
+            except OSError as e:
+                logger.warning(f"Could not remove upload {filename}: {e}")
+
+
+socketio.start_background_task(remove_stale_uploads)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def requires(component):
+    """Make a socket handler reply with a warming-up error until `component` has loaded."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            try:
+                readiness.get(component)
+            except WarmingUp as e:
+                logger.info(f"Rejected {handler.__name__}: {e}")
+                emit('error', {'message': str(e), 'warming_up': True, 'component': component})
+                return
+            return handler(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.after_request
+def track_first_byte(response):
+    readiness.mark_first_byte()
+    return response
+
 @socketio.on('connect')
 def handle_connect():
-    logger.info("Client connected")
-    emit('chat_history', {'messages': chatbot.get_chat_history()})
+    logger.info(f"Client connected: {request.sid}")
+    session = sessions.get(request.sid)
+    emit('model_status', readiness.status())
+    emit_stream(session, 'chat_history', session.stream.snapshot({'messages': session.get_chat_history()}))
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    logger.info(f"Client disconnected: {request.sid}")
+    sessions.remove(request.sid)
+
+@socketio.on('set_stream_mode')
+def handle_set_stream_mode(data):
+    session = sessions.get(request.sid)
+    mode = data.get('mode', 'full')
+    logger.info(f"Setting stream mode to: {mode}")
+    try:
+        session.stream.set_mode(mode)
+        emit('stream_mode', {'mode': mode})
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+
+@socketio.on('resync')
+def handle_resync():
+    session = sessions.get(request.sid)
+    logger.info("Client requested a resync")
+    emit_stream(session, 'chat_update', session.stream.snapshot(
+        dict(session.get_full_chat_history(), type='resync', streaming=session.stream.streaming)
+    ))
+
+def emit_stream(session, event, payload, **kwargs):
+    """Emit an event built by the session's stream and count the bytes that went out."""
+    emit(event, payload, **kwargs)
+    session.stream.sent(SizedJSON.last_size())
+
+def stream_response(session, updates):
+    """
+    Emit the history updates of a generation to the client as its stream paces them
+    (by time and size, backing off while the client has not acknowledged earlier
+    updates), then a final 'stop' update.
+    """
+    stream = session.stream
+    stream.begin_turn(session.get_chat_history())
+    try:
+        for messages in updates:
+            alternatives = session.alternative_texts()
+            if stream.due(messages, alternatives):
+                update = stream.update(session.get_full_chat_history(), alternatives=alternatives)
+                emit_stream(session, *update, callback=stream.pacer.acked)
+    except Exception as e:
+        # e.g. the inference worker crashed; what was generated so far is kept
+        logger.error(f"Generation failed: {e}", exc_info=True)
+        emit('error', {'message': f'Generation failed: {e}'})
+    final = session.get_full_chat_history()
+    emit_stream(session, *stream.update(final, type='stop'))
+    stream.end_turn(final['messages'])
+
+@socketio.on('stop_generation')
+def handle_stop_generation():
+    session = sessions.get(request.sid)
+    # The running handler ends its stream with the usual 'stop' update, keeping the partial response
+    if not session.stop_generation():
+        logger.info("Nothing to stop")
 
 @socketio.on('save_chat')
 def handle_save_chat():
+    session = sessions.get(request.sid)
     logger.info("Saving current chat")
-    filepath = chatbot.save_chat_tree()
+    filepath = session.save_chat_tree()
     emit('chat_saved', {'filepath': filepath})
 
 @socketio.on('load_chat')
 def handle_load_chat(data):
+    session = sessions.get(request.sid)
     chat_id = data.get('chat_id')
     logger.info(f"Loading chat with ID: {chat_id}")
-    try:
-        chat_history = chatbot.load_chat_tree(chat_id)
-        emit('chat_history', {
-            'messages': chat_history,
-            'id': chatbot.get_chat_id(),
-            'name': chatbot.get_chat_name()
-            })
-    except FileNotFoundError:
-        emit('error', {'message': 'Chat history not found'})
+    with session.exclusive_turn():
+        try:
+            chat_history = session.load_chat_tree(chat_id)
+            emit_stream(session, 'chat_history', session.stream.snapshot({
+                'messages': chat_history,
+                'id': session.get_chat_id(),
+                'name': session.get_chat_name()
+                }))
+        except FileNotFoundError:
+            emit('error', {'message': 'Chat history not found'})
 
 @socketio.on('list_chats')
-def handle_list_chats():
-    logger.info("Listing chat histories")
-    chat_list = chatbot.list_chat_histories()
-    emit('chat_list', {'chats': chat_list})
+def handle_list_chats(data=None):
+    session = sessions.get(request.sid)
+    data = data or {}
+    offset = data.get('offset', 0)
+    limit = data.get('limit')
+    logger.info(f"Listing chat histories (offset {offset}, limit {limit})")
+    chat_list = session.list_chat_histories(offset, limit)
+    emit('chat_list', {'chats': chat_list, 'offset': offset, 'total': session.count_chat_histories()})
 
 
 @socketio.on('new_chat')
 def handle_new_chat():
+    session = sessions.get(request.sid)
     logger.info("Starting a new chat")
-    # Save the current chat first
-    chatbot.save_chat_tree()
-    # Start a new chat
-    chatbot.start_new_chat()
-    emit('new_chat_started', {'chat_id': chatbot.get_chat_id()})
-    emit('chat_history', {'messages': chatbot.get_chat_history()})
+    with session.exclusive_turn():
+        # Save the current chat first
+        session.save_chat_tree()
+        # Start a new chat
+        session.start_new_chat()
+        emit('new_chat_started', {'chat_id': session.get_chat_id()})
+        emit_stream(session, 'chat_history', session.stream.snapshot({'messages': session.get_chat_history()}))
 
 
 @socketio.on('delete_chat')
 def handle_delete_chat(data):
+    session = sessions.get(request.sid)
     chat_id = data.get('chat_id')
     logger.info(f"Deleting chat with ID: {chat_id}")
     try:
-        chatbot.delete_chat(chat_id)
+        session.delete_chat(chat_id)
         emit('chat_deleted', {'success': True, 'chat_id': chat_id})
     except Exception as e:
         logger.error(f"Error deleting chat: {e}")
         emit('chat_deleted', {'success': False, 'error': str(e)})
 
 
+def name_chat(session, chat_tree, sid, first_message):
+    """Name a new chat without delaying its first response; the name follows as its own event."""
+    try:
+        chat_name = session.generate_name(first_message, chat_tree)
+    except Exception as e:
+        logger.error(f"Error generating chat name: {e}")
+        return
+    socketio.emit('chat_name', {'chat_id': chat_tree.chat_id, 'name': chat_name}, to=sid)
+
 @socketio.on('chat')
+@requires('llm')
 def handle_chat(data):
+    session = sessions.get(request.sid)
     user_message = data.get('message', '')
     logger.info(f"Received chat message: {user_message}")
-    for updated_messages in chatbot.chat(user_message):
-        emit('chat_update', chatbot.get_full_chat_history())
-    emit('chat_update', {'messages': updated_messages, 'type': 'stop'})
+    # A new turn waits for the running one to stop and send its last update
+    with session.exclusive_turn():
+        updates = session.chat(user_message)
+        if session.start_naming():
+            socketio.start_background_task(name_chat, session, session.chat_tree, request.sid, user_message)
+        stream_response(session, updates)
     logger.info("Chat response completed")
 
 
 @socketio.on('update_model_config')
+@requires('llm')
 def handle_update_model_config(data):
     try:
         updated_config = chatbot.update_model_config(data)
-        emit('model_config_updated', {"success": True, "config": updated_config})
+        emit('model_config_updated', {"success": True, "config": updated_config, "status": chatbot.get_model_status()})
     except ValueError as e:
         emit('model_config_updated', {"success": False, "error": str(e)})
 
 @socketio.on('edit')
+@requires('llm')
 def handle_edit(data):
+    session = sessions.get(request.sid)
     level = data.get('level', 0)
     new_message = data.get('message', '')
     logger.info(f"Editing message at level {level}: {new_message}")
-    for updated_messages in chatbot.edit(level, new_message):
-        emit('chat_update', chatbot.get_full_chat_history())
-    emit('chat_update', {'messages': updated_messages, 'type': 'stop'})
+    with session.exclusive_turn():
+        stream_response(session, session.edit(level, new_message))
     logger.info("Edit completed")
 
 @socketio.on('change_active_child')
 def handle_change_active_child(data):
+    session = sessions.get(request.sid)
     level = data.get('level', 0)
     direction = data.get('direction', 'next')
     logger.info(f"Changing active child at level {level} in direction {direction}")
     
-    updated_messages = chatbot.change_active_child(level, direction)
-    emit('chat_update', {'messages': updated_messages, 'type': 'navigation'})
+    updated_messages = session.change_active_child(level, direction)
+    emit_stream(session, 'chat_update', session.stream.snapshot({'messages': updated_messages, 'type': 'navigation'}))
     logger.info("Navigation completed")
 
 
 @socketio.on('edit_chat_name')
 def handle_edit_chat_name(data):
+    session = sessions.get(request.sid)
     new_name = data.get('name', '')
     logger.info(f"Editing chat name to: {new_name}")
-    updated_history = chatbot.edit_chat_name(new_name)
-    chatbot.save_chat_tree()  # Save updated name and timestamp
-    emit('chat_update', updated_history)
+    updated_history = session.edit_chat_name(new_name)
+    session.save_chat_tree()  # Save updated name and timestamp
+    emit_stream(session, 'chat_update', session.stream.snapshot(updated_history))
 
 @socketio.on('regenerate')
+@requires('llm')
 def handle_regenerate(data):
+    session = sessions.get(request.sid)
     level = data.get('level', 0)
-    logger.info("Regenerating response")
-    for updated_messages in chatbot.regenerate(level):
-        emit('chat_update', chatbot.get_full_chat_history())
-    emit('chat_update', {'messages': updated_messages, 'type': 'stop'})
+    n = data.get('n', 1)
+    if not isinstance(n, int) or not 1 <= n <= MAX_REGENERATE_SAMPLES:
+        emit('error', {'message': f"n must be an integer in range 1..{MAX_REGENERATE_SAMPLES}"})
+        return
+    logger.info(f"Regenerating {n} response(s)")
+    with session.exclusive_turn():
+        stream_response(session, session.regenerate(level, n))
     logger.info("Regeneration completed")
 
 @socketio.on('continue')
+@requires('llm')
 def handle_continue():
+    session = sessions.get(request.sid)
     logger.info("Continuing chat")
-    for updated_messages in chatbot.continue_chat():
-        emit('chat_update', chatbot.get_full_chat_history())
-    emit('chat_update', {'messages': updated_messages, 'type': 'stop'})
+    with session.exclusive_turn():
+        stream_response(session, session.continue_chat())
     logger.info("Continuation completed")
 
 @socketio.on('reset_chat')
 def reset_chat():
+    session = sessions.get(request.sid)
     logger.info("Resetting chat")
-    chat_history = chatbot.reset_chat()
-    emit('chat_history', chatbot.get_full_chat_history())
+    with session.exclusive_turn():
+        session.reset_chat()
+        emit_stream(session, 'chat_history', session.stream.snapshot(session.get_full_chat_history()))
     logger.info("Chat reset completed")
 
 @app.route('/api/upload_audio', methods=['POST'])
@@ -169,22 +354,43 @@ def upload_audio():
     
     # Check the MIME type instead of file extension
     if file and file.content_type == 'audio/webm':
-        # Generate a random filename with .webm extension
-        import uuid
-        random_filename = f"{uuid.uuid4()}.webm"
-        
-        webm_path = os.path.join(app.config['UPLOAD_FOLDER'], random_filename)
-        file.save(webm_path)
-        logger.info(f"File uploaded successfully with generated name: {random_filename}")
+        # Name the file after its content, so a re-sent upload is stored only once
+        data = file.read()
+        filename = f"{audio_digest(data)}.webm"
+
+        webm_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        duplicate = os.path.exists(webm_path)
+        if duplicate:
+            os.utime(webm_path)  # restart its stale-upload clock
+            logger.info(f"Duplicate upload of {filename}")
+        else:
+            with open(webm_path, 'wb') as f:
+                f.write(data)
+            logger.info(f"File uploaded successfully as {filename}")
         return jsonify({
             'message': 'File uploaded successfully',
-            'filename': random_filename
+            'filename': filename,
+            'duplicate': duplicate
         }), 200
     else:
         logger.warning(f"Invalid file type: {file.content_type}")
         return jsonify({'error': 'Invalid file type - only audio/webm is supported'}), 400
         
 
+def transcribe_cached(worker, digest, read_audio):
+    """Transcribe audio with content hash `digest`; `read_audio()` is only called when the cache misses."""
+    start_time = time.perf_counter()
+    timings = {}
+
+    def run():
+        text, run_timings = worker.transcribe(read_audio())
+        timings.update(run_timings)
+        return text
+
+    text, cached = transcription_cache.get_or_transcribe(digest, worker.transcriber.model_id, run)
+    return text, dict(timings, cached=cached, total=time.perf_counter() - start_time)
+
+
 @app.route('/api/transcribe', methods=['POST'])
 def transcribe():
     logger.info("Received transcription request")
@@ -202,18 +408,74 @@ def transcribe():
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        transcribed_text = transcriber.transcribe_audio(filepath)
+        worker = readiness.get('whisper')
+    except WarmingUp as e:
+        return jsonify({'error': str(e), 'warming_up': True}), 503, {'Retry-After': '5'}
+
+    try:
+        # Uploads stay until remove_stale_uploads so a retried request still finds them. The cache key is
+        # hashed from the bytes here rather than taken from the client's filename
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        transcribed_text, timings = transcribe_cached(worker, audio_digest(data), lambda: data)
         logger.info(f"Audio transcribed successfully: {filename}")
         logger.debug(f"Transcribed text: {transcribed_text}")
         return jsonify({
             'message': 'Audio transcribed successfully',
             'filename': filename,
-            'text': transcribed_text
+            'text': transcribed_text,
+            'timings': timings
         }), 200
     except Exception as e:
         logger.error(f"Transcription failed: {str(e)}", exc_info=True)
         return jsonify({'error': f'Transcription failed: {str(e)}'}), 500
 
+@app.route('/api/transcribe_audio', methods=['POST'])
+def transcribe_audio():
+    """Upload and transcribe in one request; the audio is decoded in memory and never stored."""
+    logger.info("Received audio transcription request")
+    file = request.files.get('audio')
+    if file is None or file.filename == '':
+        logger.warning("No audio file in the request")
+        return jsonify({'error': 'No audio file in the request'}), 400
+    if not file.content_type.startswith('audio/'):
+        logger.warning(f"Invalid file type: {file.content_type}")
+        return jsonify({'error': 'Invalid file type - only audio is supported'}), 400
+
+    try:
+        worker = readiness.get('whisper')
+    except WarmingUp as e:
+        return jsonify({'error': str(e), 'warming_up': True}), 503, {'Retry-After': '5'}
+
+    try:
+        data = file.read()
+        transcribed_text, timings = transcribe_cached(worker, audio_digest(data), lambda: data)
+    except ValueError as e:
+        logger.warning(f"Could not decode audio: {e}")
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Transcription failed: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Transcription failed: {str(e)}'}), 500
+    logger.debug(f"Transcribed text: {transcribed_text}")
+    return jsonify({
+        'message': 'Audio transcribed successfully',
+        'text': transcribed_text,
+        'timings': timings
+    }), 200
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    status = readiness.status()
+    if status['ready']:
+        return jsonify(dict(status, status='ok')), 200
+    return jsonify(dict(status, status='warming_up')), 503
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    transcription = readiness.get('whisper').stats() if readiness.is_ready('whisper') else None
+    return jsonify(dict(chatbot.get_stats(), sessions=sessions.stats(), transcription=transcription,
+                        transcription_cache=transcription_cache.stats(), startup=readiness.status())), 200
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -234,4 +496,5 @@ if __name__ == '__main__':
     logger.info(f"Static folder path: {app.static_folder}")
     logger.info(f"Index file exists: {os.path.exists(os.path.join(app.static_folder, 'index.html'))}")
     logger.info("Starting the application")
-    socketio.run(app, debug=True)
\ No newline at end of file
+    # The reloader would run a second copy of the app, loading the models (or workers) twice
+    socketio.run(app, debug=True, use_reloader=False)
\ No newline at end of file
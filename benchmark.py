@@ -0,0 +1,845 @@
+"""
+Small benchmarks for the chatbot backend that run on CPU with a tiny model.
+
+Usage:
+    python benchmark.py decode --model HuggingFaceTB/SmolLM2-135M-Instruct --tokens 256
+    python benchmark.py threads --thread-counts 1 2 4 8 --cpu-dtype int8
+    python benchmark.py prefix --turns 20
+    python benchmark.py throughput --sessions 1 4 16
+    python benchmark.py workers --sessions 4 --kill
+    python benchmark.py payload --turns 20
+    python benchmark.py pacing --turns 5 --ack-ms 200
+    python benchmark.py tree --depth 10000 --width 100
+    python benchmark.py store --turns 200
+    python benchmark.py catalog --chats 2000
+    python benchmark.py naming --runs 3
+    python benchmark.py switch --other-model HuggingFaceTB/SmolLM2-360M-Instruct
+    python benchmark.py context --turns 100 --budget 1024
+    python benchmark.py prompt --messages 200
+    python benchmark.py regenerate --samples 4
+    python benchmark.py speculative --model HuggingFaceTB/SmolLM2-360M-Instruct --draft-model HuggingFaceTB/SmolLM2-135M-Instruct
+    python benchmark.py transcribe --audio recording.webm
+    python benchmark.py longform --audio recording.webm --minutes 5 --batch-sizes 1 4 8
+    python benchmark.py vad --audio recording.webm --silence 20
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import torch
+
+from chat_store import ChatStore
+from chatbot import CPU_DTYPES, ChatBot, ChatTree
+from inference_worker import RemoteChatBot
+from streaming import ChatStream, EmitPacer, STREAM_MODES, payload_size, text_size
+
+logger = logging.getLogger(__name__)
+
+
+def make_chatbot(args, workdir, remote=False):
+    """A ChatBot on the cpu backend, with the model and sampling settings from the command line."""
+    config_file = os.path.join(workdir, "model_config.json")
+    with open(config_file, "w") as f:
+        json.dump({
+            "model_name": args.model,
+            "generation_length": args.tokens,
+            "temperature": args.temperature,
+            "top_p": args.top_p,
+            "backend": "cpu",
+            "cpu_dtype": args.cpu_dtype,
+            "cpu_threads": args.threads or 0,
+        }, f)
+    if remote:
+        return RemoteChatBot(model_config_file=config_file, chat_dir=os.path.join(workdir, "chat_history"))
+    return ChatBot(model_config_file=config_file, chat_dir=os.path.join(workdir, "chat_history"))
+
+
+def legacy_generate(bot, messages, chunk_size=50):
+    """The previous generate_response loop: one `model.generate` call per chunk, no cache reuse."""
+    formatted_input = bot.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    input_ids = bot.tokenizer.encode(formatted_input, return_tensors='pt', add_special_tokens=False)
+    prompt_length = input_ids.shape[1]
+    remaining_tokens = bot.generation_length
+    start_time = time.perf_counter()
+    first_chunk_time = None
+    while remaining_tokens > 0:
+        tokens_to_generate = min(chunk_size, remaining_tokens)
+        with torch.inference_mode():
+            output = bot.model.generate(
+                input_ids,
+                max_new_tokens=tokens_to_generate,
+                temperature=bot.temperature,
+                top_p=bot.top_p,
+                do_sample=True,
+                pad_token_id=bot.tokenizer.eos_token_id,
+                use_cache=True,
+            )
+        if first_chunk_time is None:
+            first_chunk_time = time.perf_counter()
+        new_tokens = output[0, input_ids.shape[1]:]
+        if bot.tokenizer.eos_token_id in new_tokens.tolist():
+            input_ids = output
+            break
+        input_ids = output
+        remaining_tokens -= tokens_to_generate
+    total_time = time.perf_counter() - start_time
+    generated = input_ids.shape[1] - prompt_length
+    return {
+        "generated_tokens": generated,
+        "time_to_first_chunk": first_chunk_time - start_time,
+        "tokens_per_second": generated / total_time,
+        "total_time": total_time,
+    }
+
+
+def bench_decode(args):
+    """Compare the chunked re-prefill loop against the cached incremental decode loop."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        prompt = "Tell me a long story about a lighthouse keeper. " * args.prompt_repeat
+        bot.chat_tree.add_message("user", prompt)
+        bot.chat_tree.add_message("assistant", "")
+        messages = bot.get_chat_history()
+
+        for _ in range(args.runs):
+            legacy = legacy_generate(bot, messages)
+            print(
+                f"legacy  : {legacy['generated_tokens']:4d} tokens, "
+                f"first chunk {legacy['time_to_first_chunk'] * 1000:8.1f} ms, "
+                f"{legacy['tokens_per_second']:7.1f} tokens/s overall"
+            )
+
+            bot.chat_tree.current_node.content = ""
+            for _ in bot.generate_response(messages, chunk_size=1):
+                pass
+            stats = bot.last_generation_stats
+            print(
+                f"cached  : {stats['generated_tokens']:4d} tokens, "
+                f"first token {stats['time_to_first_token'] * 1000:8.1f} ms, "
+                f"{stats['tokens_per_second']:7.1f} tokens/s decode, "
+                f"{stats['generated_tokens'] / stats['total_time']:7.1f} tokens/s overall"
+            )
+
+
+def bench_prefix(args):
+    """Time to first token of regenerating the last reply, with and without the prefix cache."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        for turn in range(args.turns):
+            bot.chat_tree.add_message("user", f"Question {turn}: what happened next in the story? " * 4)
+            bot.chat_tree.add_message("assistant", "")
+            for _ in bot.generate_response(bot.get_chat_history()):
+                pass
+
+        for use_cache in (False, True):
+            if not use_cache:
+                bot.prefix_cache.clear()
+            for _ in bot.regenerate():
+                pass
+            stats = bot.last_generation_stats
+            print(
+                f"{'cached' if use_cache else 'cold  '}: prompt {stats['prompt_tokens']:5d} tokens, "
+                f"{stats['cached_prompt_tokens']:5d} from cache, "
+                f"first token {stats['time_to_first_token'] * 1000:8.1f} ms"
+            )
+        print(f"prefix cache: {bot.prefix_cache.stats()}")
+
+
+def bench_throughput(args):
+    """Aggregate tokens/s for N concurrent sessions, serialized vs continuously batched."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        for sessions in args.sessions:
+            for max_batch_size in (1, sessions):
+                bot.scheduler.max_batch_size = max_batch_size
+                requests = []
+                for i in range(sessions):
+                    messages = [{"role": "user", "content": f"Session {i}: tell me about the sea. " * 4}]
+                    formatted = bot.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                    input_ids = bot.tokenizer.encode(formatted, return_tensors='pt', add_special_tokens=False)
+                    requests.append(input_ids)
+
+                bot.prefix_cache.clear()
+                start_time = time.perf_counter()
+                # No EOS so every session generates exactly --tokens tokens
+                handles = [
+                    bot.scheduler.submit(input_ids, args.tokens, bot.temperature, bot.top_p, eos_token_ids=set())
+                    for input_ids in requests
+                ]
+                threads = [threading.Thread(target=lambda h=handle: list(h)) for handle in handles]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start_time
+
+                total_tokens = sum(len(handle.generated_ids) for handle in handles)
+                mean_ttft = sum(handle.stats['time_to_first_token'] for handle in handles) / sessions
+                print(
+                    f"{sessions:3d} sessions, max batch {max_batch_size:3d}: "
+                    f"{total_tokens / elapsed:8.1f} tokens/s aggregate, "
+                    f"mean time to first token {mean_ttft * 1000:8.1f} ms"
+                )
+
+
+def probe_latency(seconds, interval=0.005):
+    """How late a thread that wakes every `interval` seconds runs, as web handlers would, in ms."""
+    delays = []
+    end_time = time.perf_counter() + seconds
+    while time.perf_counter() < end_time:
+        start_time = time.perf_counter()
+        time.sleep(interval)
+        json.dumps({"messages": [{"role": "assistant", "content": "x" * 200}] * 20})
+        delays.append((time.perf_counter() - start_time - interval) * 1000)
+    delays.sort()
+    return delays[len(delays) // 2], delays[int(len(delays) * 0.99)], delays[-1]
+
+
+def bench_workers(args):
+    """Responsiveness of the web process while generating, with the model in this process vs in a worker process."""
+    for remote in (False, True):
+        label = "worker process" if remote else "in-process"
+        with tempfile.TemporaryDirectory() as workdir:
+            bot = make_chatbot(args, workdir, remote=remote)
+            p50, p99, worst = probe_latency(args.probe_seconds)
+            print(f"{label:14s} idle:       probe delay p50 {p50:6.2f} ms, p99 {p99:6.2f} ms, max {worst:6.2f} ms")
+
+            def generate(session):
+                tree = ChatTree()
+                tree.add_message("user", f"Session {session}: tell me about the sea. " * 4)
+                tree.add_message("assistant", "")
+                prompt = bot.prompt_builder.encode(tree.get_chat_history(), bot.current_model)
+                request = bot.scheduler.submit(torch.tensor([prompt]), args.tokens, bot.temperature, bot.top_p,
+                                               bot.current_model.eos_token_ids, model=bot.current_model)
+                try:
+                    tokens.append(len(list(request)))
+                except RuntimeError as e:
+                    errors.append(str(e))
+
+            tokens, errors = [], []
+            start_time = time.perf_counter()
+            threads = [threading.Thread(target=generate, args=(i,)) for i in range(args.sessions)]
+            for thread in threads:
+                thread.start()
+            if remote and args.kill:
+                time.sleep(args.probe_seconds / 4)
+                bot.scheduler.workers[0].process.kill()
+            p50, p99, worst = probe_latency(args.probe_seconds)
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start_time
+            print(
+                f"{label:14s} generating: probe delay p50 {p50:6.2f} ms, p99 {p99:6.2f} ms, max {worst:6.2f} ms, "
+                f"{sum(tokens) / elapsed:7.1f} tokens/s, {len(errors)} failed"
+            )
+            if remote:
+                if args.kill:
+                    restart_time = time.perf_counter()
+                    bot.scheduler.wait_ready()
+                    while bot.scheduler.workers[0].state != "ready":
+                        time.sleep(0.05)
+                    print(f"{label:14s} worker restarted and ready again {time.perf_counter() - restart_time:.1f}s after the failed requests")
+                bot.scheduler.close()
+
+
+def bench_threads(args):
+    """Decode tokens/s of the cpu backend across intra-op thread counts."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        bot.chat_tree.add_message("user", "Tell me a long story about a lighthouse keeper. " * args.prompt_repeat)
+        bot.chat_tree.add_message("assistant", "")
+        messages = bot.get_chat_history()
+        for threads in args.thread_counts:
+            torch.set_num_threads(threads)
+            for _ in range(args.runs):
+                bot.chat_tree.current_node.content = ""
+                bot.prefix_cache.clear()
+                for _ in bot.generate_response(messages):
+                    pass
+                stats = bot.last_generation_stats
+                print(
+                    f"{threads:3d} threads ({args.cpu_dtype}): {stats['generated_tokens']:4d} tokens, "
+                    f"prefill {stats['time_to_first_token'] * 1000:8.1f} ms, "
+                    f"{stats['tokens_per_second']:7.1f} tokens/s decode"
+                )
+
+
+def bench_payload(args):
+    """Socket payload bytes per turn of the full-history and delta stream protocols."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        streams = {mode: ChatStream(mode) for mode in STREAM_MODES}
+        for turn in range(args.turns):
+            for stream in streams.values():
+                stream.begin_turn()
+            bot.chat_tree.add_message("user", f"Question {turn}: and then what happened?")
+            bot.chat_tree.add_message("assistant", "")
+            for _ in bot.generate_response(bot.get_chat_history(), chunk_size=args.chunk_size):
+                for stream in streams.values():
+                    stream.sent(payload_size(stream.update(bot.get_full_chat_history())[1]))
+            for stream in streams.values():
+                stream.sent(payload_size(stream.update(bot.get_full_chat_history(), type='stop')[1]))
+            print(f"turn {turn:3d}: " + ", ".join(
+                f"{mode} {stream.turn_events:4d} events {stream.turn_bytes:9d} bytes" for mode, stream in streams.items()
+            ))
+
+
+def bench_pacing(args):
+    """First visible text and emit rate of fixed token chunks vs emits paced by time and size."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        for label, chunk_size in ((f"chunks of {args.chunk_size}", args.chunk_size), ("paced", 1)):
+            for turn in range(args.turns):
+                stream = ChatStream('delta', EmitPacer(interval_ms=args.interval_ms, max_chars=args.max_chars))
+                bot.chat_tree.add_message("user", f"Question {turn}: and then what happened?")
+                bot.chat_tree.add_message("assistant", "")
+                stream.begin_turn(bot.get_chat_history())
+                for messages in bot.generate_response(bot.get_chat_history(), chunk_size=chunk_size):
+                    # Fixed chunks emit on every yield; the pacer decides for itself
+                    if chunk_size > 1:
+                        stream.pacer.emitted(text_size(messages))
+                    elif stream.due(messages):
+                        # A client acknowledging each update after --ack-ms
+                        threading.Timer(args.ack_ms / 1000, stream.pacer.acked).start()
+                    else:
+                        continue
+                    stream.sent(payload_size(stream.update(bot.get_full_chat_history())[1]))
+                final = bot.get_full_chat_history()
+                stream.sent(payload_size(stream.update(final, type='stop')[1]))
+                stats = stream.end_turn(final['messages'])
+                first_visible = f"{stats['first_visible_ms']:7.1f} ms" if stats['first_visible_ms'] is not None else "  never"
+                print(
+                    f"{label:14s} turn {turn:2d}: first text visible after {first_visible}, "
+                    f"{stats['emits']:4d} emits, {stats['emits_per_second']:6.1f} emits/s, "
+                    f"{stats['bytes']:7d} bytes, {stats['backoffs']} backoffs"
+                )
+
+
+def legacy_chat_history(tree):
+    """The previous ChatTree.get_chat_history: list.insert(0) and siblings.index() per level."""
+    history = []
+    node = tree.current_node
+    while node:
+        if node.parent:
+            siblings = node.parent.children
+            sibling_info = (siblings.index(node) + 1, len(siblings))
+        else:
+            sibling_info = (1, 1)
+        history.insert(0, {"role": node.role, "content": node.content, "sibling_info": sibling_info})
+        node = node.parent
+    return history
+
+
+def bench_tree(args):
+    """Cost of one streamed chunk's history retrieval on a deep tree with wide regenerate fan-out."""
+    tree = ChatTree()
+    for i in range(args.depth // 2):
+        tree.add_message("user", f"question {i}")
+        if i % 100 == 0:
+            # Regenerate fan-out along the path, with the active branch added last
+            for j in range(args.width - 1):
+                tree.current_node.add_child(type(tree.current_node)("assistant", f"alternative {j}"))
+        tree.add_message("assistant", f"answer {i}")
+
+    for name, get_history in (("legacy", legacy_chat_history), ("cached", ChatTree.get_chat_history)):
+        start_time = time.perf_counter()
+        for chunk in range(args.chunks):
+            tree.current_node.content += " token"
+            history = get_history(tree)
+        elapsed = time.perf_counter() - start_time
+        print(f"{name}: {len(history)} messages, {elapsed / args.chunks * 1000:8.3f} ms per chunk")
+
+    start_time = time.perf_counter()
+    path = tree._get_current_node_path()
+    print(f"current node path of length {len(path)} in {(time.perf_counter() - start_time) * 1000:.3f} ms")
+
+
+def bench_store(args):
+    """Time and bytes of saving after every turn: full JSON rewrite vs journal append."""
+    reply = "word " * args.tokens
+    with tempfile.TemporaryDirectory() as workdir:
+        store = ChatStore(workdir, ChatTree)
+        tree = ChatTree()
+        legacy_time = journal_time = 0.0
+        legacy_bytes = journal_bytes = 0
+        for turn in range(args.turns):
+            tree.add_message("user", f"Question {turn}: and then what happened?")
+            tree.append_content(tree.add_message("assistant", ""), reply)
+
+            start_time = time.perf_counter()
+            legacy_path = os.path.join(workdir, "legacy.json")
+            with open(legacy_path, 'w') as f:
+                json.dump(tree.to_dict(), f, indent=2)
+            legacy_time += time.perf_counter() - start_time
+            legacy_bytes += os.path.getsize(legacy_path)
+
+            sizes = [os.path.getsize(path) if os.path.exists(path) else 0
+                     for path in (store.snapshot_path(tree.chat_id), store.journal_path(tree.chat_id))]
+            start_time = time.perf_counter()
+            store.save(tree)
+            journal_time += time.perf_counter() - start_time
+            new_sizes = [os.path.getsize(path) if os.path.exists(path) else 0
+                         for path in (store.snapshot_path(tree.chat_id), store.journal_path(tree.chat_id))]
+            # A compaction rewrites the snapshot, an append only grows the journal
+            journal_bytes += new_sizes[0] if new_sizes[0] != sizes[0] else new_sizes[1] - sizes[1]
+
+        print(f"full rewrite: {legacy_time / args.turns * 1000:8.3f} ms, {legacy_bytes / args.turns:10.0f} bytes per save")
+        print(f"journal     : {journal_time / args.turns * 1000:8.3f} ms, {journal_bytes / args.turns:10.0f} bytes per save "
+              f"({store.compactions} compactions)")
+
+        start_time = time.perf_counter()
+        loaded = store.load(tree.chat_id)
+        print(f"load with replay: {(time.perf_counter() - start_time) * 1000:.1f} ms, "
+              f"{len(loaded.get_chat_history())} messages")
+
+
+def legacy_list_chats(chat_dir):
+    """The previous list_chat_histories: json.load every chat file."""
+    chat_info = []
+    for filename in [f for f in os.listdir(chat_dir) if f.endswith('.json')]:
+        with open(os.path.join(chat_dir, filename), 'r') as f:
+            data = json.load(f)
+        chat_info.append({'id': os.path.splitext(filename)[0], 'name': data.get('chat_name'), 'last_modified': data.get('last_modified')})
+    return chat_info
+
+
+def bench_catalog(args):
+    """Sidebar listing time as the number of saved chats grows."""
+    with tempfile.TemporaryDirectory() as workdir:
+        store = ChatStore(workdir, ChatTree)
+        for i in range(args.chats):
+            tree = ChatTree()
+            tree.set_chat_name(f"chat {i}")
+            for turn in range(args.turns):
+                tree.add_message("user", f"Question {turn}")
+                tree.add_message("assistant", "word " * 50)
+            store.save(tree)
+
+        for name, list_chats in (
+            ("legacy", lambda: legacy_list_chats(workdir)),
+            ("catalog", lambda: store.list_chats(0, args.page_size)),
+        ):
+            start_time = time.perf_counter()
+            chats = list_chats()
+            print(f"{name:8s}: {len(chats):5d} chats in {(time.perf_counter() - start_time) * 1000:8.2f} ms")
+
+        start_time = time.perf_counter()
+        store.rebuild_catalog()
+        print(f"catalog rebuild from {args.chats} files: {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+
+def bench_naming(args):
+    """Time to the first response chunk of a new chat, naming it first vs in the background."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        message = "Can you explain how lighthouses were kept running before electricity?"
+        for _ in range(args.runs):
+            for mode in ("blocking", "background"):
+                bot.start_new_chat()
+                bot.prefix_cache.clear()
+                start_time = time.perf_counter()
+                naming = None
+                if mode == "blocking":
+                    bot.generate_name(message)
+                updates = bot.chat(message)
+                if mode == "background" and bot.start_naming():
+                    naming = threading.Thread(target=bot.generate_name, args=(message, bot.chat_tree))
+                    naming.start()
+                next(updates)
+                first_token = time.perf_counter() - start_time
+                for _ in updates:
+                    pass
+                if naming:
+                    naming.join()
+                print(
+                    f"{mode:10s}: first chunk {first_token * 1000:8.1f} ms, "
+                    f"name {bot.get_chat_name()!r} after {(time.perf_counter() - start_time) * 1000:8.1f} ms"
+                )
+
+
+def bench_switch(args):
+    """Token gaps while another model loads in the background, and the cost of switching back."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        switched = threading.Event()
+        bot.on_model_switch = lambda model_name: switched.set()
+
+        for target in (args.other_model, args.model):
+            switched.clear()
+            bot.chat_tree.add_message("user", "Tell me a long story about the sea.")
+            bot.chat_tree.add_message("assistant", "")
+            token_times = []
+
+            def stream():
+                for _ in bot.generate_response(bot.get_chat_history(), chunk_size=1):
+                    token_times.append(time.perf_counter())
+
+            streamer = threading.Thread(target=stream)
+            streamer.start()
+            while not token_times:
+                time.sleep(0.001)
+            start_time = time.perf_counter()
+            bot.model_name = target
+            bot.model_pool.load_async(target, on_ready=bot._switch_model)
+            switched.wait()
+            switch_time = time.perf_counter() - start_time
+            streamer.join()
+            gaps = [b - a for a, b in zip(token_times, token_times[1:]) if b > start_time]
+            print(
+                f"switch to {target}: {switch_time * 1000:8.1f} ms, "
+                f"max token gap while loading {max(gaps, default=0) * 1000:8.1f} ms over {len(gaps)} tokens"
+            )
+        print(json.dumps(bot.get_model_status(), indent=2))
+
+
+def bench_context(args):
+    """Prompt size and prefix cache reuse per turn of a long conversation under a prefill budget."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        bot.context_window.budget_tokens = args.budget
+        cached = prompt = 0
+        for turn in range(args.turns):
+            start_time = time.perf_counter()
+            for _ in bot.chat(f"Question {turn}: what happened next in the story? " * 4):
+                pass
+            stats = bot.last_generation_stats
+            cached += stats['cached_prompt_tokens']
+            prompt += stats['prompt_tokens']
+            if turn % args.every == 0 or turn == args.turns - 1:
+                print(
+                    f"turn {turn:4d}: {stats['prompt_tokens']:6d} prompt tokens "
+                    f"({stats['cached_prompt_tokens']:6d} cached), {stats['prompt_messages']:4d} messages, "
+                    f"{stats['dropped_messages']:4d} dropped, time to first token {stats['time_to_first_token'] * 1000:7.1f} ms, "
+                    f"turn {(time.perf_counter() - start_time) * 1000:7.1f} ms"
+                )
+        print(f"prefix cache covered {cached / prompt:.1%} of all prompt tokens")
+
+
+def bench_prompt(args):
+    """Prompt tokenization time per turn: full template render and encode vs memoized per-node segments."""
+    from prompt_builder import PromptBuilder
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        current = bot.current_model
+        builder = PromptBuilder()
+        timings = {"full": [], "segments": []}
+        for turn in range(args.messages // 2):
+            bot.chat_tree.add_message("user", f"Question {turn}: what happened next in the story? " * 4)
+            bot.chat_tree.add_message("assistant", f"Answer {turn}: the lighthouse keeper walked on. " * 12)
+            path = bot.chat_tree.get_active_path()
+            messages = bot.get_chat_history()
+
+            start_time = time.perf_counter()
+            text = current.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            full = current.tokenizer.encode(text, add_special_tokens=False)
+            timings["full"].append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            ids = builder.build(path, current)
+            timings["segments"].append(time.perf_counter() - start_time)
+            assert ids == full, f"segments differ from a full encode at turn {turn}"
+
+        for name, times in timings.items():
+            print(
+                f"{name:8s}: first turn {times[0] * 1000:7.2f} ms, last turn {times[-1] * 1000:7.2f} ms, "
+                f"mean {sum(times) / len(times) * 1000:7.2f} ms over {len(times)} turns"
+            )
+        print(json.dumps(builder.stats(), indent=2))
+
+
+def bench_regenerate(args):
+    """Wall time of sampling --samples alternatives with one regenerate vs one regenerate per alternative."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        # No EOS so every sample generates exactly --tokens tokens
+        bot.current_model.eos_token_ids = set()
+        for _ in bot.chat("Tell me a long story about a lighthouse keeper. " * args.prompt_repeat):
+            pass
+
+        for run in range(args.runs):
+            bot.prefix_cache.clear()
+            start_time = time.perf_counter()
+            for _ in range(args.samples):
+                for _ in bot.regenerate(0):
+                    pass
+            sequential = time.perf_counter() - start_time
+
+            bot.prefix_cache.clear()
+            start_time = time.perf_counter()
+            for _ in bot.regenerate(0, n=args.samples):
+                pass
+            grouped = time.perf_counter() - start_time
+            siblings = bot.chat_tree.current_node.get_sibling_info()[1]
+            print(
+                f"{args.samples} alternatives: one at a time {sequential * 1000:8.1f} ms, "
+                f"together {grouped * 1000:8.1f} ms ({sequential / grouped:.2f}x), {siblings} siblings"
+            )
+
+
+def bench_speculative(args):
+    """Decode tokens/s without a draft model and with one proposing each --draft-tokens count, plus its acceptance rate."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = make_chatbot(args, workdir)
+        bot.load_draft(args.draft_model)
+        bot.chat_tree.add_message("user", "Tell me a long story about a lighthouse keeper.")
+        bot.chat_tree.add_message("assistant", "")
+        messages = bot.get_chat_history()
+
+        outputs = {}
+        for draft_tokens in [0] + args.draft_tokens:
+            bot.draft_model_name = args.draft_model if draft_tokens else None
+            bot.draft_tokens = draft_tokens or 1
+            for _ in range(args.runs):
+                bot.chat_tree.current_node.content = ""
+                for _ in bot.generate_response(messages, chunk_size=1):
+                    pass
+                stats = bot.last_generation_stats
+                acceptance = stats['draft_acceptance_rate']
+                print(
+                    f"draft tokens {draft_tokens:2d}: {stats['generated_tokens']:4d} tokens, "
+                    f"{stats['tokens_per_second']:7.1f} tokens/s decode, "
+                    f"acceptance rate {acceptance if acceptance is not None else float('nan'):.2f}"
+                )
+            outputs[draft_tokens] = bot.chat_tree.current_node.content
+        if args.temperature == 0:
+            # Greedy speculative decoding must reproduce plain greedy decoding exactly
+            print("greedy outputs identical:", all(text == outputs[0] for text in outputs.values()))
+        print(json.dumps(bot.scheduler.stats(), indent=2))
+
+
+def legacy_load_audio(audio_path):
+    """The previous Transcriber input path: pydub WebM -> temporary WAV, then librosa.load resampling."""
+    import librosa
+    from pydub import AudioSegment
+    wav_path = audio_path.rsplit('.', 1)[0] + '.wav'
+    AudioSegment.from_file(audio_path).export(wav_path, format="wav")
+    try:
+        audio, _ = librosa.load(wav_path, sr=16000)
+    finally:
+        os.remove(wav_path)
+    return audio
+
+
+def bench_transcribe(args):
+    """Audio decoding through temporary files vs in memory, and per-stage transcription timings."""
+    from transcribe import Transcriber, decode_audio
+
+    with open(args.audio, 'rb') as f:
+        data = f.read()
+    for name, load in (("legacy", lambda: legacy_load_audio(args.audio)), ("memory", lambda: decode_audio(data))):
+        start_time = time.perf_counter()
+        for _ in range(args.runs):
+            audio = load()
+        print(f"{name}: {len(audio) / 16000:.1f}s of audio decoded in {(time.perf_counter() - start_time) / args.runs * 1000:8.1f} ms")
+
+    transcriber = Transcriber(args.whisper_model)
+    for _ in range(args.runs):
+        _, timings = transcriber.transcribe_bytes(data)
+        print(", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in timings.items() if stage != "audio_seconds"))
+
+    # The same recording uploaded by several clients at once, inline vs through the batching worker
+    from transcription_worker import TranscriptionWorker
+    worker = TranscriptionWorker(transcriber, max_batch_size=args.concurrency)
+    for name, transcribe in (("inline", transcriber.transcribe_bytes), ("worker", worker.transcribe)):
+        threads = [threading.Thread(target=transcribe, args=(data,)) for _ in range(args.concurrency)]
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"{name}: {args.concurrency} concurrent transcriptions in {time.perf_counter() - start_time:.2f}s")
+    print(json.dumps(worker.stats(), indent=2))
+
+
+def wav_bytes(audio, sampling_rate=16000):
+    """Encode float samples as a 16-bit mono WAV file in memory."""
+    import io
+    import wave
+    import numpy as np
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sampling_rate)
+        f.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def bench_longform(args):
+    """Real-time factor of long-form transcription on a clip repeated to `--minutes`, per window batch size."""
+    import numpy as np
+    from transcribe import Transcriber, decode_audio
+
+    with open(args.audio, 'rb') as f:
+        audio = decode_audio(f.read())
+    repeats = int(np.ceil(args.minutes * 60 * 16000 / len(audio)))
+    data = wav_bytes(np.tile(audio, repeats)[:int(args.minutes * 60 * 16000)])
+
+    transcriber = Transcriber(args.whisper_model)
+    for batch_size in args.batch_sizes:
+        transcriber.batch_size = batch_size
+        text, timings = transcriber.transcribe_bytes(data)
+        print(
+            f"batch size {batch_size:3d}: {timings['audio_seconds']:.0f}s of audio in {timings['windows']} windows, "
+            f"{timings['total']:.1f}s total, generate {timings['generate']:.1f}s, "
+            f"real-time factor {timings['real_time_factor']:.3f}, {len(text.split())} words"
+        )
+
+
+def bench_vad(args):
+    """Transcription with and without energy VAD on a recording padded with `--silence` seconds on each side."""
+    import numpy as np
+    from transcribe import Transcriber, decode_audio
+    from vad import EnergyVAD
+
+    with open(args.audio, 'rb') as f:
+        audio = decode_audio(f.read())
+    silence = np.zeros(int(args.silence * 16000), dtype=np.float32)
+    clips = {"padded": wav_bytes(np.concatenate([silence, audio, silence])), "silence": wav_bytes(np.concatenate([silence, silence]))}
+
+    transcriber = Transcriber(args.whisper_model)
+    transcriber.transcribe_bytes(clips["padded"])  # warm up, and give the VAD a per-window cost estimate
+    for name, data in clips.items():
+        totals = {}
+        for vad in (None, EnergyVAD()):
+            transcriber.vad = vad
+            text, timings = transcriber.transcribe_bytes(data)
+            label = "vad" if vad else "off"
+            totals[label] = timings["total"]
+            print(
+                f"{name:8s} {label}: {timings['total']:.2f}s for {timings['audio_seconds']:.1f}s of audio, {timings['windows']} windows, "
+                f"removed {timings.get('vad_removed_seconds', 0.0):.1f}s, estimated saving {timings.get('vad_saved_seconds', 0.0):.2f}s, "
+                f"{len(text.split())} words"
+            )
+        print(f"{name:8s} measured saving: {totals['off'] - totals['vad']:.2f}s")
+    print(json.dumps(transcriber.vad_stats(), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    decode = subparsers.add_parser("decode", help="time to first token and tokens/s of generate_response")
+    decode.add_argument("--prompt-repeat", type=int, default=8)
+    decode.add_argument("--runs", type=int, default=3)
+    decode.set_defaults(func=bench_decode)
+
+    prefix = subparsers.add_parser("prefix", help="regenerate latency with the prefix KV cache")
+    prefix.add_argument("--turns", type=int, default=20)
+    prefix.set_defaults(func=bench_prefix)
+
+    throughput = subparsers.add_parser("throughput", help="continuous batching across concurrent sessions")
+    throughput.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16])
+    throughput.set_defaults(func=bench_throughput)
+
+    workers = subparsers.add_parser("workers", help="web process responsiveness during generation, in-process vs worker process")
+    workers.add_argument("--sessions", type=int, default=4)
+    workers.add_argument("--probe-seconds", type=float, default=2)
+    workers.add_argument("--kill", action="store_true", help="kill the worker mid-generation and time its restart")
+    workers.set_defaults(func=bench_workers)
+
+    payload = subparsers.add_parser("payload", help="bytes on the wire per turn, full history vs deltas")
+    payload.add_argument("--turns", type=int, default=20)
+    payload.add_argument("--chunk-size", type=int, default=8)
+    payload.set_defaults(func=bench_payload)
+
+    pacing = subparsers.add_parser("pacing", help="first visible text and emits/s, fixed token chunks vs paced emits")
+    pacing.add_argument("--turns", type=int, default=5)
+    pacing.add_argument("--chunk-size", type=int, default=50)
+    pacing.add_argument("--interval-ms", type=int, default=50)
+    pacing.add_argument("--max-chars", type=int, default=256)
+    pacing.add_argument("--ack-ms", type=int, default=5, help="simulated client acknowledgement delay")
+    pacing.set_defaults(func=bench_pacing)
+
+    threads = subparsers.add_parser("threads", help="cpu backend decode tokens/s across thread counts")
+    threads.add_argument("--thread-counts", type=int, nargs="+", default=[1, 2, 4, 8])
+    threads.add_argument("--prompt-repeat", type=int, default=8)
+    threads.add_argument("--runs", type=int, default=2)
+    threads.set_defaults(func=bench_threads)
+
+    tree = subparsers.add_parser("tree", help="ChatTree history retrieval on synthetic deep/wide trees")
+    tree.add_argument("--depth", type=int, default=10000)
+    tree.add_argument("--width", type=int, default=100)
+    tree.add_argument("--chunks", type=int, default=200)
+    tree.set_defaults(func=bench_tree)
+
+    store = subparsers.add_parser("store", help="chat save cost, full JSON rewrite vs operation journal")
+    store.add_argument("--turns", type=int, default=200)
+    store.set_defaults(func=bench_store)
+
+    catalog = subparsers.add_parser("catalog", help="listing saved chats, file scan vs SQLite catalog")
+    catalog.add_argument("--chats", type=int, default=2000)
+    catalog.add_argument("--turns", type=int, default=5)
+    catalog.add_argument("--page-size", type=int, default=50)
+    catalog.set_defaults(func=bench_catalog)
+
+    naming = subparsers.add_parser("naming", help="first response latency with background chat naming")
+    naming.add_argument("--runs", type=int, default=3)
+    naming.set_defaults(func=bench_naming)
+
+    switch = subparsers.add_parser("switch", help="serving while a model loads in the pool, and switching back")
+    switch.add_argument("--other-model", default="HuggingFaceTB/SmolLM2-360M-Instruct")
+    switch.set_defaults(func=bench_switch)
+
+    context = subparsers.add_parser("context", help="prefill budget and prompt stability over a long conversation")
+    context.add_argument("--turns", type=int, default=100)
+    context.add_argument("--budget", type=int, default=1024, help="context_budget_tokens, 0 for no limit")
+    context.add_argument("--every", type=int, default=10, help="print every n-th turn")
+    context.set_defaults(func=bench_context)
+
+    prompt = subparsers.add_parser("prompt", help="prompt tokenization per turn with memoized per-node segments")
+    prompt.add_argument("--messages", type=int, default=200)
+    prompt.set_defaults(func=bench_prompt)
+
+    regenerate = subparsers.add_parser("regenerate", help="several alternatives from one prefill vs one regenerate each")
+    regenerate.add_argument("--samples", type=int, default=4)
+    regenerate.add_argument("--prompt-repeat", type=int, default=32)
+    regenerate.add_argument("--runs", type=int, default=2)
+    regenerate.set_defaults(func=bench_regenerate)
+
+    speculative = subparsers.add_parser("speculative", help="speculative decoding with a small draft model")
+    speculative.add_argument("--draft-model", default="HuggingFaceTB/SmolLM2-135M-Instruct")
+    speculative.add_argument("--draft-tokens", type=int, nargs="+", default=[2, 4, 8])
+    speculative.add_argument("--runs", type=int, default=2)
+    speculative.set_defaults(func=bench_speculative)
+
+    transcribe = subparsers.add_parser("transcribe", help="audio decoding and Whisper stage timings")
+    transcribe.add_argument("--audio", required=True, help="recorded audio file, e.g. a WebM from the browser")
+    transcribe.add_argument("--whisper-model", default="openai/whisper-base")
+    transcribe.add_argument("--runs", type=int, default=3)
+    transcribe.add_argument("--concurrency", type=int, default=8)
+    transcribe.set_defaults(func=bench_transcribe)
+
+    longform = subparsers.add_parser("longform", help="real-time factor of windowed, batched long-form transcription")
+    longform.add_argument("--audio", required=True, help="recorded audio file, repeated to fill --minutes")
+    longform.add_argument("--minutes", type=float, default=5)
+    longform.add_argument("--whisper-model", default="openai/whisper-base")
+    longform.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    longform.set_defaults(func=bench_longform)
+
+    vad = subparsers.add_parser("vad", help="audio removed and latency saved by energy VAD")
+    vad.add_argument("--audio", required=True, help="recorded audio file with speech")
+    vad.add_argument("--silence", type=float, default=20, help="seconds of silence added before and after the recording")
+    vad.add_argument("--whisper-model", default="openai/whisper-base")
+    vad.set_defaults(func=bench_vad)
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--model", default="HuggingFaceTB/SmolLM2-135M-Instruct")
+        subparser.add_argument("--tokens", type=int, default=256, help="generation_length")
+        subparser.add_argument("--temperature", type=float, default=0.7)
+        subparser.add_argument("--top-p", type=float, default=0.95)
+        subparser.add_argument("--threads", type=int, default=None, help="cpu_threads of the cpu backend")
+        subparser.add_argument("--cpu-dtype", choices=CPU_DTYPES, default="fp32")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
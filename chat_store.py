@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ChatStore:
+    """
+    Chat trees on disk as a snapshot plus an append-only journal.
+
+    `{id}.json` holds a full snapshot of the tree and `{id}.log` one JSON line per
+    operation recorded since, so a save only appends what changed. Once the journal
+    reaches `compact_every` operations it is folded into a new snapshot, which is
+    written to a temporary file and renamed over the old one. Loading reads the
+    snapshot and replays the journal on top of it.
+
+    Chat names and modification times are also kept in a SQLite catalog in the chat
+    directory, so listing chats does not open every file. The catalog is updated on
+    save, delete and rename and is reconciled with the files on disk at startup.
+    """
+
+    CATALOG_FILE = "catalog.sqlite3"
+
+    def __init__(self, chat_dir, tree_class, compact_every=500):
+        self.chat_dir = chat_dir
+        self.tree_class = tree_class
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._saved_seq = {}  # chat_id -> journal_seq of the last operation on disk
+        self._journal_length = {}  # chat_id -> operations in the journal
+        self.compactions = 0
+        self._catalog = self._open_catalog()
+        self.sync_catalog()
+
+    def snapshot_path(self, chat_id):
+        return os.path.join(self.chat_dir, f"{chat_id}.json")
+
+    def journal_path(self, chat_id):
+        return os.path.join(self.chat_dir, f"{chat_id}.log")
+
+    def save(self, chat_tree):
+        chat_id = chat_tree.chat_id
+        ops = chat_tree.take_pending_ops()
+        base_seq = ops[0]["seq"] - 1 if ops else chat_tree.journal_seq
+        with self._lock:
+            try:
+                # A tree that did not start from what is on disk (another copy of the
+                # chat was saved in between, or a save failed) is written out in full
+                if self._saved_seq.get(chat_id) != base_seq or not os.path.exists(self.snapshot_path(chat_id)):
+                    self._compact(chat_tree)
+                elif self._journal_length.get(chat_id, 0) + len(ops) >= self.compact_every:
+                    self._compact(chat_tree)
+                elif ops:
+                    with open(self.journal_path(chat_id), 'a') as f:
+                        f.write("".join(json.dumps(op) + "\n" for op in ops))
+                    self._journal_length[chat_id] = self._journal_length.get(chat_id, 0) + len(ops)
+                    self._saved_seq[chat_id] = ops[-1]["seq"]
+                    self._index(chat_id, chat_tree.chat_name, chat_tree.last_modified)
+                    logger.debug(f"Appended {len(ops)} operations to the journal of chat {chat_id}")
+            except Exception:
+                self._saved_seq.pop(chat_id, None)
+                raise
+        return self.snapshot_path(chat_id)
+
+    def load(self, chat_id):
+        snapshot_path = self.snapshot_path(chat_id)
+        if not os.path.exists(snapshot_path):
+            raise FileNotFoundError(f"No chat history found for ID: {chat_id}")
+        with open(snapshot_path, 'r') as f:
+            chat_tree = self.tree_class.from_dict(json.load(f))
+
+        replayed, torn = self._replay(chat_tree)
+        with self._lock:
+            self._saved_seq[chat_id] = chat_tree.journal_seq
+            self._journal_length[chat_id] = replayed
+            if torn or replayed >= self.compact_every:
+                self._compact(chat_tree)
+        logger.info(f"Loaded chat {chat_id}: snapshot plus {replayed} journal operations")
+        return chat_tree
+
+    def delete(self, chat_id):
+        snapshot_path = self.snapshot_path(chat_id)
+        if not os.path.exists(snapshot_path):
+            raise FileNotFoundError(f"No chat history found for ID: {chat_id}")
+        with self._lock:
+            os.remove(snapshot_path)
+            if os.path.exists(self.journal_path(chat_id)):
+                os.remove(self.journal_path(chat_id))
+            self._saved_seq.pop(chat_id, None)
+            self._journal_length.pop(chat_id, None)
+            with self._catalog:
+                self._catalog.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+        logger.info(f"Deleted chat {chat_id}")
+
+    def rename(self, chat_tree):
+        """
+        Bring the catalog entry of a saved chat up to date with a name set since its
+        last save. The rename itself reaches the journal with the next save.
+        """
+        with self._lock, self._catalog:
+            self._catalog.execute(
+                "UPDATE chats SET name = ?, last_modified = ? WHERE id = ?",
+                (chat_tree.chat_name, chat_tree.last_modified, chat_tree.chat_id),
+            )
+
+    def list_chats(self, offset=0, limit=None):
+        """Saved chats, most recently modified first; `limit=None` returns all of them."""
+        with self._lock:
+            rows = self._catalog.execute(
+                "SELECT id, name, last_modified FROM chats ORDER BY last_modified DESC, id LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        return [{'id': chat_id, 'name': name, 'last_modified': last_modified} for chat_id, name, last_modified in rows]
+
+    def count_chats(self):
+        with self._lock:
+            return self._catalog.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+    def sync_catalog(self):
+        """Index chat files missing from the catalog and drop entries whose file is gone."""
+        on_disk = {os.path.splitext(f)[0] for f in os.listdir(self.chat_dir) if f.endswith('.json')}
+        with self._lock:
+            indexed = {row[0] for row in self._catalog.execute("SELECT id FROM chats")}
+            entries = [(chat_id, *self._read_catalog_entry(chat_id)) for chat_id in on_disk - indexed]
+            with self._catalog:
+                self._catalog.executemany("INSERT OR REPLACE INTO chats (id, name, last_modified) VALUES (?, ?, ?)", entries)
+                self._catalog.executemany("DELETE FROM chats WHERE id = ?", [(chat_id,) for chat_id in indexed - on_disk])
+        if on_disk != indexed:
+            logger.info(f"Chat catalog synced: {len(on_disk - indexed)} indexed, {len(indexed - on_disk)} removed")
+
+    def rebuild_catalog(self):
+        """Re-index every chat file from scratch."""
+        with self._lock, self._catalog:
+            self._catalog.execute("DELETE FROM chats")
+        self.sync_catalog()
+
+    def _open_catalog(self):
+        path = os.path.join(self.chat_dir, self.CATALOG_FILE)
+        try:
+            return self._connect_catalog(path)
+        except sqlite3.DatabaseError as e:
+            # The catalog only mirrors the chat files, so a damaged one is rebuilt from them
+            logger.warning(f"Rebuilding unreadable chat catalog {path}: {e}")
+            os.remove(path)
+            return self._connect_catalog(path)
+
+    def _connect_catalog(self, path):
+        # Access is serialized by self._lock, so the connection is shared across threads
+        connection = sqlite3.connect(path, check_same_thread=False)
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS chats (id TEXT PRIMARY KEY, name TEXT, last_modified TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS chats_last_modified ON chats (last_modified)")
+        return connection
+
+    def _index(self, chat_id, chat_name, last_modified):
+        with self._catalog:
+            self._catalog.execute(
+                "INSERT OR REPLACE INTO chats (id, name, last_modified) VALUES (?, ?, ?)",
+                (chat_id, chat_name, last_modified),
+            )
+
+    def _read_catalog_entry(self, chat_id):
+        """(chat_name, last_modified) of a chat file, including its journal."""
+        with open(self.snapshot_path(chat_id), 'r') as f:
+            data = json.load(f)
+        chat_name = data.get('chat_name', 'Unnamed Chat')
+        last_modified = data.get('last_modified', '')
+        # Renames and the latest timestamp may only be in the journal so far
+        for op in self._read_journal(chat_id):
+            if op is None:
+                break
+            if op["seq"] <= data.get('journal_seq', 0):
+                continue
+            last_modified = op["ts"]
+            if op["op"] == "rename":
+                chat_name = op["name"]
+        return chat_name, last_modified
+
+    def _replay(self, chat_tree):
+        """Apply journaled operations newer than the snapshot; returns (replayed, torn)."""
+        nodes = {node.node_id: node for node in chat_tree.iter_nodes()}
+        replayed = 0
+        for op in self._read_journal(chat_tree.chat_id):
+            if op is None:
+                return replayed, True
+            # Operations already folded into the snapshot by an interrupted compaction
+            if op["seq"] <= chat_tree.journal_seq:
+                continue
+            chat_tree.apply_op(op, nodes)
+            replayed += 1
+        return replayed, False
+
+    def _read_journal(self, chat_id):
+        """Yield the journal's operations, then None if it ends in a partially written line."""
+        journal_path = self.journal_path(chat_id)
+        if not os.path.exists(journal_path):
+            return
+        with open(journal_path, 'r') as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring the torn end of the journal of chat {chat_id}")
+                    yield None
+                    return
+                yield op
+
+    def _compact(self, chat_tree):
+        chat_id = chat_tree.chat_id
+        snapshot_path = self.snapshot_path(chat_id)
+        tmp_path = snapshot_path + ".tmp"
+        data = chat_tree.to_dict()
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+        # The snapshot carries the journal_seq, so a journal left behind by a crash here is skipped on replay
+        if os.path.exists(self.journal_path(chat_id)):
+            os.remove(self.journal_path(chat_id))
+        # Operations recorded while the snapshot was written stay pending for the next save
+        chat_tree.discard_pending_ops(data['journal_seq'])
+        self._saved_seq[chat_id] = data['journal_seq']
+        self._journal_length[chat_id] = 0
+        self._index(chat_id, chat_tree.chat_name, chat_tree.last_modified)
+        self.compactions += 1
+        logger.info(f"Chat tree {chat_id} compacted to {snapshot_path}")
@@ -4,35 +4,101 @@ from transformers import AutoConfig
 import logging
 import json
 import os
+import threading
+import time
 import uuid
 from datetime import datetime
 
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 
+from chat_store import ChatStore
+from context_window import ContextWindow
+from model_pool import ModelPool, PooledModel, input_device
+from detokenizer import ResponseDetokenizer
+from prefix_cache import PrefixCache
+from prompt_builder import PromptBuilder
+from scheduler import BatchScheduler, iter_group
+from speculative import check_draft_compatible
+
 logger = logging.getLogger(__name__)
 
+# Names are sampled with fixed settings, independent of the chat temperature
+CHAT_NAME_TEMPERATURE = 0.3
+CHAT_NAME_MODES = ("generate", "first_message")
+BACKENDS = ("cuda", "cpu")
+# Weights on the cpu backend: int8 dynamically quantized linear layers, or bf16/fp32 throughout
+CPU_DTYPES = ("int8", "bf16", "fp32")
+
+
+def name_from_message(message, max_words=5):
+    """A chat name taken from the first words of a message, without running the model."""
+    words = message.strip().split()
+    chat_name = " ".join(words[:max_words])
+    return chat_name + "..." if len(words) > max_words else chat_name
+
+# Guards ChatNode._parts/_content: the generation thread appends while socket handlers read
+_content_lock = threading.Lock()
+
 class ChatNode:
+    __slots__ = ('role', '_content', '_parts', 'children', 'parent', 'active_child_index', 'sibling_index', 'depth', 'node_id',
+                 'prompt_tokens')
+
     def __init__(self, role, content):
         self.role = role
         self.content = content
         self.children = []
         self.parent = None
         self.active_child_index = 0
+        self.sibling_index = 0  # position in parent.children
+        self.depth = 0  # distance from the root
+        self.node_id = None  # assigned by the ChatTree, referenced by journal operations
+
+    @property
+    def content(self):
+        # Streamed text is kept as parts and joined once when the content is read
+        with _content_lock:
+            if self._parts:
+                self._content += "".join(self._parts)
+                self._parts.clear()
+            return self._content
+
+    @content.setter
+    def content(self, content):
+        with _content_lock:
+            self._content = content
+            self._parts = []
+        self.prompt_tokens = None  # (model name, previous node id) -> templated token ids, kept by the PromptBuilder
+
+    def append_content(self, text):
+        with _content_lock:
+            self._parts.append(text)
+        self.prompt_tokens = None
 
     def add_child(self, child):
-        self.children.append(child)
-        child.parent = self
+        self._attach(child)
         logger.debug(f"Added child node: {child.role}")
 
+    def _attach(self, child):
+        child.parent = self
+        child.sibling_index = len(self.children)
+        child.depth = self.depth + 1
+        self.children.append(child)
+
     def get_sibling_info(self):
         if self.parent:
-            siblings = self.parent.children
-            index = siblings.index(self)
-            return (index + 1, len(siblings))
+            return (self.sibling_index + 1, len(self.parent.children))
         return (1, 1)  # Root node
 
+    def to_message(self):
+        return {
+            "role": self.role,
+            "content": self.content,
+            "sibling_info": self.get_sibling_info()
+        }
+
     def to_dict(self):
         return {
+            'node_id': self.node_id,
             'role': self.role,
             'content': self.content,
             'children': [child.to_dict() for child in self.children],
@@ -42,51 +108,116 @@ class ChatNode:
     @classmethod
     def from_dict(cls, data, parent=None):
         node = cls(data['role'], data['content'])
-        node.parent = parent
+        if parent is not None:
+            parent._attach(node)
         node.active_child_index = data['active_child_index']
+        node.node_id = data.get('node_id')
         for child_data in data['children']:
-            child = cls.from_dict(child_data, parent=node)
-            node.children.append(child)
+            cls.from_dict(child_data, parent=node)
         return node
 
 class ChatTree:
     def __init__(self):
         self.root = ChatNode("user", "You are an obedient language assistant.")
+        self.root.node_id = 0
+        self.next_node_id = 1
         self.current_node = self.root
         self.chat_id = str(uuid.uuid4())
         self.chat_name = ""  # New attribute to store the chat name
         self.last_modified = datetime.now().isoformat()  # New: last modified date
+        # Operations since the last save, appended to the chat's journal by the ChatStore
+        self.pending_ops = []
+        self.journal_seq = 0
+        # Held while operations are recorded, taken or snapshotted, which happens from several threads
+        self._ops_lock = threading.RLock()
+        self.naming = False  # a name is being generated in the background
+        self.context_start = None  # ((budget, model name), id of the first node after the root that still fits)
         logger.info(f"Initialized ChatTree with ID: {self.chat_id}")
     
+    @property
+    def current_node(self):
+        return self._current_node
+
+    @current_node.setter
+    def current_node(self, node):
+        self._current_node = node
+        # The active path changed; it is rebuilt on the next get_chat_history
+        self._path = None
+        self._history = None
+
     def update_last_modified(self):
         self.last_modified = datetime.now().isoformat()
 
+    def _record(self, op, **fields):
+        with self._ops_lock:
+            self.journal_seq += 1
+            fields.update(op=op, seq=self.journal_seq, ts=self.last_modified)
+            self.pending_ops.append(fields)
+
+    def take_pending_ops(self):
+        with self._ops_lock:
+            ops, self.pending_ops = self.pending_ops, []
+            return ops
+
+    def discard_pending_ops(self, seq):
+        """Drop the pending operations already covered by a snapshot taken at `seq`."""
+        with self._ops_lock:
+            self.pending_ops = [op for op in self.pending_ops if op["seq"] > seq]
+
     def set_chat_name(self, new_name):
         self.chat_name = new_name
         self.update_last_modified()
-    
-    def add_message(self, role, content):
+        self._record("rename", name=new_name)
+
+    def append_content(self, node, text):
+        with self._ops_lock:
+            node.append_content(text)
+            # Streamed chunks of the same message are journaled as one operation, as long as it
+            # has not been taken for saving yet
+            last = self.pending_ops[-1] if self.pending_ops else None
+            if last is not None and last["op"] == "append" and last["id"] == node.node_id:
+                last["text"] += text
+            else:
+                self._record("append", id=node.node_id, text=text)
+
+    def _add_node(self, parent, role, content):
+        """Attach a new node under `parent` and make it the active branch and current node."""
         new_node = ChatNode(role, content)
-        self.current_node.add_child(new_node)
-        self.current_node.active_child_index = len(self.current_node.children) - 1
+        new_node.node_id = self.next_node_id
+        self.next_node_id += 1
+        parent.add_child(new_node)
+        parent.active_child_index = len(parent.children) - 1
         self.current_node = new_node
         self.update_last_modified()  # <-- update timestamp
+        self._record("add", id=new_node.node_id, parent=parent.node_id, role=role, content=content)
+        return new_node
+    
+    def add_message(self, role, content):
+        new_node = self._add_node(self.current_node, role, content)
         logger.info(f"Added new message: {role}")
         return new_node
 
+    def get_active_path(self):
+        """Nodes from the root to the current node, materialized once per change of current node."""
+        if self._path is None:
+            path = []
+            node = self.current_node
+            while node:
+                path.append(node)
+                node = node.parent
+            path.reverse()
+            self._path = path
+            self._history = [node.to_message() for node in path]
+        return self._path
+
     def get_chat_history(self):
-        history = []
-        node = self.current_node
-        while node:
-            sibling_info = node.get_sibling_info()
-            history.insert(0, {
-                "role": node.role,
-                "content": node.content,
-                "sibling_info": sibling_info
-            })
-            node = node.parent
-        logger.debug(f"Retrieved chat history: {len(history)} messages")
-        return history
+        path = self.get_active_path()
+        # While a response streams only the tail changes, so only its message is rebuilt
+        tail, message = path[-1], self._history[-1]
+        if tail.content is not message["content"] or tail.get_sibling_info() != message["sibling_info"]:
+            self._history[-1] = tail.to_message()
+        logger.debug(f"Retrieved chat history: {len(self._history)} messages")
+        return list(self._history)
     
     def get_full_chat_history(self):
         return {
@@ -96,7 +227,8 @@ class ChatTree:
             'last_modified': self.last_modified  # New field
         }
 
-    def regenerate_message(self, level=0):
+    def regenerate_message(self, level=0, n=1):
+        """Add `n` empty assistant siblings of the message at `level`; returns them, or None if it is not an assistant message."""
         node = self.current_node
         for _ in range(level):
             if node.parent:
@@ -104,18 +236,20 @@ class ChatTree:
             else:
                 break
 
+        new_nodes = None
         if node.role == "assistant":
-            parent = node.parent
-            new_assistant_node = ChatNode("assistant", "")
-            parent.add_child(new_assistant_node)
-            parent.active_child_index = len(parent.children) - 1
-            self.current_node = new_assistant_node
-            logger.info(f"Created new branch for regenerated assistant message at level {level}")
+            new_nodes = [self._add_node(node.parent, "assistant", "") for _ in range(n)]
+            # The first of the new branches is the one shown
+            if n > 1:
+                node.parent.active_child_index = new_nodes[0].sibling_index
+                self.current_node = new_nodes[0]
+                self._record("active", id=node.parent.node_id, index=new_nodes[0].sibling_index, current=new_nodes[0].node_id)
+            logger.info(f"Created {n} new branch(es) for regenerated assistant message at level {level}")
         else:
             logger.warning(f"Attempted to regenerate a non-assistant message at level {level}")
-        self.update_last_modified()  # <-- update timestamp
+            self.update_last_modified()  # <-- update timestamp
         
-        return self.get_chat_history()
+        return new_nodes
 
     def edit_message(self, level, new_content):
         node = self.current_node
@@ -126,15 +260,11 @@ class ChatTree:
                 break
         
         if node.role == "user":
-            new_user_node = ChatNode("user", new_content)
-            node.parent.add_child(new_user_node)
-            node.parent.active_child_index = len(node.parent.children) - 1
-            self.current_node = new_user_node
+            self._add_node(node.parent, "user", new_content)
             logger.info(f"Created new branch at level {level} with content: {new_content}")
         else:
             logger.warning(f"Attempted to edit a non-user message at level {level}")
-            
-        self.update_last_modified()  # <-- update timestamp
+            self.update_last_modified()  # <-- update timestamp
         
         return self.get_chat_history()
 
@@ -164,17 +294,54 @@ class ChatTree:
         else:
             logger.warning("Attempted to change active child of root node")
         self.update_last_modified()  # <-- update timestamp
+        if parent:
+            self._record("active", id=parent.node_id, index=parent.active_child_index, current=self.current_node.node_id)
         return self.get_chat_history()
 
+    def apply_op(self, op, nodes):
+        """Replay one journal operation; `nodes` maps node ids to the tree's nodes."""
+        kind = op["op"]
+        if kind == "add":
+            parent = nodes[op["parent"]]
+            new_node = ChatNode(op["role"], op["content"])
+            new_node.node_id = op["id"]
+            parent._attach(new_node)
+            parent.active_child_index = new_node.sibling_index
+            self.current_node = new_node
+            nodes[new_node.node_id] = new_node
+            self.next_node_id = max(self.next_node_id, new_node.node_id + 1)
+        elif kind == "append":
+            nodes[op["id"]].append_content(op["text"])
+        elif kind == "active":
+            nodes[op["id"]].active_child_index = op["index"]
+            self.current_node = nodes[op["current"]]
+        elif kind == "rename":
+            self.chat_name = op["name"]
+        else:
+            raise ValueError(f"Unknown journal operation: {kind}")
+        self.last_modified = op["ts"]
+        self.journal_seq = op["seq"]
+
+    def iter_nodes(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
 
     def to_dict(self):
-        return {
-            'chat_id': self.chat_id,
-            'chat_name': self.chat_name,
-            'last_modified': self.last_modified,  # New field
-            'root': self.root.to_dict(),
-            'current_node_path': self._get_current_node_path()
-        }
+        # Under the lock, so the contents and journal_seq describe the same point of the journal
+        with self._ops_lock:
+            return {
+                'chat_id': self.chat_id,
+                'chat_name': self.chat_name,
+                'last_modified': self.last_modified,  # New field
+                'root': self.root.to_dict(),
+                'current_node_path': self._get_current_node_path(),
+                'next_node_id': self.next_node_id,
+                'journal_seq': self.journal_seq
+            }
 
     @classmethod
     def from_dict(cls, data):
@@ -183,22 +350,26 @@ class ChatTree:
         chat_tree.chat_name = data.get('chat_name')  # Use get() in case older chat trees don't have this field
         chat_tree.last_modified = data.get('last_modified', datetime.now().isoformat())
         chat_tree.root = ChatNode.from_dict(data['root'])
+        chat_tree.journal_seq = data.get('journal_seq', 0)
         
         # Restore current node
         current_node = chat_tree.root
         for index in data['current_node_path']:
             current_node = current_node.children[index]
         chat_tree.current_node = current_node
+
+        # Chat trees saved before journaling have no node ids
+        if 'next_node_id' in data:
+            chat_tree.next_node_id = data['next_node_id']
+        else:
+            for node_id, node in enumerate(chat_tree.iter_nodes()):
+                node.node_id = node_id
+            chat_tree.next_node_id = node_id + 1
         
         return chat_tree
 
     def _get_current_node_path(self):
-        path = []
-        node = self.current_node
-        while node.parent:
-            path.append(node.parent.children.index(node))
-            node = node.parent
-        return list(reversed(path))
+        return [node.sibling_index for node in self.get_active_path()[1:]]
 
     def to_json(self):
         return json.dumps(self.to_dict(), indent=2)
@@ -209,36 +380,416 @@ class ChatTree:
         return cls.from_dict(data)
 
 
-class ChatBot:
+class Conversation:
+    """
+    Operations on one chat tree: chatting, branching, naming and storage.
+
+    Subclasses provide `chat_tree` and `bot`, the ChatBot whose model, tokenizer,
+    scheduler and chat directory are shared by every conversation.
+    """
+
+    def get_chat_id(self):
+        return self.chat_tree.chat_id
+    
+    def get_chat_name(self):
+        return self.chat_tree.chat_name
+    
+    def edit_chat_name(self, new_name):
+        self.chat_tree.set_chat_name(new_name)
+        logger.info(f"Chat name updated to: {new_name}")
+        return self.get_full_chat_history()
+
+    def delete_chat(self, chat_id):
+        """Delete a chat file and its associated data."""
+        if chat_id == self.chat_tree.chat_id:
+            # If deleting current chat, reset to a new chat
+            self.start_new_chat()
+        
+        self.bot.chat_store.delete(chat_id)
+
+    def start_naming(self):
+        """
+        Claim the naming of a chat that has messages but no name yet. Returns True
+        when the caller should run `generate_name`, which can take a while and is
+        meant to run in the background once the response has been started.
+        """
+        chat_tree = self.chat_tree
+        if chat_tree.chat_name or chat_tree.naming or not chat_tree.root.children:
+            return False
+        chat_tree.naming = True
+        return True
+
+    def generate_name(self, first_message, chat_tree=None):
+        """Name `chat_tree` (the current chat by default) after its first message."""
+        chat_tree = chat_tree or self.chat_tree
+        try:
+            if self.bot.chat_name_mode == "first_message":
+                chat_name = name_from_message(first_message)
+            else:
+                chat_name = self._generate_name(first_message) or name_from_message(first_message)
+            # The user may have named the chat in the meantime
+            if not chat_tree.chat_name:
+                chat_tree.set_chat_name(chat_name)
+                # The chat may have been saved while the name was generated; list it under its name right away
+                if self.bot.chat_store is not None:
+                    self.bot.chat_store.rename(chat_tree)
+        finally:
+            chat_tree.naming = False
+        logger.info(f"Generated chat name: {chat_name}")
+        return chat_tree.chat_name
+
+    def _generate_name(self, first_message):
+        logger.info("Generating chat name based on first message")
+        prompt = f"Based on the following first message from a user, generate a short (2-5 words) and representative name for this chat conversation:\n\n'{first_message}'\n\nChat name:"
+        current = self.bot.current_model
+        first_device = input_device(current)
+        
+        input_ids = current.tokenizer.encode(prompt, return_tensors='pt').to(first_device)
+        
+        request = self.bot.scheduler.submit(
+            input_ids,
+            max_new_tokens=30,  # Limit to a short response
+            temperature=CHAT_NAME_TEMPERATURE,   # Slightly randomized but still focused
+            top_p=self.bot.top_p,
+            eos_token_ids=current.eos_token_ids,
+            background=True,  # Only uses batch slots no response is waiting for
+            model=current,
+        )
+        
+        generated_text = current.tokenizer.decode(list(request), skip_special_tokens=True)
+        chat_name = generated_text.split("Chat name:")[-1].strip()
+        
+        # Ensure the chat name is not too long
+        if len(chat_name.split()) > 5:
+            chat_name = " ".join(chat_name.split()[:5])
+        return chat_name
+
+
+    def get_chat_history(self):
+        return self.chat_tree.get_chat_history()
+
+    def get_full_chat_history(self):
+        return self.chat_tree.get_full_chat_history()
+
+    def generate_response(self, messages, chunk_size=None, nodes=None):
+        """
+        Stream a response for `messages` into the current node, or one sampled
+        response into each of `nodes`, which share a single prefill.
+
+        Decoding runs on the shared BatchScheduler, batched with every other session
+        that is generating. Tokens are detokenized incrementally, so the chat history
+        can be yielded every `chunk_size` tokens (the conversation's `chunk_size` by
+        default; 1 yields every piece of text) without breaking words or characters
+        at chunk boundaries.
+
+        When `messages` is the active path, the oldest turns that do not fit the
+        bot's context_budget_tokens are left out (see ContextWindow).
+
+        `stop_generation` ends the response early; what was generated so far stays in the nodes.
+        """
+        logger.info("Generating response")
+        # The whole response uses one model, even if the bot switches models meanwhile
+        current = self.bot.current_model
+        first_device = input_device(current)
+        prompt_ids, prompt_messages, dropped = self._build_prompt(messages, current)
+        input_ids = torch.tensor([prompt_ids], device=first_device)
+        nodes = nodes or [self.chat_tree.current_node]
+        chunk_size = chunk_size or self.chunk_size
+        sampling = dict(
+            max_new_tokens=self.bot.generation_length,
+            temperature=self.bot.temperature,
+            top_p=self.bot.top_p,
+            eos_token_ids=current.eos_token_ids,
+            model=current,
+        )
+        if len(nodes) == 1:
+            requests = [self.bot.scheduler.submit(input_ids, **sampling)]
+            tokens = ((requests[0], token_id) for token_id in requests[0])
+        else:
+            # One prefill, then every sample decodes in its own batch row
+            requests = self.bot.scheduler.submit_group(len(nodes), input_ids, **sampling)
+            tokens = iter_group(requests)
+
+        responses = {request: (node, ResponseDetokenizer(current.tokenizer)) for request, node in zip(requests, nodes)}
+        self.generating = requests
+        self.alternatives = nodes if len(nodes) > 1 else []
+        pending_tokens = 0
+        try:
+            for request, token_id in tokens:
+                node, detokenizer = responses[request]
+                text = detokenizer.push(token_id)
+                if text:
+                    self.chat_tree.append_content(node, text)
+                pending_tokens += 1
+                if pending_tokens >= chunk_size * len(nodes):
+                    pending_tokens = 0
+                    yield self.get_chat_history()
+            flushed = False
+            for node, detokenizer in responses.values():
+                text = detokenizer.flush()
+                if text:
+                    self.chat_tree.append_content(node, text)
+                    flushed = True
+            if pending_tokens or flushed:
+                yield self.get_chat_history()
+        finally:
+            # Frees the batch slots right away if the consumer stopped early
+            for request in requests:
+                if not request.done:
+                    request.cancel()
+            if self.generating is requests:
+                self.generating = []
+                self.alternatives = []
+            stats = dict(requests[0].stats, prompt_messages=prompt_messages, dropped_messages=dropped)
+            if len(requests) > 1:
+                stats.update(samples=len(requests), sample_tokens=[len(request.generated_ids) for request in requests])
+            self.bot.last_generation_stats = stats
+            logger.info(
+                f"{'Stopped after' if stats['cancelled'] else 'Generated'} "
+                f"{sum(len(request.generated_ids) for request in requests)} tokens in {len(requests)} samples "
+                f"({stats['cached_prompt_tokens']}/{stats['prompt_tokens']} prompt tokens cached, "
+                f"{prompt_messages} messages, {dropped} older ones dropped): "
+                f"time to first token {stats['time_to_first_token']:.3f}s, "
+                f"{stats['tokens_per_second']:.1f} tokens/s"
+            )
+
+        logger.debug(f"Full response generated: {nodes[0].content}")
+
+    def alternative_texts(self):
+        """Text so far of the samples being generated besides the one on the active path."""
+        tail = self.chat_tree.current_node
+        return [node.content for node in self.alternatives if node is not tail]
+
+    def stop_generation(self):
+        """Cancel the response being generated, if any; returns whether there was one."""
+        requests = self.generating
+        for request in requests:
+            request.cancel()
+        if requests:
+            logger.info(f"Stopping generation of {len(requests)} samples")
+        return bool(requests)
+
+    def _build_prompt(self, messages, current):
+        """
+        Prompt token ids for `messages` on the pooled model `current`; returns (ids,
+        messages sent, messages dropped). The active path is cut to the prefill budget
+        and assembled from memoized per-node segments; other message lists are encoded whole.
+        """
+        path = self.chat_tree.get_active_path()
+        if len(path) != len(messages):
+            return self.bot.prompt_builder.encode(messages, current), len(messages), 0
+        context_window = self.bot.context_window
+        reserve = 0
+        while True:
+            kept, estimated_tokens = context_window.select(self.chat_tree, path, current, reserve)
+            prompt_ids = self.bot.prompt_builder.build([path[i] for i in kept], current)
+            # Counts are taken in path order; the first message after a cut can come out longer
+            if reserve or estimated_tokens is None or len(prompt_ids) <= context_window.budget_tokens:
+                return prompt_ids, len(kept), len(path) - len(kept)
+            reserve = max(len(prompt_ids) - estimated_tokens, 1)
+
+    def chat(self, user_message):
+        logger.info(f"Processing chat: {user_message[:50]}...")
+        self.chat_tree.add_message("user", user_message)
+        self.chat_tree.add_message("assistant", "")
+        # The chat name is generated separately, see start_naming
+        return self.generate_response(self.get_chat_history())
+
+    def edit(self, level, new_message):
+        logger.info(f"Editing message at level {level}")
+        updated_history = self.chat_tree.edit_message(level, new_message)
+        self.chat_tree.add_message("assistant", "")
+        return self.generate_response(updated_history)
+
+    def change_active_child(self, level, direction):
+        return self.chat_tree.change_active_child(level, direction)
+
+    def regenerate(self, level=0, n=1):
+        """
+        Sample `n` new responses as siblings of the assistant message at `level`; the first becomes active
+        and the others stream alongside it (see alternative_texts).
+        """
+        logger.info(f"Regenerating {n} response(s) at level {level}")
+        new_nodes = self.chat_tree.regenerate_message(level, n)
+        if new_nodes is None:
+            # Nothing was regenerated
+            return self.generate_response(self.get_chat_history())
+        return self.generate_response(self.get_chat_history(), nodes=new_nodes)
+
+
+    def continue_chat(self):
+        logger.info("Continuing chat")
+        if self.chat_tree.current_node.role != "assistant":
+            self.chat_tree.add_message("assistant", "")
+            logger.debug("Continuing chat: new assistant message added") 
+        else:
+            self.chat_tree.append_content(self.chat_tree.current_node, " ")
+        return self.generate_response(self.get_chat_history())
+
+    def reset_chat(self):
+        logger.info("Resetting chat")
+        self.chat_tree = ChatTree()
+        return self.get_chat_history()
+
+    def save_chat_tree(self):
+        filepath = self.bot.chat_store.save(self.chat_tree)
+        logger.info(f"Chat tree saved to {filepath}")
+        return filepath
+
+    def load_chat_tree(self, chat_id):
+        self.chat_tree = self.bot.chat_store.load(chat_id)
+        logger.info(f"Chat tree loaded: {chat_id}")
+        return self.get_chat_history()
+
+    def list_chat_histories(self, offset=0, limit=None):
+        return self.bot.chat_store.list_chats(offset, limit)
+
+    def count_chat_histories(self):
+        return self.bot.chat_store.count_chats()
+
+
+    def start_new_chat(self):
+        self.chat_tree = ChatTree()
+        logger.info(f"Started new chat with ID: {self.chat_tree.chat_id}")
+        return self.chat_tree.chat_id
+
+    def get_current_chat_id(self):
+        return self.chat_tree.chat_id
+
+
+class ChatBot(Conversation):
     def __init__(
         self, 
         model_config_file="model_config.json", 
-        chat_dir="chat_history"
+        chat_dir="chat_history",
+        lazy=False
     ):
         self.model_config_file = model_config_file
         self.chat_dir = chat_dir
 
-        if not os.path.exists(self.chat_dir):
-            os.makedirs(self.chat_dir)
+        # Snapshots plus append-only operation journals of saved chats; chat_dir=None saves no chats
+        self.chat_store = None
+        if self.chat_dir is not None:
+            if not os.path.exists(self.chat_dir):
+                os.makedirs(self.chat_dir)
+            self.chat_store = ChatStore(self.chat_dir, ChatTree)
 
         # 1. Load or create the model config
         self.load_model_config()  # sets self.model_name, self.generation_length, self.temperature, self.top_p
 
-        # 2. Load the actual model & tokenizer
-        self.model, self.tokenizer = self.load_model()
-
-        # 3. Initialize ChatTree
+        # KV state of earlier prompts, reused by regenerate/edit/continue on the same branch
+        self.prefix_cache = self.make_prefix_cache()
+        # Tokenizes each message once, and keeps long conversations within the prefill budget
+        self.prompt_builder = PromptBuilder()
+        self.context_window = ContextWindow(self.context_budget_tokens, self.prompt_builder)
+
+        # 2. Load the actual model & tokenizer; other models load in the background later
+        self.model_pool = self.make_model_pool()
+        self.current_model = None
+        # Small model proposing tokens for speculative decoding; None decodes in the batch only
+        self.draft_model = None
+        self._draft_compatible = {}  # target model name -> whether the draft shares its tokenizer
+        # Called with the model name whenever a newly loaded model takes over
+        self.on_model_switch = None
+
+        # 3. Decode requests from all sessions in shared batches
+        self.scheduler = self.make_scheduler()
+        if not lazy:
+            self.load()
+
+        # 4. Initialize ChatTree
         self.chat_tree = ChatTree()
+
+        # Latency numbers of the most recent generate_response call
+        self.last_generation_stats = {}
+        # Scheduler requests of the response being generated, for stop_generation
+        self.generating = []
+        # The other samples of a multi-sample response being generated
+        self.alternatives = []
+        # Tokens per yielded history of generate_response
+        self.chunk_size = 50
         
         logger.info("ChatBot initialization complete")
 
+    @property
+    def bot(self):
+        # A ChatBot is also the conversation of its own default chat tree
+        return self
+
+    def load(self):
+        """Load the configured model; a ChatBot created with lazy=True serves nothing until this returns."""
+        entry = self.model_pool.load(self.model_name)
+        self.model_pool.set_active(entry)
+        self.current_model = entry
+        logger.info(f"Serving model {entry.name}")
+        if self.draft_model_name:
+            self.load_draft(self.draft_model_name)
+        return self
+
+    def make_prefix_cache(self):
+        return PrefixCache(self.prefix_cache_mb * 1024 * 1024)
+
+    def make_model_pool(self):
+        return ModelPool(
+            self.load_model,
+            max_models=self.model_pool_size,
+            max_memory_mb=self.model_pool_memory_mb,
+            on_evict=self.prefix_cache.clear,
+        )
+
+    def make_scheduler(self):
+        return BatchScheduler(self, max_batch_size=self.max_batch_size)
+
+    def load_draft(self, model_name):
+        """Load the draft model for speculative decoding; it lives outside the pool and is never evicted."""
+        logger.info(f"Loading draft model {model_name}")
+        start_time = time.perf_counter()
+        model, tokenizer = self.load_model(model_name)
+        self.draft_model = PooledModel(model_name, model, tokenizer, time.perf_counter() - start_time)
+        self._draft_compatible = {}
+        logger.info(f"Loaded draft model {model_name} in {self.draft_model.load_time:.1f}s")
+        return self.draft_model
+
+    def draft_for(self, model):
+        """The draft model to decode `model`'s requests speculatively with, if there is a usable one."""
+        draft = self.draft_model
+        if draft is None or draft.name != self.draft_model_name:
+            return None
+        if model.name not in self._draft_compatible:
+            try:
+                check_draft_compatible(model, draft)
+                self._draft_compatible[model.name] = True
+            except ValueError as e:
+                logger.warning(f"Not decoding speculatively: {e}")
+                self._draft_compatible[model.name] = False
+        return draft if self._draft_compatible[model.name] else None
+
+    @property
+    def model(self):
+        return self.current_model.model
+
+    @property
+    def tokenizer(self):
+        return self.current_model.tokenizer
+
     def load_model_config(self):
         """Load model config from JSON file or use defaults if not found."""
         defaults = {
             "model_name": "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
             "generation_length": 512,
             "temperature": 0.7,
-            "top_p": 0.95
+            "top_p": 0.95,
+            "prefix_cache_mb": 2048,
+            "max_batch_size": 16,
+            "chat_name_mode": "generate",
+            "model_pool_size": 2,
+            "model_pool_memory_mb": 0,
+            "draft_model_name": None,
+            "draft_tokens": 4,
+            "context_budget_tokens": 8192,
+            "backend": "cuda",
+            "cpu_dtype": "bf16",
+            "cpu_threads": 0
         }
 
         if os.path.exists(self.model_config_file):
@@ -258,6 +809,17 @@ class ChatBot:
         self.generation_length = data.get("generation_length", defaults["generation_length"])
         self.temperature = data.get("temperature", defaults["temperature"])
         self.top_p = data.get("top_p", defaults["top_p"])
+        self.prefix_cache_mb = data.get("prefix_cache_mb", defaults["prefix_cache_mb"])
+        self.max_batch_size = data.get("max_batch_size", defaults["max_batch_size"])
+        self.chat_name_mode = data.get("chat_name_mode", defaults["chat_name_mode"])
+        self.model_pool_size = data.get("model_pool_size", defaults["model_pool_size"])
+        self.model_pool_memory_mb = data.get("model_pool_memory_mb", defaults["model_pool_memory_mb"])
+        self.draft_model_name = data.get("draft_model_name", defaults["draft_model_name"])
+        self.draft_tokens = data.get("draft_tokens", defaults["draft_tokens"])
+        self.context_budget_tokens = data.get("context_budget_tokens", defaults["context_budget_tokens"])
+        self.backend = data.get("backend", defaults["backend"])
+        self.cpu_dtype = data.get("cpu_dtype", defaults["cpu_dtype"])
+        self.cpu_threads = data.get("cpu_threads", defaults["cpu_threads"])
 
     def save_model_config(self):
         """Save current config to the model_config_file."""
@@ -265,35 +827,82 @@ class ChatBot:
             "model_name": self.model_name,
             "generation_length": self.generation_length,
             "temperature": self.temperature,
-            "top_p": self.top_p
+            "top_p": self.top_p,
+            "prefix_cache_mb": self.prefix_cache_mb,
+            "max_batch_size": self.max_batch_size,
+            "chat_name_mode": self.chat_name_mode,
+            "model_pool_size": self.model_pool_size,
+            "model_pool_memory_mb": self.model_pool_memory_mb,
+            "draft_model_name": self.draft_model_name,
+            "draft_tokens": self.draft_tokens,
+            "context_budget_tokens": self.context_budget_tokens,
+            "backend": self.backend,
+            "cpu_dtype": self.cpu_dtype,
+            "cpu_threads": self.cpu_threads
         }
         try:
-            with open(self.model_config_file, "w") as f:
+            # Written aside and renamed over the old file, so a reader never sees a partial config
+            tmp_path = self.model_config_file + ".tmp"
+            with open(tmp_path, "w") as f:
                 json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.model_config_file)
             logger.info("Model config saved.")
         except Exception as e:
             logger.error(f"Error saving model config: {e}")
 
-    def update_model_config(self, new_config):
+    def update_model_config(self, new_config, save=True):
         """
         Update model config with new values (validate them), 
         reload the model if the model_name changed.
+        With save=False the config is only applied in memory.
         """
-        valid_models = [
-            "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
-            "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B",
-            "deepseek-ai/DeepSeek-R1-Distill-Qwen-32B",
-            "meta-llama/Llama-3.1-8B-Instruct",
-            "meta-llama/Llama-3.2-3B-Instruct",
-            "Qwen/Qwen2.5-14B-Instruct-1M",
-            "meta-llama/Llama-3.3-70B-Instruct",
-            "mistralai/Mistral-Small-24B-Instruct-2501",
-        ]
-        
-        # 1. Validate model_name
+        # Models each backend may switch to; those for the cpu backend are small enough to decode at a usable speed there
+        valid_models = {
+            "cuda": [
+                "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
+                "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B",
+                "deepseek-ai/DeepSeek-R1-Distill-Qwen-32B",
+                "meta-llama/Llama-3.1-8B-Instruct",
+                "meta-llama/Llama-3.2-3B-Instruct",
+                "Qwen/Qwen2.5-14B-Instruct-1M",
+                "meta-llama/Llama-3.3-70B-Instruct",
+                "mistralai/Mistral-Small-24B-Instruct-2501",
+            ],
+            "cpu": [
+                "HuggingFaceTB/SmolLM2-135M-Instruct",
+                "HuggingFaceTB/SmolLM2-360M-Instruct",
+                "HuggingFaceTB/SmolLM2-1.7B-Instruct",
+                "Qwen/Qwen2.5-0.5B-Instruct",
+                "Qwen/Qwen2.5-1.5B-Instruct",
+                "meta-llama/Llama-3.2-1B-Instruct",
+                "meta-llama/Llama-3.2-3B-Instruct",
+                "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B",
+            ],
+        }
+        # Small models that share a tokenizer with some of the models above
+        valid_draft_models = {
+            "cuda": [
+                "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B",
+                "meta-llama/Llama-3.2-1B-Instruct",
+                "Qwen/Qwen2.5-0.5B-Instruct",
+            ],
+            "cpu": [
+                "HuggingFaceTB/SmolLM2-135M-Instruct",
+                "Qwen/Qwen2.5-0.5B-Instruct",
+                "meta-llama/Llama-3.2-1B-Instruct",
+            ],
+        }
+
+        # 1. Validate the inference backend, then model_name against the models of that backend.
+        # The backend applies to models loaded from now on. The model already configured for it is not checked again,
+        # so one set in model_config.json (a local checkpoint, say) keeps working.
+        requested_backend = new_config.get("backend", self.backend)
+        if requested_backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+        backend_changed = (requested_backend != self.backend)
         requested_model = new_config.get("model_name", self.model_name)
-        if requested_model not in valid_models:
-            raise ValueError(f"Invalid model_name: {requested_model}")
+        if (requested_model != self.model_name or backend_changed) and requested_model not in valid_models[requested_backend]:
+            raise ValueError(f"Invalid model_name for the {requested_backend} backend: {requested_model}")
 
         # 2. Validate generation_length
         requested_length = new_config.get("generation_length", self.generation_length)
@@ -310,50 +919,146 @@ class ChatBot:
         if not (0.0 <= requested_top_p <= 1.0):
             raise ValueError("top_p must be in range 0.0..1.0")
 
+        # 5. Validate prefix_cache_mb
+        requested_cache_mb = new_config.get("prefix_cache_mb", self.prefix_cache_mb)
+        if not isinstance(requested_cache_mb, int) or requested_cache_mb < 0:
+            raise ValueError("prefix_cache_mb must be a non-negative integer")
+
+        # 6. Validate chat_name_mode
+        requested_name_mode = new_config.get("chat_name_mode", self.chat_name_mode)
+        if requested_name_mode not in CHAT_NAME_MODES:
+            raise ValueError(f"chat_name_mode must be one of {', '.join(CHAT_NAME_MODES)}")
+
+        # 7. Validate model_pool_size
+        requested_pool_size = new_config.get("model_pool_size", self.model_pool_size)
+        if not isinstance(requested_pool_size, int) or requested_pool_size < 1:
+            raise ValueError("model_pool_size must be a positive integer")
+
+        # 8. Validate the speculative decoding draft model
+        requested_draft = new_config.get("draft_model_name", self.draft_model_name) or None
+        draft_choices = valid_draft_models[requested_backend] + valid_models[requested_backend]
+        if (requested_draft is not None and (requested_draft != self.draft_model_name or backend_changed)
+                and requested_draft not in draft_choices):
+            raise ValueError(f"Invalid draft_model_name for the {requested_backend} backend: {requested_draft}")
+        requested_draft_tokens = new_config.get("draft_tokens", self.draft_tokens)
+        if not isinstance(requested_draft_tokens, int) or not 1 <= requested_draft_tokens <= 16:
+            raise ValueError("draft_tokens must be an integer in range 1..16")
+
+        # 9. Validate context_budget_tokens
+        requested_budget = new_config.get("context_budget_tokens", self.context_budget_tokens)
+        if not isinstance(requested_budget, int) or requested_budget < 0:
+            raise ValueError("context_budget_tokens must be a non-negative integer (0 for no limit)")
+
+        # 10. Validate the settings of the cpu backend
+        requested_cpu_dtype = new_config.get("cpu_dtype", self.cpu_dtype)
+        if requested_cpu_dtype not in CPU_DTYPES:
+            raise ValueError(f"cpu_dtype must be one of {', '.join(CPU_DTYPES)}")
+        requested_threads = new_config.get("cpu_threads", self.cpu_threads)
+        if not isinstance(requested_threads, int) or requested_threads < 0:
+            raise ValueError("cpu_threads must be a non-negative integer (0 for the torch default)")
+
         # Check if the model_name is changing
         model_changed = (requested_model != self.model_name)
+        draft_changed = (requested_draft != self.draft_model_name)
 
         # Update the config in memory
         self.model_name = requested_model
         self.generation_length = requested_length
         self.temperature = requested_temp
         self.top_p = requested_top_p
-
-        # Reload model if needed
-        if model_changed:
-            logger.info("Model changed. Reloading new model...")
-            self.model, self.tokenizer = self.load_model()
+        self.prefix_cache_mb = requested_cache_mb
+        if self.prefix_cache is not None:
+            self.prefix_cache.max_bytes = requested_cache_mb * 1024 * 1024
+        self.chat_name_mode = requested_name_mode
+        self.model_pool_size = requested_pool_size
+        if self.model_pool is not None:
+            self.model_pool.max_models = requested_pool_size
+        self.draft_model_name = requested_draft
+        self.draft_tokens = requested_draft_tokens
+        self.context_budget_tokens = requested_budget
+        self.context_window.budget_tokens = requested_budget
+        self.backend = requested_backend
+        self.cpu_dtype = requested_cpu_dtype
+        if requested_threads != self.cpu_threads:
+            self.cpu_threads = requested_threads
+            self._set_cpu_threads()
+
+        self._apply_model_changes(model_changed, draft_changed)
 
         # Save new config to file
-        self.save_model_config()
+        if save:
+            self.save_model_config()
 
         # Return updated config to the caller
         return self.get_model_config()
 
+    def _apply_model_changes(self, model_changed, draft_changed):
+        # Load the new model in the background; the current one keeps serving until it is ready
+        if model_changed:
+            logger.info(f"Model changed. Loading {self.model_name} in the background...")
+            self.model_pool.load_async(self.model_name, on_ready=self._switch_model)
+        # Requests keep decoding without a draft until the new one is loaded
+        if draft_changed:
+            if self.draft_model_name is None:
+                self.draft_model = None
+            else:
+                threading.Thread(target=self.load_draft, args=(self.draft_model_name,), name="load-draft", daemon=True).start()
+
     def get_model_config(self):
         """Return current config as a dict."""
         return {
             "model_name": self.model_name,
             "generation_length": self.generation_length,
             "temperature": self.temperature,
-            "top_p": self.top_p
+            "top_p": self.top_p,
+            "prefix_cache_mb": self.prefix_cache_mb,
+            "max_batch_size": self.max_batch_size,
+            "chat_name_mode": self.chat_name_mode,
+            "model_pool_size": self.model_pool_size,
+            "model_pool_memory_mb": self.model_pool_memory_mb,
+            "draft_model_name": self.draft_model_name,
+            "draft_tokens": self.draft_tokens,
+            "context_budget_tokens": self.context_budget_tokens,
+            "backend": self.backend,
+            "cpu_dtype": self.cpu_dtype,
+            "cpu_threads": self.cpu_threads
         }
 
 
-    def load_model(self,):
+    def _switch_model(self, entry):
+        """Make a loaded model the one new requests use; requests already running finish on the old one."""
+        if entry.name != self.model_name:
+            # The config moved on to another model while this one was loading
+            logger.info(f"Not switching to {entry.name}: {self.model_name} is configured now")
+            return
+        self.model_pool.set_active(entry)
+        self.current_model = entry
+        logger.info(f"Switched to model {entry.name}")
+        if self.on_model_switch:
+            self.on_model_switch(entry.name)
+
+    def get_model_status(self):
+        """The model serving requests, the configured one, and the pool's loaded models."""
+        return dict(
+            self.model_pool.stats(),
+            serving=self.current_model.name if self.current_model else None,
+            configured=self.model_name,
+            switching=self.current_model is not None and self.current_model.name != self.model_name,
+            draft=self.draft_model.stats() if self.draft_model else None,
+        )
+
+    def load_model(self, model_name=None):
         """
-        Load the model and tokenizer based on self.model_name, 
+        Load the model and tokenizer based on self.model_name (or `model_name`), 
         returning (model, tokenizer).
-        Make sure GPU is cleared if needed.
+        The configured backend decides how: 4-bit on the GPUs, or on the CPU (see `_load_cpu_model`).
+        Evicting models to make room is left to the ModelPool.
         """
-        # If a model is already loaded, clear it before loading a new one
-        try:
-            if hasattr(self, 'model') and self.model is not None:
-                del self.model
-                torch.cuda.empty_cache()
-        except Exception as e:
-            logger.warning(f"Could not clear old model from GPU: {e}")
-        # Define model identifier for the 32B model
+        model_name = model_name or self.model_name
+        tokenizer = self.load_tokenizer(model_name)
+        if self.backend == "cpu":
+            return self._load_cpu_model(model_name), tokenizer
+
         # Configure 4-bit quantization
         bnb_config = BitsAndBytesConfig(
             load_in_4bit=True,
@@ -365,18 +1070,9 @@ class ChatBot:
         # Set max_memory for each GPU to force all parts of the model to load on GPU
         max_memory = {0: "24GB", 1: "24GB"}
         
-        # Load the tokenizer
-        tokenizer = AutoTokenizer.from_pretrained(
-            self.model_name,
-            use_fast=True,
-            trust_remote_code=True,
-        )
-        if tokenizer.pad_token_id is None:
-            tokenizer.pad_token_id = tokenizer.eos_token_id
-        
         # Load the model with quantization, device map, and max_memory constraints
         model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
+            model_name,
             quantization_config=bnb_config,
             device_map="auto",         # distribute layers across GPUs
             max_memory=None,         # force all modules onto the GPUs
@@ -391,203 +1087,46 @@ class ChatBot:
             
         return model, tokenizer
 
+    def _load_cpu_model(self, model_name):
+        """
+        Load a model for CPU inference in `cpu_dtype`: bf16 or fp32 weights, or fp32
+        with every linear layer dynamically quantized to int8.
 
-    def get_chat_id(self):
-        return self.chat_tree.chat_id
-    
-    def get_chat_name(self):
-        return self.chat_tree.chat_name
-    
-    def edit_chat_name(self, new_name):
-        self.chat_tree.set_chat_name(new_name)
-        logger.info(f"Chat name updated to: {new_name}")
-        return self.get_full_chat_history()
-
-    def delete_chat(self, chat_id):
-        """Delete a chat file and its associated data."""
-        if chat_id == self.chat_tree.chat_id:
-            # If deleting current chat, reset to a new chat
-            self.start_new_chat()
-        
-        filename = f"{chat_id}.json"
-        filepath = os.path.join(self.chat_dir, filename)
-        
-        if not os.path.exists(filepath):
-            raise FileNotFoundError(f"No chat history found for ID: {chat_id}")
-        
-        try:
-            os.remove(filepath)
-            logger.info(f"Deleted chat file: {filepath}")
-        except Exception as e:
-            logger.error(f"Error deleting chat file: {e}")
-            raise
-
-    def generate_name(self, first_message):
-        logger.info("Generating chat name based on first message")
-        prompt = f"Based on the following first message from a user, generate a short (2-5 words) and representative name for this chat conversation:\n\n'{first_message}'\n\nChat name:"
-        first_device = self.model.hf_device_map.get('transformer.wte', 0)
-        
-        input_ids = self.tokenizer.encode(prompt, return_tensors='pt').to(first_device)
-        
-        with torch.inference_mode():
-            output = self.model.generate(
-                input_ids, 
-                max_new_tokens=30,  # Limit to a short response
-                do_sample=True,
-                temperature=self.temperature,   # Slightly randomized but still focused
-                top_p=self.top_p,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
-        
-        generated_text = self.tokenizer.decode(output[0], skip_special_tokens=True)
-        chat_name = generated_text.split("Chat name:")[-1].strip()
-        
-        # Ensure the chat name is not too long
-        if len(chat_name.split()) > 5:
-            chat_name = " ".join(chat_name.split()[:5])
-        
-        self.chat_tree.chat_name = chat_name
-        logger.info(f"Generated chat name: {chat_name}")
-        return chat_name
-
-
-    def get_chat_history(self):
-        return self.chat_tree.get_chat_history()
-    
-    def get_full_chat_history(self):
-        return self.chat_tree.get_full_chat_history()
-
-    def generate_response(self, messages, ):
-        logger.info("Generating response")
-        total_tokens = self.generation_length
-        chunk_size = 50
-        formatted_input = self.tokenizer.apply_chat_template(
-            messages, 
-            tokenize=False,
-            add_generation_prompt=True,
+        Safetensors checkpoints are memory-mapped and copied straight into the
+        weights, without a randomly initialized copy of the model first.
+        """
+        self._set_cpu_threads()
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.bfloat16 if self.cpu_dtype == "bf16" else torch.float32,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True
         )
+        model.eval()
+        if self.cpu_dtype == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        logger.info(f"Loaded {model_name} for CPU inference ({self.cpu_dtype}, {torch.get_num_threads()} threads)")
+        return model
 
-        first_device = self.model.hf_device_map.get('transformer.wte', 0)
-        
-        input_ids = self.tokenizer.encode(formatted_input, return_tensors='pt', add_special_tokens=False).to(first_device)
-        generated_text = self.chat_tree.current_node.content
-        remaining_tokens = total_tokens
-        first_chunk = True
-            
-        while remaining_tokens > 0:
-            tokens_to_generate = min(chunk_size, remaining_tokens)
-            logger.debug(f"Generating {tokens_to_generate} tokens")
-            with torch.inference_mode():
-                output = self.model.generate(
-                    input_ids, 
-                    max_new_tokens=tokens_to_generate, 
-                    temperature=self.temperature,  # Slightly randomized but still focused
-                    top_p=self.top_p,
-                    do_sample=True, 
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    use_cache=True,
-                )
-            
-            new_tokens = output[0, input_ids.shape[1]:]
-            chunk_text = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
-            
-            if first_chunk:
-                chunk_text = chunk_text.lstrip("assistant").lstrip()
-                first_chunk = False
-            
-            generated_text += chunk_text
-            self.chat_tree.current_node.content = generated_text
-            
-            yield self.get_chat_history()
-            
-            if self.tokenizer.eos_token_id in new_tokens.tolist():
-                logger.info("EOS token encountered, stopping generation")
-                break
-            input_ids = output
-            remaining_tokens -= tokens_to_generate
-
-        logger.debug(f"Full response generated: {generated_text}")
-        # Final GPU memory cleanup
-        del input_ids
-        torch.cuda.empty_cache()
-
-    def chat(self, user_message):
-        logger.info(f"Processing chat: {user_message[:50]}...")
-        self.chat_tree.add_message("user", user_message)
-        self.chat_tree.add_message("assistant", "")
-
-        # If this is the first user message and there's no chat name, generate one
-        if len(self.chat_tree.get_chat_history()) >= 2 and not self.chat_tree.chat_name:  # 2 because of the initial system message
-            self.generate_name(user_message)
-        return self.generate_response(self.get_chat_history())
-
-    def edit(self, level, new_message):
-        logger.info(f"Editing message at level {level}")
-        updated_history = self.chat_tree.edit_message(level, new_message)
-        self.chat_tree.add_message("assistant", "")
-        return self.generate_response(updated_history)
-
-    def change_active_child(self, level, direction):
-        return self.chat_tree.change_active_child(level, direction)
-
-    def regenerate(self, level=0):
-        logger.info(f"Regenerating response at level {level}")
-        updated_history = self.chat_tree.regenerate_message(level)
-        return self.generate_response(updated_history)
-
+    def _set_cpu_threads(self):
+        if self.backend == "cpu" and self.cpu_threads:
+            torch.set_num_threads(self.cpu_threads)
 
-    def continue_chat(self):
-        logger.info("Continuing chat")
-        if self.chat_tree.current_node.role != "assistant":
-            self.chat_tree.add_message("assistant", "")
-            logger.debug("Continuing chat: new assistant message added") 
-        else:
-            self.chat_tree.current_node.content += " "
-        return self.generate_response(self.get_chat_history())
-
-    def reset_chat(self):
-        logger.info("Resetting chat")
-        self.chat_tree = ChatTree()
-        return self.get_chat_history()
-
-    def save_chat_tree(self):
-        filename = f"{self.chat_tree.chat_id}.json"
-        filepath = os.path.join(self.chat_dir, filename)
-        with open(filepath, 'w') as f:
-            json.dump(self.chat_tree.to_dict(), f, indent=2)
-        logger.info(f"Chat tree saved to {filepath}")
-        return filepath
-
-    def load_chat_tree(self, chat_id):
-        filename = f"{chat_id}.json"
-        filepath = os.path.join(self.chat_dir, filename)
-        if not os.path.exists(filepath):
-            raise FileNotFoundError(f"No chat history found for ID: {chat_id}")
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-        self.chat_tree = ChatTree.from_dict(data)
-        logger.info(f"Chat tree loaded from {filepath}")
-        return self.get_chat_history()
-
-    def list_chat_histories(self):
-        chat_files = [f for f in os.listdir(self.chat_dir) if f.endswith('.json')]
-        chat_info = []
-        for filename in chat_files:
-            chat_id = os.path.splitext(filename)[0]
-            filepath = os.path.join(self.chat_dir, filename)
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-            chat_name = data.get('chat_name', 'Unnamed Chat')
-            last_modified = data.get('last_modified', '')
-            chat_info.append({'id': chat_id, 'name': chat_name, 'last_modified': last_modified})
-
-        return chat_info
-
-
-    def start_new_chat(self):
-        self.chat_tree = ChatTree()
-        logger.info(f"Started new chat with ID: {self.chat_tree.chat_id}")
-        return self.chat_tree.chat_id
+    def load_tokenizer(self, model_name):
+        tokenizer = AutoTokenizer.from_pretrained(
+            model_name,
+            use_fast=True,
+            trust_remote_code=True,
+        )
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token_id = tokenizer.eos_token_id
+        return tokenizer
 
-    def get_current_chat_id(self):
-        return self.chat_tree.chat_id
+    def get_stats(self):
+        return {
+            "generation": self.last_generation_stats,
+            "prefix_cache": self.prefix_cache.stats(),
+            "prompt_builder": self.prompt_builder.stats(),
+            "scheduler": self.scheduler.stats(),
+            "models": self.get_model_status(),
+        }
@@ -0,0 +1,66 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# After the budget is exceeded, old turns are dropped until the prompt is this fraction of it,
+# so the next turns fit without moving the cut (and invalidating the cached prompt prefix) again
+LOW_WATER = 0.75
+
+
+class ContextWindow:
+    """
+    Fits the active path of a chat into a prefill budget of `budget_tokens` (0 for no limit).
+
+    Token counts are the lengths of the nodes' memoized prompt segments (see
+    PromptBuilder), so each message is only tokenized once per model. The root
+    prompt and the latest turn are always kept; when the path does not fit, whole
+    turns are dropped from the oldest end until it takes `low_water` of the budget.
+    The first kept node is remembered on the chat tree and reused for as long as the
+    rest still fits, so the prompt only changes at its start every few turns and the
+    prefix cache keeps matching in between. The cut is tied to the budget and model it
+    was made for; when either changes it is recomputed from the start of the path.
+    """
+
+    def __init__(self, budget_tokens, prompt_builder, low_water=LOW_WATER):
+        self.budget_tokens = budget_tokens
+        self.prompt_builder = prompt_builder
+        self.low_water = low_water
+
+    def select(self, chat_tree, path, pooled, reserve=0):
+        """
+        Indices into `path` of the nodes to send, fitting the budget less `reserve`
+        tokens; returns (indices, estimated prompt tokens or None without a budget).
+        """
+        if not self.budget_tokens:
+            return list(range(len(path))), None
+        counts = [
+            len(self.prompt_builder.segment(node, path[index - 1] if index else None, pooled))
+            for index, node in enumerate(path)
+        ]
+        counts[-1] += len(self.prompt_builder.generation_prompt(pooled))
+        budget = self.budget_tokens - reserve
+
+        # Resume from the previous cut when it was made for this budget and model and is still on this branch
+        start = 1
+        key = (self.budget_tokens, pooled.name)
+        if chat_tree.context_start is not None and chat_tree.context_start[0] == key:
+            for index, node in enumerate(path[1:], start=1):
+                if node.node_id == chat_tree.context_start[1]:
+                    start = index
+                    break
+        total = counts[0] + sum(counts[start:])
+
+        if total > budget:
+            target = budget * self.low_water
+            last_turn = max(1, len(path) - 2)  # the latest user message and the response to it
+            while start < last_turn and total > target:
+                total -= counts[start]
+                start += 1
+                # Only cut in front of a user message, so the kept history starts with a whole turn
+                while start < last_turn and path[start].role != "user":
+                    total -= counts[start]
+                    start += 1
+            if total > budget:
+                logger.warning(f"The latest turn alone takes {total} tokens, over the {self.budget_tokens} token budget")
+        chat_tree.context_start = (key, path[start].node_id) if start > 1 else None
+        return [0] + list(range(start, len(path))), total
@@ -0,0 +1,88 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingDetokenizer:
+    """
+    Turns a stream of generated token ids into text as it arrives.
+
+    Decoding tokens one at a time (or in fixed chunks) drops the space that
+    SentencePiece-style tokenizers merge into the following token and splits
+    multi-byte characters across tokens. Instead the tokens since the last emitted
+    text are decoded together with the few before them, and only the text past
+    what those already produced is emitted, once it no longer ends in an
+    incomplete character.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens=True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.token_ids = []
+        self.prefix_offset = 0  # start of the decode window
+        self.read_offset = 0  # tokens before this have been emitted as text
+
+    def push(self, token_id):
+        """Add a token; returns the newly stable text, possibly empty."""
+        self.token_ids.append(token_id)
+        return self._advance(final=False)
+
+    def flush(self):
+        """Return whatever text is still held back at the end of the stream."""
+        return self._advance(final=True)
+
+    def _advance(self, final):
+        if self.read_offset == len(self.token_ids):
+            return ""
+        prefix_text = self._decode(self.token_ids[self.prefix_offset:self.read_offset])
+        text = self._decode(self.token_ids[self.prefix_offset:])
+        # An incomplete UTF-8 sequence decodes to U+FFFD until its last byte arrives
+        if len(text) <= len(prefix_text) or (text.endswith("�") and not final):
+            return ""
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.token_ids)
+        return text[len(prefix_text):]
+
+    def _decode(self, token_ids):
+        return self.tokenizer.decode(token_ids, skip_special_tokens=self.skip_special_tokens)
+
+
+def split_role_name(text, role="assistant"):
+    """
+    Strip the role name some chat templates leave at the start of a response.
+
+    Returns (held, text). While `text` could still turn out to be the role name it
+    is held back entirely; once the response proper has started `held` is None and
+    `text` is the response with the role name and leading whitespace removed.
+    """
+    stripped = text.lstrip()
+    if role.startswith(stripped):
+        return text, ""
+    if stripped.startswith(role) and not stripped[len(role)].isalnum():
+        stripped = stripped[len(role):].lstrip()
+        if not stripped:
+            return text, ""
+    return None, stripped
+
+
+class ResponseDetokenizer:
+    """A StreamingDetokenizer for one response that also strips a leading role name."""
+
+    def __init__(self, tokenizer, role="assistant"):
+        self.detokenizer = StreamingDetokenizer(tokenizer)
+        self.role = role
+        self.held = ""  # start of the response, held back until a leading role name is stripped
+
+    def push(self, token_id):
+        text = self.detokenizer.push(token_id)
+        if self.held is not None:
+            self.held, text = split_role_name(self.held + text, self.role)
+        return text
+
+    def flush(self):
+        text = self.detokenizer.flush()
+        if self.held is not None:
+            # Nothing but (part of) the role name was generated
+            text = (self.held + text).lstrip().removeprefix(self.role).lstrip()
+            self.held = None
+        return text
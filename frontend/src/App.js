@@ -1,5 +1,5 @@
 import React, { useState, useEffect, useRef, useCallback } from 'react';
-import { Layout, Space, message, Spin, List, Typography, Modal } from 'antd';
+import { Layout, Space, message, Spin, List, Typography, Modal, Tag } from 'antd';
 import { BrowserRouter as Router, Routes, Route, useNavigate, useParams } from 'react-router-dom';
 import { MessageItem, ChatInput } from './components';
 import { ModelSettings } from './ModelSettings';
@@ -11,6 +11,32 @@ import './styles/global.css';
 const { Title } = Typography;
 const { Header, Content } = Layout;
 
+const CHAT_PAGE_SIZE = 50;
+
+// Apply a chat_delta event from the server to the current message list
+const applyChatDelta = (messages, delta) => {
+  if (delta.append !== undefined) {
+    return messages.map((msg, i) => (
+      i === delta.index ? { ...msg, content: msg.content + delta.append } : msg
+    ));
+  }
+  if (delta.messages !== undefined) {
+    return [...messages.slice(0, delta.start), ...delta.messages];
+  }
+  return messages;
+};
+
+// Alternatives sampled together with the streaming response, shown until they become its siblings
+const applyAlternativesDelta = (alternatives, delta) => {
+  if (delta.alternatives !== undefined) {
+    return delta.alternatives;
+  }
+  if (delta.alternatives_append !== undefined) {
+    return alternatives.map((text, i) => text + delta.alternatives_append[i]);
+  }
+  return alternatives;
+};
+
 // Wrapper component to handle routing
 const AppWrapper = () => {
   return (
@@ -27,14 +53,20 @@ const App = () => {
   useTheme('light');
   
   const [messages, setMessages] = useState([]);
+  const [alternatives, setAlternatives] = useState([]);
   const [inputMessage, setInputMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const [modelConfigLoading, setModelConfigLoading] = useState(false);
   const [editingIndex, setEditingIndex] = useState(-1);
   const [chatList, setChatList] = useState([]);
+  const [chatTotal, setChatTotal] = useState(0);
+  const [warmingUp, setWarmingUp] = useState([]);
   const [currentChatId, setCurrentChatId] = useState(null);
   const [isChatSaved, setIsChatSaved] = useState(false);
   const chatContainerRef = useRef(null);
+  const lastSeqRef = useRef(0);
+  const resyncingRef = useRef(false);
+  const chatListRef = useRef([]);
   const socket = useSocket();
   const audioControls = useAudio();
   const navigate = useNavigate();
@@ -56,40 +88,94 @@ const App = () => {
   useEffect(() => {
     if (!socket) return;
 
+    // Reload the first page, keeping as many chats as the sidebar already shows
+    const refreshChatList = () => {
+      socket.emit('list_chats', { offset: 0, limit: Math.max(chatListRef.current.length, CHAT_PAGE_SIZE) });
+    };
+
     socket.on('model_config_updated', (data) => {
       setModelConfigLoading(false);
       if (data.success) {
         setModelConfig(data.config);
-        message.success('Model settings updated successfully');
+        if (data.status && data.status.switching) {
+          message.info(`Loading ${data.config.model_name}; ${data.status.serving} keeps answering until it is ready`);
+        } else {
+          message.success('Model settings updated successfully');
+        }
       } else {
         message.error(data.error || 'Failed to update model settings');
       }
     });
 
-    socket.on('chat_history', (data) => {
-      setMessages(data.messages);
-      setIsChatSaved(true);
+    socket.on('model_switched', (data) => {
+      message.success(`Now using ${data.model_name}`);
     });
 
-    socket.on('chat_update', (data) => {
-      setMessages(data.messages);
+    const trackSnapshotSeq = (data) => {
+      if (data.seq !== undefined) {
+        lastSeqRef.current = data.seq;
+        resyncingRef.current = false;
+      }
+    };
+
+    const handleStreamEnd = (data) => {
+      if (data.type === 'resync') {
+        setIsLoading(data.streaming);
+        return;
+      }
       setIsLoading(data.type !== 'stop' && data.type !== 'navigation');
       
       if (currentChatId && data.type === 'stop') {
         socket.emit('save_chat');
       }
+    };
+
+    // Only send what changed during generation instead of the whole history
+    const enableDeltaStream = () => socket.emit('set_stream_mode', { mode: 'delta' });
+    socket.on('connect', enableDeltaStream);
+    enableDeltaStream();
+
+    socket.on('chat_history', (data) => {
+      trackSnapshotSeq(data);
+      setMessages(data.messages);
+      setAlternatives([]);
+      setIsChatSaved(true);
+    });
+
+    // Streamed updates are acknowledged, so the server can slow down for a client that falls behind
+    socket.on('chat_update', (data, ack) => {
+      if (ack) ack();
+      trackSnapshotSeq(data);
+      setMessages(data.messages);
+      setAlternatives(data.alternatives || []);
+      handleStreamEnd(data);
+    });
+
+    socket.on('chat_delta', (data, ack) => {
+      if (ack) ack();
+      if (resyncingRef.current) return;
+      if (data.seq !== lastSeqRef.current + 1) {
+        // Missed an event; ask for a full snapshot
+        resyncingRef.current = true;
+        socket.emit('resync');
+        return;
+      }
+      lastSeqRef.current = data.seq;
+      setMessages(prev => applyChatDelta(prev, data));
+      setAlternatives(prev => applyAlternativesDelta(prev, data));
+      handleStreamEnd(data);
     });
 
     socket.on('chat_saved', (data) => {
       setIsChatSaved(true);
-      socket.emit('list_chats');
+      refreshChatList();
     });
 
     socket.on('new_chat_started', (data) => {
       setCurrentChatId(data.chat_id);
       setIsChatSaved(false);
       message.success('New chat started');
-      socket.emit('list_chats');
+      refreshChatList();
       navigate(`/chat/${data.chat_id}`);
     });
 
@@ -100,7 +186,19 @@ const App = () => {
         last_modified: chat.last_modified,
         preview: chat.name,
       }));
-      setChatList(updatedChatList);
+      const nextChatList = data.offset ? [...chatListRef.current, ...updatedChatList] : updatedChatList;
+      chatListRef.current = nextChatList;
+      setChatList(nextChatList);
+      setChatTotal(data.total);
+    });
+
+    // Chat names are generated in the background after the first response starts
+    socket.on('chat_name', (data) => {
+      const nextChatList = chatListRef.current.map(chat => (
+        chat.id === data.chat_id ? { ...chat, name: data.name, preview: data.name } : chat
+      ));
+      chatListRef.current = nextChatList;
+      setChatList(nextChatList);
     });
 
     socket.on('chat_deleted', (data) => {
@@ -111,27 +209,45 @@ const App = () => {
           navigate('/');
         }
         message.success('Chat deleted successfully');
-        socket.emit('list_chats');
+        refreshChatList();
       } else {
         message.error(data.error || 'Failed to delete chat');
       }
     });
 
     socket.on('error', (data) => {
+      if (data.warming_up) {
+        // The request was rejected before anything streamed
+        setIsLoading(false);
+        setModelConfigLoading(false);
+        message.warning(data.message);
+        return;
+      }
       message.error(data.message);
     });
 
-    socket.emit('list_chats');
+    socket.on('model_status', (data) => {
+      setWarmingUp(Object.entries(data.components)
+        .filter(([, component]) => component.state !== 'ready')
+        .map(([name, component]) => `${name}: ${component.state}`));
+    });
+
+    refreshChatList();
 
     return () => {
       socket.off('model_config_updated');
+      socket.off('model_switched');
       socket.off('chat_history');
       socket.off('chat_update');
+      socket.off('chat_delta');
+      socket.off('connect', enableDeltaStream);
       socket.off('chat_saved');
       socket.off('new_chat_started');
       socket.off('chat_list');
+      socket.off('chat_name');
       socket.off('chat_deleted');
       socket.off('error');
+      socket.off('model_status');
     };
   }, [socket, currentChatId, navigate]);
 
@@ -152,6 +268,10 @@ const App = () => {
     socket.emit('update_model_config', values);
   };
 
+  const handleLoadMoreChats = () => {
+    socket.emit('list_chats', { offset: chatListRef.current.length, limit: CHAT_PAGE_SIZE });
+  };
+
   const handleDeleteChat = (chatId) => {
     Modal.confirm({
       title: 'Delete Chat',
@@ -181,8 +301,7 @@ const App = () => {
 
     if (audioControls.audioBlob) {
       try {
-        const audioUrl = await uploadAudio(audioControls.audioBlob);
-        messageContent = await transcribeAudio(audioUrl);
+        messageContent = await transcribeAudio(audioControls.audioBlob);
       } catch (error) {
         console.error('Error processing audio:', error);
         message.error('Failed to process audio. Please try again.');
@@ -197,31 +316,15 @@ const App = () => {
     setIsChatSaved(false);
   };
 
-  const uploadAudio = async (blob) => {
+  // Upload and transcription in a single request; the server never stores the audio
+  const transcribeAudio = async (blob) => {
     const formData = new FormData();
     const file = new File([blob], 'audio.webm', { type: 'audio/webm' });
     formData.append('audio', file);
-  
-    const response = await fetch('/api/upload_audio', {
-      method: 'POST',
-      body: formData,
-    });
-  
-    if (!response.ok) {
-      throw new Error('Failed to upload audio');
-    }
-  
-    const data = await response.json();
-    return data.filename;
-  };
 
-  const transcribeAudio = async (filename) => {
-    const response = await fetch('/api/transcribe', {
+    const response = await fetch('/api/transcribe_audio', {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ filename }),
+      body: formData,
     });
 
     if (!response.ok) {
@@ -277,14 +380,20 @@ const App = () => {
     setIsChatSaved(false);
   }, [socket]);
 
-  const handleRegenerate = useCallback((index) => {
+  const handleRegenerate = useCallback((index, n = 1) => {
     socket.emit('regenerate', {
-      level: messages.length - index - 1
+      level: messages.length - index - 1,
+      n
     });
     setIsLoading(true);
     setIsChatSaved(false);
   }, [socket, messages]);
 
+  // The partial response stays; the server ends the stream with the usual 'stop' update
+  const handleStop = useCallback(() => {
+    socket.emit('stop_generation');
+  }, [socket]);
+
   const getLastSystemMessageIndex = useCallback(() => {
     for (let i = messages.length - 1; i >= 0; i--) {
       if (messages[i].role === 'assistant') {
@@ -298,6 +407,9 @@ const App = () => {
     <Layout className={styleUtils.classNames('app-layout')}>
       <Header className="app-header">
         <Title level={3}>Local Chatbot</Title>
+        {warmingUp.length > 0 && (
+          <Tag color="processing">Warming up ({warmingUp.join(', ')})</Tag>
+        )}
         <ModelSettings 
           currentConfig={modelConfig}
           onUpdateSettings={handleUpdateModelSettings}
@@ -312,6 +424,8 @@ const App = () => {
           onNewChat={handleNewChat}
           onUpdateChatName={handleChatNameEdit}
           onDeleteChat={handleDeleteChat}
+          hasMoreChats={chatList.length < chatTotal}
+          onLoadMoreChats={handleLoadMoreChats}
         />
         <Layout>
           <Content className="main-content">
@@ -334,6 +448,7 @@ const App = () => {
                       isLastSystemMessage={index === getLastSystemMessageIndex()}
                       handleContinue={handleContinue}
                       handleRegenerate={handleRegenerate}
+                      alternatives={index === messages.length - 1 ? alternatives : []}
                       isLoading={isLoading}
                     />
                   </List.Item>
@@ -344,6 +459,7 @@ const App = () => {
               inputMessage={inputMessage}
               setInputMessage={setInputMessage}
               handleSubmit={handleSubmit}
+              handleStop={handleStop}
               isLoading={isLoading}
               audioControls={audioControls}
             />
@@ -19,7 +19,9 @@ const ChatNavigation = ({
   onNewChat,
   onChatSelect,
   onUpdateChatName, 
-  onDeleteChat 
+  onDeleteChat,
+  hasMoreChats,
+  onLoadMoreChats
 }) => {
   const [editingChatId, setEditingChatId] = useState(null);
   const [editingName, setEditingName] = useState('');
@@ -82,6 +84,11 @@ const ChatNavigation = ({
         <div className="chat-list-wrapper scrollable">
           <List
             dataSource={sortedChats}
+            loadMore={hasMoreChats && (
+              <div style={{ textAlign: 'center', margin: '8px 0' }}>
+                <Button size="small" onClick={onLoadMoreChats}>Load more</Button>
+              </div>
+            )}
             renderItem={(chat) => (
               <List.Item 
                 onClick={() => onChatSelect(chat.id)}
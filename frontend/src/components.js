@@ -10,14 +10,19 @@ import {
   LeftOutlined, 
   RightOutlined,
   SyncOutlined,
+  BranchesOutlined,
   PlusCircleOutlined,
   CheckOutlined,
   DeleteOutlined,
-  CloseOutlined
+  CloseOutlined,
+  StopOutlined
 } from '@ant-design/icons';
 import { styleUtils } from './styles/useTheme';
 
 const { Text } = Typography;
+
+// Responses sampled at once by the "alternatives" button; browse them with prev/next
+const REGENERATE_ALTERNATIVES = 4;
 const { Header, Content, Footer, Sider } = Layout;
 
 export const MessageItem = ({ 
@@ -31,6 +36,7 @@ export const MessageItem = ({
   isLastSystemMessage, 
   handleContinue, 
   handleRegenerate, 
+  alternatives = [],
   isLoading 
 }) => {
   const [editContent, setEditContent] = useState(item.content);
@@ -72,6 +78,12 @@ export const MessageItem = ({
       >
         <Text className="message-text">{item.content}</Text>
       </div>
+      {alternatives.map((text, i) => (
+        <div key={i} className={styleUtils.classNames('message-content', 'message-content--assistant', 'message-content--alternative')}>
+          <Text type="secondary" className="sibling-counter">{`${currentSibling + i + 1} / ${totalSiblings}`}</Text>
+          <Text className="message-text">{text}</Text>
+        </div>
+      ))}
       {(isLastSystemMessage || isHovered) && (
         <Space className="message-actions">
           {item.role === 'user' && (
@@ -135,6 +147,15 @@ export const MessageItem = ({
                   className="action-button"
                 />
               </Tooltip>
+              <Tooltip title={`Regenerate ${REGENERATE_ALTERNATIVES} alternatives`}>
+                <Button 
+                  type="text" 
+                  icon={<BranchesOutlined />} 
+                  onClick={() => handleRegenerate(index, REGENERATE_ALTERNATIVES)}
+                  loading={isLoading}
+                  className="action-button"
+                />
+              </Tooltip>
             </>
           )}
         </Space>
@@ -143,7 +164,7 @@ export const MessageItem = ({
   );
 };
 
-export const ChatInput = ({ inputMessage, setInputMessage, handleSubmit, isLoading, audioControls }) => {
+export const ChatInput = ({ inputMessage, setInputMessage, handleSubmit, handleStop, isLoading, audioControls }) => {
   const { isRecording, audioBlob, isPlaying, startRecording, stopRecording, playRecording, pauseRecording } = audioControls;
 
   return (
@@ -178,13 +199,24 @@ export const ChatInput = ({ inputMessage, setInputMessage, handleSubmit, isLoadi
           {isPlaying ? 'Pause' : 'Play'}
         </Button>
       )}
-      <Button 
-        type="primary" 
-        onClick={handleSubmit} 
-        icon={<SendOutlined />} 
-        loading={isLoading}
-        className="send-button"
-      />
+      {isLoading ? (
+        <Tooltip title="Stop generating">
+          <Button
+            type="primary"
+            danger
+            onClick={handleStop}
+            icon={<StopOutlined />}
+            className="send-button"
+          />
+        </Tooltip>
+      ) : (
+        <Button 
+          type="primary" 
+          onClick={handleSubmit} 
+          icon={<SendOutlined />} 
+          className="send-button"
+        />
+      )}
     </Space.Compact>
   );
 };
\ No newline at end of file
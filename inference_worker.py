@@ -0,0 +1,526 @@
+"""
+Model inference in worker processes, so generation never competes with the web
+process for its interpreter.
+
+The web process runs a RemoteChatBot: it keeps the tokenizers, builds prompts and
+detokenizes responses, and hands token ids to InferenceWorkers, which has the
+BatchScheduler interface. Each worker is a separate Python process (this file run
+as a script) holding a regular ChatBot with the model pool, prefix cache and batch
+scheduler; requests and sampled tokens travel over a multiprocessing Pipe.
+"""
+import argparse
+import importlib
+import itertools
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+
+import torch
+
+from chatbot import ChatBot
+from model_pool import eos_token_ids, input_device
+from scheduler import GenerationRequest, iter_group
+
+logger = logging.getLogger(__name__)
+
+STATUS_INTERVAL = 2  # seconds between the status reports (and stats) a worker sends
+RESTART_DELAY = 1  # seconds before a crashed worker is restarted, doubling up to MAX_RESTART_DELAY
+MAX_RESTART_DELAY = 30
+STABLE_AFTER = 60  # a worker that ran this long before crashing restarts after RESTART_DELAY again
+MAX_FAILED_STARTS = 3  # crashes before a worker ever became ready, after which it is given up on
+
+
+class RemoteModel:
+    """The web process's side of a model served by the workers: its name and tokenizer, no weights."""
+
+    def __init__(self, name, tokenizer):
+        self.name = name
+        self.model = None
+        self.tokenizer = tokenizer
+        # The workers stop at the model's own EOS ids; this is only the tokenizer's
+        self.eos_token_ids = eos_token_ids(None, tokenizer)
+
+
+class RemoteRequest(GenerationRequest):
+    """A GenerationRequest decoded by an inference worker; its tokens arrive over the worker's connection."""
+
+    def __init__(self, workers, request_id, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.workers = workers
+        self.request_id = request_id
+        self.worker = None
+
+    def cancel(self):
+        if self.cancelled or self.done:
+            return
+        super().cancel()
+        self.workers._cancel(self)
+
+
+class WorkerProcess:
+    """One inference worker process slot, restarted by InferenceWorkers whenever its process exits."""
+
+    def __init__(self, index, device, model_config_file, bot_class):
+        self.index = index
+        self.device = device
+        self.model_config_file = model_config_file
+        self.bot_class = bot_class
+        self.process = None
+        self.conn = None
+        self.state = "stopped"  # starting, ready, restarting, failed or stopped
+        self.status = {}  # the worker's last status report
+        self.in_flight = 0
+        self.restarts = 0
+        self.failed_starts = 0
+        self.started_at = None
+        self._send_lock = threading.Lock()
+
+    def start(self):
+        parent_conn, child_conn = Pipe()
+        env = dict(os.environ)
+        if self.device is not None:
+            env["CUDA_VISIBLE_DEVICES"] = str(self.device)
+        self.process = subprocess.Popen(
+            [
+                sys.executable, os.path.abspath(__file__),
+                "--fd", str(child_conn.fileno()),
+                "--index", str(self.index),
+                "--config", self.model_config_file,
+                "--bot-class", self.bot_class,
+            ],
+            pass_fds=(child_conn.fileno(),),
+            env=env,
+        )
+        child_conn.close()
+        self.conn = parent_conn
+        self.state = "starting"
+        self.started_at = time.monotonic()
+        logger.info(f"Started inference worker {self.index} (pid {self.process.pid}, device {self.device})")
+
+    def send(self, message):
+        with self._send_lock:
+            self.conn.send(message)
+
+    def serves(self, model_name):
+        return self.state == "ready" and model_name in self.status.get("models", ())
+
+    def stats(self):
+        return {
+            "index": self.index,
+            "device": self.device,
+            "pid": self.process.pid if self.process else None,
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "restarts": self.restarts,
+            "serving": self.status.get("serving"),
+            "models": self.status.get("models", []),
+            "stats": self.status.get("stats"),
+        }
+
+
+class InferenceWorkers:
+    """
+    The worker processes behind a RemoteChatBot, with the BatchScheduler interface.
+
+    One worker runs per entry in `devices`, each with CUDA_VISIBLE_DEVICES set to it
+    (None inherits the web process's). A request goes to the least busy ready worker
+    serving its model, and a group from `submit_group` stays on one worker so it
+    shares a prefill. Every worker has a supervisor thread that reads its connection
+    and restarts the process with a growing delay when it exits; the requests it was
+    decoding fail with an error, but the web process and the other workers carry on.
+    """
+
+    def __init__(self, model_config_file, devices=(None,), bot_class="chatbot:ChatBot", on_status=None):
+        self.workers = [
+            WorkerProcess(index, device, os.path.abspath(model_config_file), bot_class)
+            for index, device in enumerate(devices)
+        ]
+        self.on_status = on_status  # called with no arguments after every status report
+        self._requests = {}  # request id -> the RemoteRequests of one submission
+        self._ids = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def start(self):
+        for worker in self.workers:
+            threading.Thread(target=self._supervise, args=(worker,), name=f"inference-worker-{worker.index}", daemon=True).start()
+
+    def wait_ready(self, timeout=None):
+        """Block until a worker is ready; raises RuntimeError once every worker has failed to start."""
+        with self._condition:
+            ready = self._condition.wait_for(
+                lambda: any(worker.state == "ready" for worker in self.workers) or
+                all(worker.state == "failed" for worker in self.workers),
+                timeout,
+            )
+            if not ready:
+                raise TimeoutError("No inference worker became ready in time")
+            if not any(worker.state == "ready" for worker in self.workers):
+                raise RuntimeError("Every inference worker failed to start")
+
+    def serving(self, model_name):
+        """Whether every ready worker serves `model_name`."""
+        ready = [worker for worker in self.workers if worker.state == "ready"]
+        return bool(ready) and all(worker.status.get("serving") == model_name for worker in ready)
+
+    def configure(self, config):
+        """Apply a model config on every running worker; restarted workers read it from the config file."""
+        for worker in self.workers:
+            if worker.state in ("starting", "ready"):
+                try:
+                    worker.send(("config", config))
+                except OSError as e:
+                    logger.warning(f"Could not configure inference worker {worker.index}: {e}")
+
+    def submit(self, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, background=False, model=None):
+        return self._submit(1, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, background, model)[0]
+
+    def submit_group(self, n, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, model=None):
+        """Sample `n` continuations of one prompt on one worker; consume them with `iter_group`."""
+        return self._submit(n, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, False, model)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "workers": [worker.stats() for worker in self.workers],
+                "ready": sum(worker.state == "ready" for worker in self.workers),
+                "restarts": sum(worker.restarts for worker in self.workers),
+                "in_flight": len(self._requests),
+            }
+
+    def close(self):
+        self._closed = True
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                worker.process.terminate()
+
+    def _submit(self, n, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, background, model):
+        request_id = next(self._ids)
+        requests = [
+            RemoteRequest(self, request_id, model, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, background)
+            for _ in range(n)
+        ]
+        if n > 1:
+            shared = requests[0]._tokens
+            for request in requests:
+                request.group = requests
+                request._tokens = shared
+        sampling = dict(max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+        with self._condition:
+            candidates = [worker for worker in self.workers if worker.serves(model.name)]
+            worker = min(candidates, key=lambda worker: worker.in_flight) if candidates else None
+            if worker is not None:
+                for request in requests:
+                    request.worker = worker
+                worker.in_flight += 1
+                self._requests[request_id] = requests
+        if worker is None:
+            for request in requests:
+                request._finish(error=RuntimeError(f"No inference worker is serving {model.name}"))
+            return requests
+        try:
+            worker.send(("generate", request_id, model.name, requests[0].prompt_ids, sampling, n, background))
+        except OSError as e:
+            # The supervisor fails everything the worker had once it notices the exit
+            logger.warning(f"Could not send request to inference worker {worker.index}: {e}")
+        return requests
+
+    def _cancel(self, request):
+        try:
+            request.worker.send(("cancel", request.request_id))
+        except (OSError, AttributeError):
+            pass
+
+    def _supervise(self, worker):
+        delay = RESTART_DELAY
+        while not self._closed:
+            worker.start()
+            self._read(worker)
+            code = worker.process.wait()
+            ran_for = time.monotonic() - worker.started_at
+            was_ready = worker.state == "ready"
+            self._fail_requests(worker, RuntimeError(f"Inference worker {worker.index} exited with code {code}"))
+            if self._closed:
+                break
+            with self._condition:
+                if not was_ready:
+                    worker.failed_starts += 1
+                worker.restarts += 1
+                worker.status = {}
+                if worker.failed_starts >= MAX_FAILED_STARTS:
+                    worker.state = "failed"
+                else:
+                    worker.state = "restarting"
+                self._condition.notify_all()
+            if worker.state == "failed":
+                logger.error(f"Inference worker {worker.index} failed to start {worker.failed_starts} times; giving up on it")
+                break
+            delay = RESTART_DELAY if ran_for > STABLE_AFTER else delay
+            logger.error(f"Inference worker {worker.index} exited with code {code} after {ran_for:.0f}s; restarting in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+        worker.conn = None
+
+    def _read(self, worker):
+        """Route the worker's messages until its connection closes."""
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                return
+            kind = message[0]
+            if kind == "token":
+                _, request_id, index, token_id = message
+                requests = self._requests.get(request_id)
+                if requests is not None:
+                    requests[index]._emit(token_id)
+            elif kind == "done":
+                _, request_id, index, summary, error = message
+                self._done(request_id, index, summary, error)
+            elif kind in ("ready", "status"):
+                with self._condition:
+                    worker.status = message[1]
+                    if kind == "ready":
+                        worker.state = "ready"
+                        worker.failed_starts = 0
+                        logger.info(f"Inference worker {worker.index} is ready, serving {worker.status['serving']}")
+                    self._condition.notify_all()
+                if self.on_status:
+                    self.on_status()
+
+    def _done(self, request_id, index, summary, error):
+        requests = self._requests.get(request_id)
+        if requests is None:
+            return
+        request = requests[index]
+        request.cached_prompt_tokens = summary.get("cached_prompt_tokens", 0)
+        request.draft_proposed = summary.get("draft_proposed", 0)
+        request.draft_accepted = summary.get("draft_accepted", 0)
+        # Tokens the worker sampled after the cancel, on top of those that arrived here after it
+        request.wasted_tokens += summary.get("wasted_tokens", 0)
+        request._finish(error=RuntimeError(error) if error else None)
+        if all(request.done for request in requests):
+            with self._condition:
+                if self._requests.pop(request_id, None) is not None:
+                    request.worker.in_flight -= 1
+
+    def _fail_requests(self, worker, error):
+        with self._condition:
+            failed = {request_id: requests for request_id, requests in self._requests.items() if requests[0].worker is worker}
+            for request_id in failed:
+                del self._requests[request_id]
+            worker.in_flight = 0
+            worker.state = "restarting"
+        for requests in failed.values():
+            for request in requests:
+                request._finish(error=error)
+        if failed:
+            logger.warning(f"Failed {len(failed)} requests of inference worker {worker.index}")
+
+
+class RemoteChatBot(ChatBot):
+    """
+    A ChatBot whose models run in InferenceWorkers processes.
+
+    The web process only loads tokenizers: prompts are built and responses
+    detokenized here, while model loading, switching, prefix caching and batching
+    happen inside every worker. Config changes are validated and saved here, then
+    forwarded to the workers; the bot switches to a new model once every ready
+    worker serves it.
+    """
+
+    def __init__(self, *args, devices=(None,), bot_class="chatbot:ChatBot", **kwargs):
+        self.devices = devices
+        self.bot_class = bot_class
+        self._remote_models = {}  # model name -> RemoteModel
+        self._switch_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def make_prefix_cache(self):
+        # Every worker keeps its own prefix cache and model pool
+        return None
+
+    def make_model_pool(self):
+        return None
+
+    def make_scheduler(self):
+        return InferenceWorkers(self.model_config_file, self.devices, self.bot_class, on_status=self._check_switch)
+
+    def load(self):
+        """Load the tokenizer and start the workers; returns once one of them serves the configured model."""
+        self.current_model = self._load_remote_model(self.model_name)
+        self.scheduler.start()
+        self.scheduler.wait_ready()
+        logger.info(f"Serving model {self.model_name} from {len(self.devices)} inference workers")
+        return self
+
+    def draft_for(self, model):
+        # The workers decode speculatively themselves
+        return None
+
+    def _apply_model_changes(self, model_changed, draft_changed):
+        self.scheduler.configure(self.get_model_config())
+        if model_changed:
+            threading.Thread(target=self._prepare_switch, args=(self.model_name,), name="load-tokenizer", daemon=True).start()
+
+    def _prepare_switch(self, model_name):
+        try:
+            self._load_remote_model(model_name)
+        except Exception as e:
+            logger.error(f"Loading the tokenizer of {model_name} failed: {e}", exc_info=True)
+            return
+        self._check_switch()
+
+    def _load_remote_model(self, model_name):
+        entry = self._remote_models.get(model_name)
+        if entry is None:
+            entry = self._remote_models[model_name] = RemoteModel(model_name, self.load_tokenizer(model_name))
+        return entry
+
+    def _check_switch(self):
+        """Switch to the configured model once its tokenizer is loaded and every ready worker serves it."""
+        with self._switch_lock:
+            entry = self._remote_models.get(self.model_name)
+            if entry is None or entry is self.current_model or not self.scheduler.serving(entry.name):
+                return
+            self.current_model = entry
+        logger.info(f"Switched to model {entry.name}")
+        if self.on_model_switch:
+            self.on_model_switch(entry.name)
+
+    def get_model_status(self):
+        return {
+            "serving": self.current_model.name if self.current_model else None,
+            "configured": self.model_name,
+            "switching": self.current_model is not None and self.current_model.name != self.model_name,
+            "workers": [
+                {"index": worker.index, "state": worker.state, "serving": worker.status.get("serving"),
+                 "models": worker.status.get("models", [])}
+                for worker in self.scheduler.workers
+            ],
+        }
+
+    def get_stats(self):
+        return {
+            "generation": self.last_generation_stats,
+            "prompt_builder": self.prompt_builder.stats(),
+            "scheduler": self.scheduler.stats(),
+            "models": self.get_model_status(),
+        }
+
+
+def worker_status(bot):
+    return {
+        "serving": bot.current_model.name,
+        "models": [entry["model_name"] for entry in bot.model_pool.stats()["models"]],
+        "stats": {
+            "scheduler": bot.scheduler.stats(),
+            "prefix_cache": bot.prefix_cache.stats(),
+            "models": bot.get_model_status(),
+        },
+    }
+
+
+def _relay(requests, request_id, send):
+    """Send the tokens of one submission back to the web process, then a 'done' per request."""
+    errors = {}
+    try:
+        if len(requests) == 1:
+            for token_id in requests[0]:
+                send(("token", request_id, 0, token_id))
+        else:
+            for request, token_id in iter_group(requests):
+                send(("token", request_id, requests.index(request), token_id))
+    except Exception as e:
+        errors = {index: str(request.error or e) for index, request in enumerate(requests)}
+    for index, request in enumerate(requests):
+        summary = {
+            "cached_prompt_tokens": request.cached_prompt_tokens,
+            "draft_proposed": request.draft_proposed,
+            "draft_accepted": request.draft_accepted,
+            "wasted_tokens": request.wasted_tokens,
+        }
+        send(("done", request_id, index, summary, errors.get(index)))
+
+
+def serve(conn, bot):
+    """Decode the web process's requests on `bot` until the connection closes."""
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def report_status():
+        while True:
+            time.sleep(STATUS_INTERVAL)
+            send(("status", worker_status(bot)))
+
+    running = {}  # request id -> GenerationRequests
+    bot.on_model_switch = lambda model_name: send(("status", worker_status(bot)))
+    send(("ready", worker_status(bot)))
+    threading.Thread(target=report_status, name="status", daemon=True).start()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            logger.info("The web process went away")
+            return
+        kind = message[0]
+        if kind == "generate":
+            _, request_id, model_name, prompt_ids, sampling, n, background = message
+            pooled = bot.model_pool.get(model_name)
+            if pooled is None:
+                for index in range(n):
+                    send(("done", request_id, index, {}, f"Model {model_name} is not loaded in this worker"))
+                continue
+            input_ids = torch.tensor([prompt_ids], device=input_device(pooled))
+            if n == 1:
+                requests = [bot.scheduler.submit(input_ids, eos_token_ids=pooled.eos_token_ids, background=background,
+                                                 model=pooled, **sampling)]
+            else:
+                requests = bot.scheduler.submit_group(n, input_ids, eos_token_ids=pooled.eos_token_ids, model=pooled, **sampling)
+            running[request_id] = requests
+
+            def relay(requests=requests, request_id=request_id):
+                try:
+                    _relay(requests, request_id, send)
+                finally:
+                    running.pop(request_id, None)
+
+            threading.Thread(target=relay, name=f"relay-{request_id}", daemon=True).start()
+        elif kind == "cancel":
+            for request in running.get(message[1], ()):
+                request.cancel()
+        elif kind == "config":
+            try:
+                # The web process owns the config file; the worker only applies it
+                bot.update_model_config(message[1], save=False)
+            except ValueError as e:
+                logger.warning(f"Rejected model config: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference worker process, started by InferenceWorkers")
+    parser.add_argument("--fd", type=int, required=True, help="file descriptor of the connection to the web process")
+    parser.add_argument("--index", type=int, default=0)
+    parser.add_argument("--config", required=True, help="model config file shared with the web process")
+    parser.add_argument("--bot-class", default="chatbot:ChatBot", help="module:class of the ChatBot to load the models with")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - worker {args.index} - %(name)s - %(levelname)s - %(message)s')
+
+    conn = Connection(args.fd)
+    module_name, class_name = args.bot_class.split(":")
+    bot_class = getattr(importlib.import_module(module_name), class_name)
+    # Chats live in the web process, so the worker saves none
+    bot = bot_class(model_config_file=args.config, chat_dir=None)
+    serve(conn, bot)
+
+
+if __name__ == '__main__':
+    main()
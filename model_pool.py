@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class PooledModel:
+    """A loaded model with its tokenizer and what it cost to load."""
+
+    def __init__(self, name, model, tokenizer, load_time):
+        self.name = name
+        self.model = model
+        self.tokenizer = tokenizer
+        self.load_time = load_time
+        self.memory_bytes = model_memory_bytes(model)
+        self.eos_token_ids = eos_token_ids(model, tokenizer)
+        self.last_used = time.time()
+
+    def stats(self):
+        return {
+            "model_name": self.name,
+            "load_time": self.load_time,
+            "memory_mb": self.memory_bytes / (1024 * 1024),
+            "last_used": self.last_used,
+        }
+
+
+def input_device(pooled):
+    """
+    Device prompts for `pooled` go to: its input embeddings', wherever the backend or
+    device map put them, or the CPU for a model in another process.
+    """
+    if pooled.model is None:
+        return 'cpu'
+    return pooled.model.get_input_embeddings().weight.device
+
+
+def model_memory_bytes(model):
+    """
+    Resident size of a model's weights, counted from its state dict: that also holds
+    the packed weights of dynamically quantized layers, which are neither parameters
+    nor buffers. Tied weights are counted once.
+    """
+    seen = set()
+    return sum(_tensor_bytes(value, seen) for value in model.state_dict().values())
+
+
+def _tensor_bytes(value, seen):
+    if isinstance(value, torch.Tensor):
+        if value.data_ptr() in seen:
+            return 0
+        seen.add(value.data_ptr())
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item, seen) for item in value)
+    return 0
+
+
+def eos_token_ids(model, tokenizer):
+    """The tokenizer's EOS plus any extra ones in the model's generation config."""
+    ids = {tokenizer.eos_token_id}
+    config_eos = getattr(getattr(model, 'generation_config', None), 'eos_token_id', None)
+    if isinstance(config_eos, int):
+        ids.add(config_eos)
+    elif config_eos:
+        ids.update(config_eos)
+    return ids
+
+
+class ModelPool:
+    """
+    Keeps up to `max_models` loaded models within `max_memory_mb` (0 for no memory
+    limit), evicting the least recently used one that is not active.
+
+    Models are loaded one at a time, either blocking with `load` or on a background
+    thread with `load_async`, so the active model keeps serving while another one
+    loads. Switching back to a model that is still in the pool is free.
+    """
+
+    def __init__(self, load_fn, max_models=2, max_memory_mb=0, on_evict=None):
+        self.load_fn = load_fn
+        self.on_evict = on_evict
+        self.max_models = max_models
+        self.max_memory_mb = max_memory_mb
+        self.active = None
+        self._models = OrderedDict()  # name -> PooledModel, least recently used first
+        self._loading = {}  # name -> callbacks waiting for the model
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.errors = {}  # name -> last load error
+        self.evictions = 0
+
+    def get(self, name):
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is not None:
+                self._models.move_to_end(name)
+                entry.last_used = time.time()
+            return entry
+
+    def load(self, name):
+        """Return the pooled model `name`, loading it first if needed."""
+        entry = self.get(name)
+        if entry is not None:
+            return entry
+        with self._load_lock:
+            # Another thread may have loaded it while this one waited
+            entry = self.get(name)
+            if entry is None:
+                entry = self._load(name)
+        return entry
+
+    def load_async(self, name, on_ready=None, on_error=None):
+        """Load `name` on a background thread and call `on_ready(entry)` when it is in the pool."""
+        entry = self.get(name)
+        if entry is not None:
+            if on_ready:
+                on_ready(entry)
+            return
+        with self._lock:
+            callbacks = self._loading.get(name)
+            if callbacks is not None:
+                callbacks.append((on_ready, on_error))
+                return
+            self._loading[name] = [(on_ready, on_error)]
+        threading.Thread(target=self._load_in_background, args=(name,), name=f"load-{name}", daemon=True).start()
+
+    def is_loading(self, name):
+        with self._lock:
+            return name in self._loading
+
+    def set_active(self, entry):
+        with self._lock:
+            self.active = entry
+            self._models.move_to_end(entry.name)
+            entry.last_used = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active.name if self.active else None,
+                "models": [entry.stats() for entry in self._models.values()],
+                "loading": list(self._loading),
+                "errors": dict(self.errors),
+                "memory_mb": sum(entry.memory_bytes for entry in self._models.values()) / (1024 * 1024),
+                "max_models": self.max_models,
+                "max_memory_mb": self.max_memory_mb,
+                "evictions": self.evictions,
+            }
+
+    def _load_in_background(self, name):
+        try:
+            entry = self.load(name)
+        except Exception as e:
+            logger.error(f"Loading model {name} failed: {e}", exc_info=True)
+            with self._lock:
+                callbacks = self._loading.pop(name, [])
+            for _, on_error in callbacks:
+                if on_error:
+                    on_error(name, e)
+            return
+        with self._lock:
+            callbacks = self._loading.pop(name, [])
+        for on_ready, _ in callbacks:
+            if on_ready:
+                on_ready(entry)
+
+    def _load(self, name):
+        # Make room first: a model that is about to be dropped should not share the GPU with the new one
+        self._evict(reserve=1)
+        logger.info(f"Loading model {name}")
+        start_time = time.perf_counter()
+        try:
+            model, tokenizer = self.load_fn(name)
+        except Exception as e:
+            self.errors[name] = str(e)
+            raise
+        entry = PooledModel(name, model, tokenizer, time.perf_counter() - start_time)
+        with self._lock:
+            self.errors.pop(name, None)
+            self._models[name] = entry
+        self._evict(keep=entry)
+        logger.info(f"Loaded model {name} in {entry.load_time:.1f}s, {entry.memory_bytes / (1024 * 1024):.0f} MB")
+        return entry
+
+    def _evict(self, reserve=0, keep=None):
+        """Drop least recently used models other than the active one and `keep` until there is room for `reserve` more."""
+        evicted = []
+        with self._lock:
+            while True:
+                memory_mb = sum(entry.memory_bytes for entry in self._models.values()) / (1024 * 1024)
+                over_count = len(self._models) + reserve > self.max_models
+                over_memory = self.max_memory_mb and memory_mb > self.max_memory_mb
+                candidates = [name for name, entry in self._models.items() if entry is not self.active and entry is not keep]
+                if not (over_count or over_memory) or not candidates:
+                    break
+                del self._models[candidates[0]]
+                evicted.append(candidates[0])
+                self.evictions += 1
+        for name in evicted:
+            logger.info(f"Evicted model {name} from the pool")
+            if self.on_evict:
+                self.on_evict(name)
+        # Requests still decoding on an evicted model keep it alive until they finish
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
@@ -0,0 +1,131 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from transformers import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+
+def cache_to_layers(past_key_values):
+    """Return the per-layer (key, value) tensors of a model's past_key_values."""
+    if hasattr(past_key_values, 'layers'):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        return list(past_key_values.to_legacy_cache())
+    return list(past_key_values)
+
+
+def layers_to_cache(layers):
+    """Build a cache object the model accepts as past_key_values from (key, value) tensors."""
+    if hasattr(DynamicCache, 'from_legacy_cache'):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(layers)
+
+
+def _common_prefix_length(a, b, limit):
+    length = 0
+    for x, y in zip(a, b):
+        if length >= limit or x != y:
+            break
+        length += 1
+    return length
+
+
+class PrefixCache:
+    """
+    LRU cache of KV state keyed by token prefix.
+
+    An entry is stored when a response ends, so it covers the whole branch up to that
+    message boundary. A new prompt reuses the longest cached prefix it shares with any
+    entry (cropped to the shared length), which means regenerate/edit/continue on an
+    existing branch only prefill the tokens after the shared part. Entries are tagged
+    with the model that produced them and only served to that model.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (model, tuple(token_ids)) -> (layers, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+
+    def lookup(self, token_ids, model=None):
+        """
+        Return (num_cached_tokens, past_key_values) for the longest cached prefix of
+        token_ids, or (0, None) on a miss. The last token is never served from the
+        cache because the caller needs its logits to sample the next token.
+        """
+        limit = len(token_ids) - 1
+        with self._lock:
+            best_key, best_length = None, 0
+            for key in self._entries:
+                if key[0] != model:
+                    continue
+                length = _common_prefix_length(key[1], token_ids, limit)
+                if length > best_length:
+                    best_key, best_length = key, length
+            if best_key is None:
+                self.misses += 1
+                return 0, None
+            self._entries.move_to_end(best_key)
+            layers, _ = self._entries[best_key]
+            self.hits += 1
+            self.reused_tokens += best_length
+
+        logger.debug(f"Prefix cache hit: reusing {best_length} of {len(token_ids)} prompt tokens")
+        return best_length, layers_to_cache([(k[:, :, :best_length], v[:, :, :best_length]) for k, v in layers])
+
+    def store(self, token_ids, past_key_values, model=None):
+        """Remember the KV state of `token_ids`, the tokens that were fed to produce `past_key_values`."""
+        layers = cache_to_layers(past_key_values)
+        if not token_ids or not layers or layers[0][0].shape[2] < len(token_ids):
+            return
+        # Copies, so an entry does not keep a whole batch's (or a longer sequence's) KV storage alive
+        layers = [(k[:, :, :len(token_ids)].clone(), v[:, :, :len(token_ids)].clone()) for k, v in layers]
+        nbytes = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+        if nbytes > self.max_bytes:
+            logger.debug(f"Not caching {len(token_ids)} tokens: {nbytes} bytes exceeds the budget")
+            return
+
+        key = (model, tuple(token_ids))
+        ids = key[1]
+        with self._lock:
+            # A stored prefix of this sequence can never win a lookup against it
+            for other in [other for other in self._entries
+                          if other[0] == model and len(other[1]) <= len(ids) and ids[:len(other[1])] == other[1]]:
+                self._remove(other)
+            while self._entries and self._bytes + nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (layers, nbytes)
+            self._bytes += nbytes
+
+    def _remove(self, key):
+        _, nbytes = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def clear(self, model=None):
+        """Drop every entry, or only those of `model`."""
+        with self._lock:
+            if model is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [key for key in self._entries if key[0] == model]:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reused_tokens": self.reused_tokens,
+            }
@@ -0,0 +1,101 @@
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Assembled prompts are checked against a full render and encode this often per model
+VERIFY_EVERY = 50
+
+
+def _message(node):
+    return {"role": node.role, "content": node.content}
+
+
+class PromptBuilder:
+    """
+    Builds prompt token ids from per-node segments instead of rendering and encoding
+    the whole conversation on every request.
+
+    A node's segment is the text its message adds to the chat template after the
+    message before it (a render diff), encoded once and memoized on the node for that
+    model and predecessor until its content changes. A prompt is the concatenation of
+    the segments on the path plus the generation prompt, so only new or changed
+    messages are tokenized.
+
+    Templates that do not render message by message, or tokenizers that merge across
+    message boundaries, would make the assembled prompt differ from a full encode.
+    The first prompt for each model, and every VERIFY_EVERY-th after it, is compared
+    with a full encode; on a mismatch the model falls back to full encodes for good.
+    """
+
+    def __init__(self, verify_every=VERIFY_EVERY):
+        self.verify_every = verify_every
+        self._builds = Counter()  # model name -> prompts built from segments
+        self._generation_prompts = {}  # model name -> token ids of the generation prompt
+        self.unsupported = set()  # models whose prompts are always fully encoded
+        self.segments_encoded = 0
+        self.full_encodes = 0
+
+    def supports(self, pooled):
+        return pooled.name not in self.unsupported
+
+    def segment(self, node, previous, pooled):
+        """Token ids `node` adds to a prompt after `previous` (None for the first message)."""
+        key = (pooled.name, previous.node_id if previous is not None else None)
+        if node.prompt_tokens is None:
+            node.prompt_tokens = {}
+        ids = node.prompt_tokens.get(key)
+        if ids is None:
+            render = pooled.tokenizer.apply_chat_template
+            if previous is None:
+                text = render([_message(node)], tokenize=False)
+            else:
+                before = render([_message(previous)], tokenize=False)
+                after = render([_message(previous), _message(node)], tokenize=False)
+                # A template that rewrites earlier messages breaks the diff; fall back to the tail
+                text = after[len(before):] if after.startswith(before) else after
+            ids = node.prompt_tokens[key] = pooled.tokenizer.encode(text, add_special_tokens=False)
+            self.segments_encoded += 1
+        return ids
+
+    def generation_prompt(self, pooled):
+        ids = self._generation_prompts.get(pooled.name)
+        if ids is None:
+            message = [{"role": "user", "content": ""}]
+            before = pooled.tokenizer.apply_chat_template(message, tokenize=False)
+            after = pooled.tokenizer.apply_chat_template(message, tokenize=False, add_generation_prompt=True)
+            ids = self._generation_prompts[pooled.name] = pooled.tokenizer.encode(after[len(before):], add_special_tokens=False)
+        return ids
+
+    def build(self, nodes, pooled):
+        """Prompt token ids for `nodes` followed by the generation prompt."""
+        if not self.supports(pooled):
+            return self.encode([_message(node) for node in nodes], pooled)
+        ids = []
+        for index, node in enumerate(nodes):
+            ids += self.segment(node, nodes[index - 1] if index else None, pooled)
+        ids += self.generation_prompt(pooled)
+
+        builds = self._builds[pooled.name]
+        self._builds[pooled.name] += 1
+        if builds % self.verify_every == 0:
+            full = self.encode([_message(node) for node in nodes], pooled)
+            if full != ids:
+                logger.warning(f"Prompts for {pooled.name} do not split into per-message segments; encoding them whole")
+                self.unsupported.add(pooled.name)
+                return full
+        return ids
+
+    def encode(self, messages, pooled):
+        """Render and encode the whole conversation."""
+        self.full_encodes += 1
+        text = pooled.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return pooled.tokenizer.encode(text, add_special_tokens=False)
+
+    def stats(self):
+        return {
+            "segments_encoded": self.segments_encoded,
+            "full_encodes": self.full_encodes,
+            "prompts_built": sum(self._builds.values()),
+            "unsupported_models": sorted(self.unsupported),
+        }
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WarmingUp(Exception):
+    """Raised for a component that is still loading."""
+
+    def __init__(self, name, state):
+        super().__init__(f"The {name} model is still warming up" if state != "failed" else f"The {name} model failed to load")
+        self.name = name
+        self.state = state
+
+
+class Readiness:
+    """
+    Loads the app's models on background threads, all at once, and tracks which of
+    them are ready so the server can start answering before they are.
+
+    Times are measured from `started`, which defaults to when the Readiness was
+    created; pass the process start to include import time. Listeners are called
+    with the full status after every change.
+    """
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.first_byte_time = None
+        self._components = {}
+        self._lock = threading.Lock()
+        self.listeners = []
+
+    def load(self, name, load_fn):
+        """Start `load_fn` on its own thread; its return value becomes the component."""
+        with self._lock:
+            self._components[name] = {"state": "loading", "value": None, "error": None,
+                                      "load_time": None, "ready_at": None, "start": time.perf_counter()}
+        self._notify()
+        threading.Thread(target=self._run, args=(name, load_fn), name=f"warmup-{name}", daemon=True).start()
+
+    def get(self, name):
+        """Return the loaded component, or raise WarmingUp if it is not ready."""
+        with self._lock:
+            component = self._components.get(name)
+            if component is None or component["state"] != "ready":
+                raise WarmingUp(name, component["state"] if component else "pending")
+            return component["value"]
+
+    def is_ready(self, name=None):
+        with self._lock:
+            components = [self._components[name]] if name else self._components.values()
+            return all(component["state"] == "ready" for component in components)
+
+    def mark_first_byte(self):
+        """Record the first response the server sent since startup."""
+        if self.first_byte_time is None:
+            self.first_byte_time = time.perf_counter() - self.started
+            logger.info(f"First byte served {self.first_byte_time:.2f}s after startup")
+
+    def status(self):
+        with self._lock:
+            components = {
+                name: {
+                    "state": component["state"],
+                    "load_time": component["load_time"],
+                    "ready_at": component["ready_at"],
+                    "error": component["error"],
+                }
+                for name, component in self._components.items()
+            }
+        return {
+            "ready": all(component["state"] == "ready" for component in components.values()),
+            "components": components,
+            "uptime": time.perf_counter() - self.started,
+            "first_byte_time": self.first_byte_time,
+        }
+
+    def _run(self, name, load_fn):
+        try:
+            value = load_fn()
+        except Exception as e:
+            logger.error(f"Loading {name} failed: {e}", exc_info=True)
+            with self._lock:
+                self._components[name].update(state="failed", error=str(e))
+        else:
+            now = time.perf_counter()
+            with self._lock:
+                component = self._components[name]
+                component.update(state="ready", value=value, load_time=now - component["start"], ready_at=now - self.started)
+            logger.info(f"{name} ready after {now - self.started:.2f}s")
+        self._notify()
+
+    def _notify(self):
+        status = self.status()
+        for listener in self.listeners:
+            try:
+                listener(status)
+            except Exception as e:
+                logger.warning(f"Readiness listener failed: {e}")
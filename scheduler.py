@@ -0,0 +1,410 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import torch
+from transformers import LogitsProcessorList, TemperatureLogitsWarper, TopPLogitsWarper
+
+from prefix_cache import cache_to_layers, layers_to_cache
+from speculative import SpeculativeRow
+
+logger = logging.getLogger(__name__)
+
+
+def build_logits_warper(temperature, top_p):
+    """Temperature / top-p warpers matching the sampling `model.generate` does."""
+    warpers = LogitsProcessorList()
+    if 0 < temperature != 1.0:
+        warpers.append(TemperatureLogitsWarper(temperature))
+    if top_p < 1.0:
+        warpers.append(TopPLogitsWarper(top_p))
+    return warpers
+
+
+def _pad_left(tensor, length, dim):
+    missing = length - tensor.shape[dim]
+    if missing == 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+class GenerationRequest:
+    """
+    One sequence decoded by the BatchScheduler.
+    Iterating over it yields the generated token ids as they are sampled.
+    """
+
+    def __init__(self, model, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, background=False, draft=None):
+        self.model = model  # the PooledModel the prompt was tokenized for
+        self.draft = draft  # a PooledModel proposing tokens for speculative decoding, if any
+        self.input_ids = input_ids
+        self.prompt_ids = input_ids[0].tolist()
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.warpers = build_logits_warper(temperature, top_p)
+        self.eos_token_ids = eos_token_ids
+        self.background = background
+        self.generated_ids = []
+        self.cached_prompt_tokens = 0
+        self.draft_proposed = 0
+        self.draft_accepted = 0
+        self.cancelled = False
+        self.wasted_tokens = 0  # sampled after the request was cancelled, never delivered
+        self.done = False
+        self.error = None
+        self.submit_time = time.perf_counter()
+        self.first_token_time = None
+        self.end_time = None
+        self.group = None  # requests sampling the same prompt, prefilled together
+        self._tokens = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            token_id = self._tokens.get()
+            if token_id is None:
+                break
+            yield token_id
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        """Ask the scheduler to drop this sequence before its next step."""
+        self.cancelled = True
+
+    def _emit(self, token_id):
+        """Record a sampled token; returns True once the sequence is finished."""
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        # Kept even when cancelled, so the KV state stored for the prefix cache matches the tokens
+        self.generated_ids.append(token_id)
+        is_eos = token_id in self.eos_token_ids
+        if self.cancelled:
+            self.wasted_tokens += 1
+        elif not is_eos:
+            self._put(token_id)
+        return is_eos or self.cancelled or len(self.generated_ids) >= self.max_new_tokens
+
+    def _finish(self, error=None):
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        self.end_time = time.perf_counter()
+        self._put(None)
+
+    def _put(self, token_id):
+        # A group shares one queue, so its samples can be consumed together
+        self._tokens.put((self, token_id) if self.group else token_id)
+
+    @property
+    def stats(self):
+        """Latency numbers for this request; tokens/s covers the decode phase after the first token."""
+        end_time = self.end_time or time.perf_counter()
+        generated = len(self.generated_ids)
+        time_to_first_token = (self.first_token_time - self.submit_time) if self.first_token_time else 0.0
+        decode_time = (end_time - self.first_token_time) if self.first_token_time else 0.0
+        return {
+            "prompt_tokens": len(self.prompt_ids),
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "generated_tokens": generated,
+            "time_to_first_token": time_to_first_token,
+            "tokens_per_second": (generated - 1) / decode_time if decode_time > 0 else 0.0,
+            "total_time": end_time - self.submit_time,
+            "cancelled": self.cancelled,
+            "wasted_tokens": self.wasted_tokens,
+            "draft_acceptance_rate": self.draft_accepted / self.draft_proposed if self.draft_proposed else None,
+        }
+
+
+def iter_group(requests):
+    """Yield (request, token_id) for a group from `submit_group` as the tokens of all its samples arrive."""
+    tokens = requests[0]._tokens
+    running = len(requests)
+    while running:
+        request, token_id = tokens.get()
+        if token_id is None:
+            running -= 1
+            if request.error is not None:
+                raise request.error
+            continue
+        yield request, token_id
+
+
+class BatchScheduler:
+    """
+    Continuous batching in front of the model.
+
+    Requests from any number of sessions are submitted to a single background thread.
+    Each new request is prefilled on its own (reusing the prefix cache) and then joins
+    the running batch, which advances every active sequence with one batched forward
+    pass per step. Sequences are left-padded in the shared KV cache; finished ones
+    leave the batch immediately and new ones join between steps.
+
+    Background requests (chat names and other housekeeping) only take a batch slot
+    when no interactive request is waiting for one.
+
+    Every request runs on the model it was submitted for. A batch only holds one
+    model, so after the bot switches models the old batch drains and requests for
+    the new model are admitted once it is empty.
+
+    A group of requests for the same prompt (`submit_group`) is prefilled once and its
+    KV state copied into one batch row per sample, so k samples cost one prefill.
+
+    A cancelled request leaves the batch before the next step, so at most the tokens
+    of the step that was already running are decoded for nobody.
+
+    When the bot has a draft model for the request's model and fewer than
+    `speculative_below` other requests are running or being admitted, the request is
+    decoded speculatively (see speculative.SpeculativeRow) on its own row beside the
+    batch, one draft/verify round per step, and still counts towards `max_batch_size`.
+    Under more load it joins the batch like any other request, since a batched step
+    already amortizes the target model's weights over many sequences.
+    """
+
+    def __init__(self, bot, max_batch_size=16, speculative_below=1):
+        self.bot = bot
+        self.max_batch_size = max_batch_size
+        self.speculative_below = speculative_below
+        self._pending = deque()
+        self._background = deque()
+        self._condition = threading.Condition()
+        self._rows = []
+        self._speculative = []
+        self._cache = None
+        self._mask = None
+        self.steps = 0
+        self.decoded_tokens = 0
+        self.completed = 0
+        self.draft_proposed = 0
+        self.draft_accepted = 0
+        self.cancelled = 0
+        self.cancelled_tokens = 0  # generated for requests that were stopped early
+        self.wasted_tokens = 0  # sampled after the stop and never delivered
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, background=False, model=None):
+        model = model or self.bot.current_model
+        # Background prompts are short and not worth a second model's forward passes
+        draft = None if background else self.bot.draft_for(model)
+        request = GenerationRequest(model, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, background, draft)
+        with self._condition:
+            (self._background if background else self._pending).append(request)
+            self._condition.notify()
+        return request
+
+    def submit_group(self, n, input_ids, max_new_tokens, temperature, top_p, eos_token_ids, model=None):
+        """Sample `n` continuations of one prompt; returns the requests, to be consumed with `iter_group`."""
+        model = model or self.bot.current_model
+        requests = [
+            GenerationRequest(model, input_ids, max_new_tokens, temperature, top_p, eos_token_ids)
+            for _ in range(n)
+        ]
+        shared = queue.Queue()
+        for request in requests:
+            request.group = requests
+            request._tokens = shared
+        with self._condition:
+            self._pending.extend(requests)
+            self._condition.notify()
+        return requests
+
+    def stats(self):
+        return {
+            "active": len(self._rows) + len(self._speculative),
+            "speculative": len(self._speculative),
+            "queued": len(self._pending),
+            "queued_background": len(self._background),
+            "steps": self.steps,
+            "decoded_tokens": self.decoded_tokens,
+            "completed": self.completed,
+            "mean_batch_size": self.decoded_tokens / self.steps if self.steps else 0.0,
+            "draft_proposed": self.draft_proposed,
+            "draft_accepted": self.draft_accepted,
+            "draft_acceptance_rate": self.draft_accepted / self.draft_proposed if self.draft_proposed else None,
+            "cancelled": self.cancelled,
+            "cancelled_tokens": self.cancelled_tokens,
+            "wasted_tokens": self.wasted_tokens,
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._background and not self._rows and not self._speculative:
+                    self._condition.wait()
+                admitted = []
+                batch_model = self._rows[0].model if self._rows else None
+                for waiting in (self._pending, self._background):
+                    while waiting and len(self._rows) + len(self._speculative) + len(admitted) < self.max_batch_size:
+                        batch_model = batch_model or waiting[0].model
+                        if waiting[0].model is not batch_model:
+                            break
+                        # A group is admitted whole, overfilling the batch only when nothing else is running
+                        size = len(waiting[0].group) if waiting[0].group else 1
+                        if size > 1 and (self._rows or self._speculative or admitted) and \
+                                len(self._rows) + len(self._speculative) + len(admitted) + size > self.max_batch_size:
+                            break
+                        for _ in range(size):
+                            admitted.append(waiting.popleft())
+            try:
+                with torch.inference_mode():
+                    for i, request in enumerate(admitted):
+                        if request.group:
+                            if request is request.group[0]:
+                                self._prefill_group(request.group)
+                        else:
+                            self._prefill(request, admitting=len(admitted) - i - 1)
+                    self._drop_cancelled()
+                    if self._rows:
+                        self._decode_step()
+                    for row in list(self._speculative):
+                        if row.step():
+                            self._speculative.remove(row)
+                            self._complete(row.request, cache_to_layers(row.target_cache))
+            except Exception as e:
+                logger.error(f"Batch step failed: {e}", exc_info=True)
+                for request in self._rows + [row.request for row in self._speculative] + admitted:
+                    request._finish(error=e)
+                self._rows, self._speculative, self._cache, self._mask = [], [], None, None
+
+    def _sample(self, logits, rows):
+        next_tokens = []
+        for row_logits, request in zip(logits, rows):
+            row_logits = row_logits.unsqueeze(0)
+            if request.temperature <= 0:
+                next_tokens.append(row_logits.argmax(dim=-1).item())
+            else:
+                probs = torch.softmax(request.warpers(None, row_logits), dim=-1)
+                next_tokens.append(torch.multinomial(probs, num_samples=1).item())
+        return next_tokens
+
+    def _drop_cancelled(self):
+        """Take cancelled requests out of the batch and the speculative rows before they decode another token."""
+        cancelled = [i for i, request in enumerate(self._rows) if request.cancelled]
+        if cancelled:
+            self._leave(cancelled)
+        for row in [row for row in self._speculative if row.request.cancelled]:
+            self._speculative.remove(row)
+            self._complete(row.request, cache_to_layers(row.target_cache))
+
+    def _prefill(self, request, admitting=0):
+        if request.cancelled:
+            self._count_cancelled(request)
+            request._finish()
+            return
+        cached_length, past_key_values = self.bot.prefix_cache.lookup(request.prompt_ids, request.model.name)
+        request.cached_prompt_tokens = cached_length
+        outputs = request.model.model(
+            input_ids=request.input_ids[:, cached_length:],
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        token_id = self._sample(outputs.logits[:, -1, :].float(), [request])[0]
+        if request._emit(token_id):
+            self._complete(request, cache_to_layers(outputs.past_key_values))
+        elif request.draft is not None and \
+                len(self._rows) + len(self._speculative) + admitting < self.speculative_below:
+            self._speculative.append(SpeculativeRow(request, outputs.past_key_values, self.bot.draft_tokens))
+        else:
+            self._join(request, outputs.past_key_values)
+
+    def _prefill_group(self, group):
+        requests = [request for request in group if not request.cancelled]
+        for request in group:
+            if request.cancelled:
+                self._count_cancelled(request)
+                request._finish()
+        if not requests:
+            return
+        first = requests[0]
+        cached_length, past_key_values = self.bot.prefix_cache.lookup(first.prompt_ids, first.model.name)
+        outputs = first.model.model(
+            input_ids=first.input_ids[:, cached_length:],
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        logits = outputs.logits[:, -1, :].float().expand(len(requests), -1)
+        layers = cache_to_layers(outputs.past_key_values)
+        for request, token_id in zip(requests, self._sample(logits, requests)):
+            request.cached_prompt_tokens = cached_length
+            if request._emit(token_id):
+                self._complete(request, layers)
+            else:
+                # Every sample gets its own copy of the prompt's KV state in the batch
+                self._join(request, layers_to_cache(layers))
+
+    def _join(self, request, past_key_values):
+        mask = torch.ones((1, len(request.prompt_ids)), dtype=torch.long, device=request.input_ids.device)
+        if not self._rows:
+            self._rows, self._cache, self._mask = [request], past_key_values, mask
+            return
+        length = max(self._mask.shape[1], mask.shape[1])
+        layers = [
+            (
+                torch.cat([_pad_left(k, length, 2), _pad_left(new_k, length, 2)]),
+                torch.cat([_pad_left(v, length, 2), _pad_left(new_v, length, 2)]),
+            )
+            for (k, v), (new_k, new_v) in zip(cache_to_layers(self._cache), cache_to_layers(past_key_values))
+        ]
+        self._cache = layers_to_cache(layers)
+        self._mask = torch.cat([_pad_left(self._mask, length, 1), _pad_left(mask, length, 1)])
+        self._rows.append(request)
+
+    def _decode_step(self):
+        rows = self._rows
+        input_ids = torch.tensor([[request.generated_ids[-1]] for request in rows], device=self._mask.device)
+        attention_mask = torch.cat([self._mask, self._mask.new_ones((len(rows), 1))], dim=1)
+        position_ids = self._mask.sum(dim=1, keepdim=True)
+        outputs = rows[0].model.model(
+            input_ids=input_ids,
+            past_key_values=self._cache,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+        self._cache, self._mask = outputs.past_key_values, attention_mask
+        self.steps += 1
+        self.decoded_tokens += len(rows)
+
+        next_tokens = self._sample(outputs.logits[:, -1, :].float(), rows)
+        finished = [i for i, (request, token_id) in enumerate(zip(rows, next_tokens)) if request._emit(token_id)]
+        if finished:
+            self._leave(finished)
+
+    def _leave(self, finished):
+        layers = cache_to_layers(self._cache)
+        lengths = self._mask.sum(dim=1).tolist()
+        for i in finished:
+            # Real tokens of a row are always its last `length` positions
+            length = lengths[i]
+            self._complete(self._rows[i], [(k[i:i + 1, :, -length:], v[i:i + 1, :, -length:]) for k, v in layers])
+
+        keep = [i for i in range(len(self._rows)) if i not in finished]
+        if not keep:
+            self._rows, self._cache, self._mask = [], None, None
+            return
+        trim = self._mask.shape[1] - int(max(lengths[i] for i in keep))
+        self._rows = [self._rows[i] for i in keep]
+        self._mask = self._mask[keep, trim:]
+        self._cache = layers_to_cache([(k[keep, :, trim:], v[keep, :, trim:]) for k, v in layers])
+
+    def _count_cancelled(self, request):
+        self.cancelled += 1
+        self.cancelled_tokens += len(request.generated_ids)
+        self.wasted_tokens += request.wasted_tokens
+
+    def _complete(self, request, layers):
+        if request.cancelled:
+            self._count_cancelled(request)
+        self.draft_proposed += request.draft_proposed
+        self.draft_accepted += request.draft_accepted
+        # Background prompts are one-offs that would only push chat branches out of the cache
+        if not request.background:
+            # The last sampled token was never fed back, so it is not in the cache
+            self.bot.prefix_cache.store(request.prompt_ids + request.generated_ids[:-1], layers, request.model.name)
+        self.completed += 1
+        request._finish()
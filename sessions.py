@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from chatbot import ChatTree, Conversation
+from streaming import ChatStream
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSession(Conversation):
+    """The conversation of one socket connection, running on a shared ChatBot."""
+
+    def __init__(self, bot, sid):
+        self.bot = bot
+        self.sid = sid
+        self.chat_tree = ChatTree()
+        self.stream = ChatStream()
+        self.generating = []
+        self.alternatives = []
+        # Held by the handler running a turn until it sent its last update
+        self.turn_lock = threading.Lock()
+        # Every piece of text is handed to the stream, which decides when to emit (see EmitPacer)
+        self.chunk_size = 1
+        self.last_active = time.monotonic()
+
+    @contextmanager
+    def exclusive_turn(self):
+        """Stop the response being generated, wait until its handler is done streaming it, and hold the session."""
+        while not self.turn_lock.acquire(timeout=0.1):
+            # Also stops a turn that had not submitted its requests yet at the first try
+            self.stop_generation()
+        try:
+            yield
+        finally:
+            self.turn_lock.release()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def has_messages(self):
+        return bool(self.chat_tree.root.children)
+
+
+class SessionManager:
+    """
+    Maps socket session ids to their own ChatSession.
+
+    All sessions share the bot's model and tokenizer. Sessions idle for longer than
+    `idle_timeout` seconds are saved to the chat directory and dropped from memory;
+    the next event from that client reloads the chat it had open.
+    """
+
+    def __init__(self, bot, idle_timeout=30 * 60):
+        self.bot = bot
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._evicted = {}  # sid -> chat_id saved when the session was evicted
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, sid):
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None:
+                session = ChatSession(self.bot, sid)
+                chat_id = self._evicted.pop(sid, None)
+                if chat_id:
+                    try:
+                        session.load_chat_tree(chat_id)
+                        logger.info(f"Restored evicted session {sid} with chat {chat_id}")
+                    except FileNotFoundError:
+                        logger.warning(f"Chat {chat_id} of evicted session {sid} no longer exists")
+                self._sessions[sid] = session
+            session.touch()
+            return session
+
+    def remove(self, sid):
+        """Save and drop the session of a disconnected client."""
+        with self._lock:
+            session = self._sessions.pop(sid, None)
+            self._evicted.pop(sid, None)
+        if session is not None:
+            # Nobody is left to read the response
+            session.stop_generation()
+            if session.has_messages():
+                session.save_chat_tree()
+        logger.info(f"Removed session {sid}")
+
+    def evict_idle(self):
+        """Save idle sessions to disk and free them; returns how many were evicted."""
+        now = time.monotonic()
+        with self._lock:
+            idle = [sid for sid, session in self._sessions.items() if now - session.last_active > self.idle_timeout]
+            for sid in idle:
+                session = self._sessions.pop(sid)
+                if session.has_messages():
+                    session.save_chat_tree()
+                    self._evicted[sid] = session.get_chat_id()
+                self.evictions += 1
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle sessions")
+        return len(idle)
+
+    def stats(self):
+        with self._lock:
+            turns = [session.stream.last_turn for session in self._sessions.values() if session.stream.last_turn]
+            first_visible = [turn["first_visible_ms"] for turn in turns if turn["first_visible_ms"] is not None]
+            return {
+                "active": len(self._sessions),
+                "evicted": len(self._evicted),
+                "evictions": self.evictions,
+                # Over the last streamed turn of each active session
+                "streaming": {
+                    "turns": len(turns),
+                    "mean_first_visible_ms": sum(first_visible) / len(first_visible) if first_visible else None,
+                    "mean_emits_per_second": sum(turn["emits_per_second"] for turn in turns) / len(turns) if turns else None,
+                    "backoffs": sum(turn["backoffs"] for turn in turns),
+                },
+            }
@@ -0,0 +1,117 @@
+import torch
+
+
+def check_draft_compatible(target, draft):
+    """Raise ValueError unless `draft` tokenizes text exactly like `target`, so its token ids mean the same."""
+    if target.tokenizer.get_vocab() != draft.tokenizer.get_vocab():
+        raise ValueError(f"Draft model {draft.name} does not share the tokenizer of {target.name}")
+
+
+def _crop(cache, length):
+    """Drop everything after the first `length` positions of a DynamicCache."""
+    extra = cache.get_seq_length() - length
+    if extra > 0:
+        cache.crop(-extra)
+
+
+def _vocab_size(pooled):
+    return pooled.model.get_output_embeddings().weight.shape[0]
+
+
+class SpeculativeRow:
+    """
+    A request decoded with speculative sampling instead of in the shared batch.
+
+    Each round the draft model proposes up to `draft_tokens` tokens one at a time,
+    the target model scores them all in a single forward pass, and they are accepted
+    left to right with probability min(1, p/q). The first rejected token is replaced
+    by a sample from the normalized residual max(0, p - q), and when every draft is
+    accepted the target's next distribution yields a bonus token. Both p and q are
+    taken after the request's temperature/top-p warpers, so the accepted tokens follow
+    exactly the distribution plain sampling from the target would; with temperature 0
+    both are one-hot and this reduces to greedy decoding.
+
+    `tokens[:target_length]` is in the target's KV cache and `tokens[:draft_length]`
+    in the draft's; the last committed token is never in either, like in the batch.
+    """
+
+    def __init__(self, request, target_cache, draft_tokens):
+        self.request = request
+        self.draft = request.draft
+        self.draft_tokens = draft_tokens
+        self.target_cache = target_cache
+        self.target_length = len(request.prompt_ids)
+        self.draft_cache = None
+        self.draft_length = 0
+        # Both models may pad their embeddings differently past the shared tokenizer
+        self.vocab_size = min(_vocab_size(request.model), _vocab_size(self.draft))
+
+    def step(self):
+        """Run one draft/verify round; returns True once the request is finished."""
+        request = self.request
+        tokens = request.prompt_ids + request.generated_ids
+        count = max(1, min(self.draft_tokens, request.max_new_tokens - len(request.generated_ids) - 1))
+
+        # Draft: feed whatever the draft cache is missing, then one proposed token at a time
+        draft_ids, draft_probs = [], []
+        pending = tokens[self.draft_length:]
+        for _ in range(count):
+            outputs = self.draft.model(
+                input_ids=torch.tensor([pending], device=self.draft.model.device),
+                past_key_values=self.draft_cache,
+                use_cache=True,
+            )
+            self.draft_cache = outputs.past_key_values
+            self.draft_length += len(pending)
+            probs = self._probs(outputs.logits[:, -1, :])[0]
+            token_id = torch.multinomial(probs, num_samples=1).item()
+            draft_ids.append(token_id)
+            draft_probs.append(probs)
+            pending = [token_id]
+
+        # Verify: the target scores every proposal, plus the position after the last one
+        outputs = request.model.model(
+            input_ids=torch.tensor([tokens[self.target_length:] + draft_ids], device=request.input_ids.device),
+            past_key_values=self.target_cache,
+            use_cache=True,
+        )
+        self.target_cache = outputs.past_key_values
+        target_probs = self._probs(outputs.logits[0, -(count + 1):, :])
+
+        new_tokens = []
+        for i, token_id in enumerate(draft_ids):
+            p = target_probs[i, token_id].item()
+            q = draft_probs[i][token_id].item()
+            if torch.rand(()).item() * q < p:
+                new_tokens.append(token_id)
+                continue
+            residual = torch.clamp(target_probs[i] - draft_probs[i].to(target_probs.device), min=0)
+            if residual.sum() <= 0:
+                residual = target_probs[i]
+            new_tokens.append(torch.multinomial(residual / residual.sum(), num_samples=1).item())
+            break
+        else:
+            new_tokens.append(torch.multinomial(target_probs[count], num_samples=1).item())
+        request.draft_proposed += count
+        request.draft_accepted += len(new_tokens) - 1
+
+        finished = False
+        for token_id in new_tokens:
+            if request._emit(token_id):
+                finished = True
+                break
+
+        # Drop the rejected proposals from both caches
+        committed = len(request.prompt_ids) + len(request.generated_ids) - 1
+        _crop(self.target_cache, committed)
+        self.target_length = committed
+        if self.draft_length > committed:
+            _crop(self.draft_cache, committed)
+            self.draft_length = committed
+        return finished
+
+    def _probs(self, logits):
+        logits = logits[:, :self.vocab_size].float()
+        if self.request.temperature <= 0:
+            return torch.nn.functional.one_hot(logits.argmax(dim=-1), logits.shape[-1]).float()
+        return torch.softmax(self.request.warpers(None, logits), dim=-1)
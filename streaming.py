@@ -0,0 +1,254 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STREAM_MODES = ('full', 'delta')
+
+EMIT_INTERVAL_MS = 50  # a streamed turn is flushed at least this often while text is arriving
+EMIT_MAX_CHARS = 256  # or as soon as this much new text is waiting, whichever comes first
+MAX_EMIT_INTERVAL_MS = 1000  # the interval backs off up to this for a client that falls behind
+MAX_UNACKED_EMITS = 2  # emits a client may have outstanding before the stream backs off
+
+
+def encoded_size(text):
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+def payload_size(payload):
+    """Bytes of `payload` encoded the way the Socket.IO server encodes it."""
+    return encoded_size(json.dumps(payload, separators=(',', ':')))
+
+
+def text_size(messages):
+    return sum(len(message['content']) for message in messages)
+
+
+class SizedJSON:
+    """
+    The json module of the Socket.IO server. It remembers the size of the last packet
+    encoded on each thread, so a stream counts the bytes it actually sent without
+    serializing its payloads a second time.
+    """
+
+    _local = threading.local()
+    loads = staticmethod(json.loads)
+
+    @classmethod
+    def dumps(cls, obj, *args, **kwargs):
+        text = json.dumps(obj, *args, **kwargs)
+        cls._local.size = encoded_size(text)
+        return text
+
+    @classmethod
+    def last_size(cls):
+        return getattr(cls._local, 'size', 0)
+
+
+class EmitPacer:
+    """
+    Decides when a streamed turn is flushed to the client, independently of how
+    often tokens are decoded.
+
+    New text is flushed once `interval_ms` has passed since the last emit or
+    `max_chars` of it are waiting, whichever comes first. Emits are acknowledged by
+    the client; while `max_unacked` of them are still outstanding nothing more is
+    sent (for up to `max_interval_ms`) and the interval doubles, up to
+    `max_interval_ms`, so a slow client gets fewer, larger updates. It halves again
+    with every acknowledgement.
+    """
+
+    def __init__(self, interval_ms=EMIT_INTERVAL_MS, max_chars=EMIT_MAX_CHARS,
+                 max_interval_ms=MAX_EMIT_INTERVAL_MS, max_unacked=MAX_UNACKED_EMITS):
+        self.base_interval = interval_ms / 1000
+        self.max_interval = max_interval_ms / 1000
+        self.max_chars = max_chars
+        self.max_unacked = max_unacked
+        self.interval = self.base_interval
+        self.unacked = 0
+        self._lock = threading.Lock()
+        self.begin(0)
+
+    def begin(self, size):
+        """Start a turn whose messages hold `size` characters of text so far."""
+        self.start_time = time.perf_counter()
+        self.last_emit = None  # the first text of a turn is sent right away
+        self.first_visible = None
+        self.emits = 0
+        self.backoffs = 0
+        self._emitted_size = size
+        with self._lock:
+            # Acknowledgements still missing from an earlier turn must not hold back this one
+            self.unacked = 0
+
+    def due(self, size):
+        """Whether to emit now that the messages hold `size` characters; an emit is recorded when it is."""
+        waiting = size - self._emitted_size
+        if waiting <= 0:
+            return False
+        now = time.perf_counter()
+        since_emit = now - self.last_emit if self.last_emit is not None else self.max_interval
+        if waiting < self.max_chars and since_emit < self.interval:
+            return False
+        with self._lock:
+            # A client that never acknowledges still gets an update every max_interval
+            if self.unacked >= self.max_unacked and since_emit < self.max_interval:
+                if self.interval < self.max_interval:
+                    self.interval = min(self.interval * 2, self.max_interval)
+                    self.backoffs += 1
+                return False
+            self.unacked += 1
+        self.emitted(size, now)
+        return True
+
+    def emitted(self, size, now=None):
+        """Record an emit that brought the client up to `size` characters."""
+        now = now or time.perf_counter()
+        if self.first_visible is None and size > self._emitted_size:
+            self.first_visible = now - self.start_time
+        self._emitted_size = size
+        self.last_emit = now
+        self.emits += 1
+
+    def acked(self, *args):
+        """The client processed an emit; usable directly as a socket.io callback."""
+        with self._lock:
+            self.unacked = max(0, self.unacked - 1)
+            self.interval = max(self.interval / 2, self.base_interval)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.start_time
+        return {
+            "first_visible_ms": self.first_visible * 1000 if self.first_visible is not None else None,
+            "emits": self.emits,
+            "emits_per_second": self.emits / elapsed if elapsed > 0 else 0.0,
+            "emit_interval_ms": self.interval * 1000,
+            "backoffs": self.backoffs,
+        }
+
+
+class ChatStream:
+    """
+    One client's view of the chat stream.
+
+    In 'full' mode every update is the whole history as a `chat_update`, which is the
+    original protocol. In 'delta' mode an update only carries what changed since the
+    last event, as a `chat_delta`: either text appended to one message, or the
+    messages from the first changed position onwards. Every event carries a sequence
+    number; a client that sees a gap asks for a resync and gets a full snapshot.
+
+    While several alternatives of a response are sampled at once, updates also carry
+    the text of the ones off the active path, as `alternatives` (the full list) or,
+    in 'delta' mode, `alternatives_append` (text appended to each of them).
+
+    While a turn streams, `due` paces the updates (see EmitPacer). Only the last
+    message and its alternatives grow during a turn, so the text waiting to be sent is
+    measured from their lengths alone. The bytes of each event are reported back with `sent` once it was
+    encoded (see SizedJSON).
+    """
+
+    def __init__(self, mode='full', pacer=None):
+        self.mode = mode
+        self.pacer = pacer or EmitPacer()
+        self.seq = 0
+        self._sent = []  # messages as the client last saw them
+        self._sent_alternatives = []
+        self._lock = threading.Lock()
+        self.streaming = False
+        self.last_turn = None
+        self._prefix_size = 0  # characters in the messages before the streamed one
+        self.turn_events = 0
+        self.turn_bytes = 0
+        self.total_bytes = 0
+
+    def set_mode(self, mode):
+        if mode not in STREAM_MODES:
+            raise ValueError(f"Invalid stream mode: {mode}")
+        self.mode = mode
+
+    def snapshot(self, payload):
+        """Stamp a full-history payload with the next sequence number and make it the delta baseline."""
+        with self._lock:
+            return self._snapshot(payload)
+
+    def update(self, full_history, type=None, alternatives=()):
+        """Return the (event, payload) that brings the client up to date with `full_history` and `alternatives`."""
+        with self._lock:
+            if self.mode == 'full':
+                payload = dict(full_history, type=type) if type else full_history
+                if alternatives:
+                    payload = dict(payload, alternatives=list(alternatives))
+                return 'chat_update', self._snapshot(payload)
+            payload = self._delta(full_history['messages'])
+            payload.update(self._alternatives_delta(alternatives))
+            if type:
+                payload['type'] = type
+            self.turn_events += 1
+            return 'chat_delta', payload
+
+    def begin_turn(self, messages=()):
+        self.streaming = True
+        self.turn_events = 0
+        self.turn_bytes = 0
+        self._prefix_size = text_size(messages[:-1])
+        self.pacer.begin(self._turn_size(messages))
+
+    def due(self, messages, alternatives=()):
+        """Whether the turn's progress up to `messages` (and `alternatives`) should be sent now."""
+        return self.pacer.due(self._turn_size(messages) + sum(len(text) for text in alternatives))
+
+    def sent(self, size):
+        """Count `size` bytes of an event built by this stream that went out to the client."""
+        self.turn_bytes += size
+        self.total_bytes += size
+
+    def end_turn(self, messages=()):
+        """Finish the turn once its last update, holding `messages`, was sent; returns its stats."""
+        self.streaming = False
+        self.pacer.emitted(self._turn_size(messages))
+        stats = dict(self.pacer.stats(), mode=self.mode, events=self.turn_events, bytes=self.turn_bytes)
+        self.last_turn = stats
+        first_visible = f"{stats['first_visible_ms']:.0f} ms" if stats['first_visible_ms'] is not None else "never"
+        logger.info(
+            f"Streamed turn in {self.mode} mode: {self.turn_events} events, {self.turn_bytes} bytes, "
+            f"first text visible after {first_visible}, {stats['emits_per_second']:.1f} emits/s"
+        )
+        return stats
+
+    def _turn_size(self, messages):
+        return self._prefix_size + (len(messages[-1]['content']) if messages else 0)
+
+    def _snapshot(self, payload):
+        self.seq += 1
+        payload = dict(payload, seq=self.seq)
+        self._sent = list(payload['messages'])
+        self._sent_alternatives = list(payload.get('alternatives', ()))
+        self.turn_events += 1
+        return payload
+
+    def _alternatives_delta(self, alternatives):
+        sent = self._sent_alternatives
+        self._sent_alternatives = list(alternatives)
+        if sent == self._sent_alternatives:
+            return {}
+        if len(sent) == len(alternatives) and all(new.startswith(old) for old, new in zip(sent, alternatives)):
+            return {'alternatives_append': [new[len(old):] for old, new in zip(sent, alternatives)]}
+        return {'alternatives': list(alternatives)}
+
+    def _delta(self, messages):
+        self.seq += 1
+        sent = self._sent
+        start = 0
+        while start < len(sent) and start < len(messages) and sent[start] == messages[start]:
+            start += 1
+        self._sent = list(messages)
+
+        if start == len(sent) == len(messages):
+            return {'seq': self.seq}
+        if start == len(sent) - 1 == len(messages) - 1:
+            old, new = sent[start], messages[start]
+            if (old['role'], old['sibling_info']) == (new['role'], new['sibling_info']) and new['content'].startswith(old['content']):
+                return {'seq': self.seq, 'index': start, 'append': new['content'][len(old['content']):]}
+        return {'seq': self.seq, 'start': start, 'messages': messages[start:]}
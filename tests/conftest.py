@@ -0,0 +1,94 @@
+import os
+import sys
+import types
+
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_pool import PooledModel
+from prefix_cache import PrefixCache
+
+VOCAB_SIZE = 64
+EOS_TOKEN_ID = 0
+
+
+def make_tiny_model(name, seed, num_hidden_layers=2):
+    """A randomly initialized Llama small enough to run a few hundred steps on CPU."""
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=256,
+        bos_token_id=1,
+        eos_token_id=EOS_TOKEN_ID,
+        pad_token_id=EOS_TOKEN_ID,
+    )
+    model = LlamaForCausalLM(config).eval()
+    return PooledModel(name, model, types.SimpleNamespace(eos_token_id=EOS_TOKEN_ID), 0.0)
+
+
+class FakeBot:
+    """The parts of a ChatBot the BatchScheduler uses."""
+
+    def __init__(self, model, draft=None, draft_tokens=4, prefix_cache_bytes=64 * 1024 * 1024):
+        self.current_model = model
+        self.draft_model = draft
+        self.draft_tokens = draft_tokens
+        self.prefix_cache = PrefixCache(prefix_cache_bytes)
+
+    def draft_for(self, model):
+        return self.draft_model
+
+
+class CharTokenizer:
+    """A tokenizer with a simple chat template and one token per character."""
+
+    eos_token_id = EOS_TOKEN_ID
+
+    def __init__(self):
+        self.encoded = 0  # characters encoded so far
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        text = "".join(f"<|{message['role']}|>{message['content']}\n" for message in messages)
+        return text + "<|assistant|>" if add_generation_prompt else text
+
+    def encode(self, text, add_special_tokens=False):
+        self.encoded += len(text)
+        return [ord(c) for c in text]
+
+
+def chat_model(name="chat"):
+    """The parts of a PooledModel prompts are built for."""
+    return types.SimpleNamespace(name=name, tokenizer=CharTokenizer())
+
+
+def greedy(model, prompt_ids, max_new_tokens):
+    """Reference greedy decoding: the whole sequence is run through the model at every step."""
+    ids = list(prompt_ids)
+    generated = []
+    with torch.inference_mode():
+        for _ in range(max_new_tokens):
+            logits = model.model(input_ids=torch.tensor([ids])).logits
+            token_id = logits[0, -1].argmax().item()
+            generated.append(token_id)
+            if token_id == EOS_TOKEN_ID:
+                break
+            ids.append(token_id)
+    return generated
+
+
+@pytest.fixture(scope="session")
+def tiny_model():
+    return make_tiny_model("tiny", seed=0)
+
+
+@pytest.fixture(scope="session")
+def tiny_draft():
+    return make_tiny_model("tiny-draft", seed=1, num_hidden_layers=1)
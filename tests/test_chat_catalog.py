@@ -0,0 +1,45 @@
+import os
+
+from chat_store import ChatStore
+from chatbot import ChatTree
+
+
+def save_chats(store, count):
+    chats = []
+    for i in range(count):
+        chat_tree = ChatTree()
+        chat_tree.add_message("user", f"Message {i}")
+        chat_tree.set_chat_name(f"Chat {i}")
+        chat_tree.last_modified = f"2026-01-{i + 1:02d}T00:00:00"
+        store.save(chat_tree)
+        chats.append(chat_tree)
+    return chats
+
+
+def test_chats_are_listed_newest_first_a_page_at_a_time(tmp_path):
+    store = ChatStore(str(tmp_path), ChatTree)
+    save_chats(store, 5)
+    assert store.count_chats() == 5
+    assert [chat["name"] for chat in store.list_chats(0, 2)] == ["Chat 4", "Chat 3"]
+    assert [chat["name"] for chat in store.list_chats(4, 2)] == ["Chat 0"]
+    assert len(store.list_chats()) == 5
+
+
+def test_catalog_is_reconciled_with_the_files_at_startup(tmp_path):
+    store = ChatStore(str(tmp_path), ChatTree)
+    chats = save_chats(store, 3)
+    os.remove(store.snapshot_path(chats[0].chat_id))
+    # A damaged catalog is rebuilt from the chat files, without the deleted one
+    with open(os.path.join(str(tmp_path), ChatStore.CATALOG_FILE), "w") as f:
+        f.write("not a database")
+
+    reopened = ChatStore(str(tmp_path), ChatTree)
+    assert sorted(chat["name"] for chat in reopened.list_chats()) == ["Chat 1", "Chat 2"]
+
+
+def test_deleted_chats_leave_the_catalog(tmp_path):
+    store = ChatStore(str(tmp_path), ChatTree)
+    chats = save_chats(store, 2)
+    store.delete(chats[1].chat_id)
+    assert [chat["id"] for chat in store.list_chats()] == [chats[0].chat_id]
+    assert [chat["id"] for chat in ChatStore(str(tmp_path), ChatTree).list_chats()] == [chats[0].chat_id]
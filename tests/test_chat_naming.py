@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from chat_store import ChatStore
+from chatbot import ChatTree
+from sessions import ChatSession
+
+
+def make_session(tmp_path):
+    bot = SimpleNamespace(chat_store=ChatStore(str(tmp_path), ChatTree), chat_name_mode="first_message")
+    return ChatSession(bot, "sid")
+
+
+def test_naming_is_claimed_once_per_chat(tmp_path):
+    session = make_session(tmp_path)
+    assert not session.start_naming()  # nothing to name yet
+    session.chat_tree.add_message("user", "Tell me about the quick brown fox")
+    assert session.start_naming()
+    assert not session.start_naming()
+    assert session.generate_name("Tell me about the quick brown fox") == "Tell me about the quick..."
+    assert not session.chat_tree.naming and not session.start_naming()
+
+
+def test_background_name_reaches_the_catalog_of_a_saved_chat(tmp_path):
+    session = make_session(tmp_path)
+    session.chat_tree.add_message("user", "Hello there")
+    session.save_chat_tree()
+    assert session.start_naming()
+    session.generate_name("Hello there")
+    assert [chat["name"] for chat in session.list_chat_histories()] == ["Hello there"]
+
+    # The catalog rebuilt from the files agrees once the rename is saved
+    session.save_chat_tree()
+    store = session.bot.chat_store
+    store.rebuild_catalog()
+    assert store.list_chats()[0]["name"] == "Hello there"
+
+
+def test_the_users_name_wins_over_the_generated_one(tmp_path):
+    session = make_session(tmp_path)
+    session.chat_tree.add_message("user", "Hello there")
+    assert session.start_naming()
+    session.edit_chat_name("Mine")
+    assert session.generate_name("Hello there") == "Mine"
@@ -0,0 +1,92 @@
+import json
+import os
+
+from chat_store import ChatStore
+from chatbot import ChatTree
+
+
+def make_chat(store):
+    chat_tree = ChatTree()
+    chat_tree.add_message("user", "Hello")
+    node = chat_tree.add_message("assistant", "")
+    store.save(chat_tree)
+    for text in ["Hi", " there", ", how", " can I help?"]:
+        chat_tree.append_content(node, text)
+        store.save(chat_tree)
+    return chat_tree, node
+
+
+def history(chat_tree):
+    return [(message["role"], message["content"]) for message in chat_tree.get_chat_history()]
+
+
+def test_journal_replays_on_top_of_snapshot(tmp_path):
+    store = ChatStore(str(tmp_path), ChatTree)
+    chat_tree, node = make_chat(store)
+    chat_tree.set_chat_name("Greeting")
+    store.save(chat_tree)
+    assert os.path.exists(store.journal_path(chat_tree.chat_id))
+
+    loaded = ChatStore(str(tmp_path), ChatTree).load(chat_tree.chat_id)
+    assert history(loaded) == history(chat_tree)
+    assert loaded.chat_name == "Greeting"
+    assert loaded.journal_seq == chat_tree.journal_seq
+
+
+def test_torn_last_line_is_ignored_and_compacted(tmp_path):
+    store = ChatStore(str(tmp_path), ChatTree)
+    chat_tree, node = make_chat(store)
+    with open(store.journal_path(chat_tree.chat_id), 'a') as f:
+        f.write('{"op": "append", "id": %d, "text": " and mo' % node.node_id)
+
+    loaded = ChatStore(str(tmp_path), ChatTree).load(chat_tree.chat_id)
+    assert loaded.current_node.content == "Hi there, how can I help?"
+    # The torn journal was folded into a fresh snapshot
+    assert not os.path.exists(store.journal_path(chat_tree.chat_id))
+    assert history(ChatStore(str(tmp_path), ChatTree).load(chat_tree.chat_id)) == history(loaded)
+
+
+def test_journal_is_compacted_after_compact_every_operations(tmp_path):
+    store = ChatStore(str(tmp_path), ChatTree, compact_every=3)
+    chat_tree, node = make_chat(store)
+    assert store.compactions >= 2
+    with open(store.journal_path(chat_tree.chat_id)) as f:
+        assert len(f.readlines()) < 3
+
+    loaded = ChatStore(str(tmp_path), ChatTree).load(chat_tree.chat_id)
+    assert history(loaded) == history(chat_tree)
+
+
+def test_appends_after_a_save_start_a_new_operation(tmp_path):
+    store = ChatStore(str(tmp_path), ChatTree)
+    chat_tree = ChatTree()
+    node = chat_tree.add_message("assistant", "")
+    chat_tree.append_content(node, "a")
+    store.save(chat_tree)
+    for text in ["b", "c"]:
+        chat_tree.append_content(node, text)
+        store.save(chat_tree)
+
+    # Each save journals only what was appended since the previous one
+    with open(store.journal_path(chat_tree.chat_id)) as f:
+        ops = [json.loads(line) for line in f]
+    assert [(op["op"], op["text"]) for op in ops] == [("append", "b"), ("append", "c")]
+    assert ops[1]["seq"] == ops[0]["seq"] + 1
+    assert ChatStore(str(tmp_path), ChatTree).load(chat_tree.chat_id).current_node.content == "abc"
+
+
+def test_branches_replay_after_regenerate_edit_and_navigation(tmp_path):
+    store = ChatStore(str(tmp_path), ChatTree)
+    chat_tree, node = make_chat(store)
+    for regenerated in chat_tree.regenerate_message(0, n=2):
+        chat_tree.append_content(regenerated, f"Answer {regenerated.sibling_index}")
+    store.save(chat_tree)
+    chat_tree.edit_message(1, "Hey")
+    chat_tree.change_active_child(0, "prev")  # back to the first user message and its active answer
+    store.save(chat_tree)
+
+    loaded = ChatStore(str(tmp_path), ChatTree).load(chat_tree.chat_id)
+    assert history(loaded) == history(chat_tree)
+    assert [message["sibling_info"] for message in loaded.get_chat_history()] == [(1, 1), (1, 2), (2, 3)]
+    assert [child.content for child in loaded.current_node.parent.children] == [
+        "Hi there, how can I help?", "Answer 1", "Answer 2"]
@@ -0,0 +1,49 @@
+from chatbot import ChatTree
+
+
+def contents(messages):
+    return [message["content"] for message in messages[1:]]
+
+
+def branched_tree():
+    """Hi -> [A1, A2 (active)], with A2 answered once more by the user."""
+    tree = ChatTree()
+    tree.add_message("user", "Hi")
+    tree.add_message("assistant", "A1")
+    tree.regenerate_message(0)
+    tree.current_node = tree.current_node.parent.children[-1]
+    tree.append_content(tree.current_node, "A2")
+    tree.add_message("user", "More")
+    return tree
+
+
+def test_nodes_know_their_depth_and_sibling_index():
+    tree = branched_tree()
+    more = tree.current_node
+    a2 = more.parent
+    assert (more.depth, a2.depth) == (3, 2)
+    assert a2.sibling_index == 1 and a2.get_sibling_info() == (2, 2)
+    assert [node.depth for node in tree.get_active_path()] == [0, 1, 2, 3]
+
+
+def test_history_follows_streaming_and_navigation():
+    tree = branched_tree()
+    assert contents(tree.get_chat_history()) == ["Hi", "A2", "More"]
+    reply = tree.add_message("assistant", "")
+    tree.append_content(reply, "Sure")
+    assert contents(tree.get_chat_history())[-1] == "Sure"
+    tree.append_content(reply, ", here")
+    assert contents(tree.get_chat_history())[-1] == "Sure, here"
+
+    messages = tree.change_active_child(2, "prev")
+    assert contents(messages) == ["Hi", "A1"] and messages[-1]["sibling_info"] == (1, 2)
+    messages = tree.change_active_child(0, "next")
+    assert contents(messages) == ["Hi", "A2", "More", "Sure, here"]
+
+
+def test_indices_survive_a_round_trip():
+    tree = branched_tree()
+    loaded = ChatTree.from_json(tree.to_json())
+    assert contents(loaded.get_chat_history()) == ["Hi", "A2", "More"]
+    a2 = loaded.current_node.parent
+    assert (a2.sibling_index, a2.depth) == (1, 2)
@@ -0,0 +1,48 @@
+from chatbot import ChatTree
+from conftest import chat_model
+from context_window import ContextWindow
+from prompt_builder import PromptBuilder
+
+
+def long_chat(turns, length=40):
+    tree = ChatTree()
+    for i in range(turns):
+        tree.add_message("user", f"{i}" + "u" * length)
+        tree.add_message("assistant", f"{i}" + "a" * length)
+    return tree
+
+
+def select(window, tree, pooled):
+    path = tree.get_active_path()
+    indices, total = window.select(tree, path, pooled)
+    return [path[index] for index in indices], total
+
+
+def test_no_budget_sends_everything():
+    tree = long_chat(5)
+    nodes, total = select(ContextWindow(0, PromptBuilder()), tree, chat_model())
+    assert len(nodes) == 11 and total is None
+
+
+def test_old_turns_are_cut_whole_down_to_the_low_water_mark():
+    tree = long_chat(10)
+    window = ContextWindow(600, PromptBuilder())
+    nodes, total = select(window, tree, chat_model())
+    assert nodes[0] is tree.root and nodes[-1] is tree.current_node
+    assert nodes[1].role == "user" and total <= 600 * window.low_water
+    assert len(nodes) < 21
+
+
+def test_the_cut_stays_put_while_new_turns_fit():
+    tree = long_chat(10)
+    pooled = chat_model()
+    window = ContextWindow(600, PromptBuilder())
+    first = select(window, tree, pooled)[0][1]
+    tree.add_message("user", "and one more")
+    nodes, total = select(window, tree, pooled)
+    assert nodes[1] is first and total <= 600
+
+    # A new budget cuts again from the start of the path
+    window.budget_tokens = 5000
+    assert len(select(window, tree, pooled)[0]) == 22
+    assert tree.context_start is None
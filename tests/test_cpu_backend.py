@@ -0,0 +1,38 @@
+import json
+
+import pytest
+import torch
+
+from chatbot import ChatBot
+from model_pool import model_memory_bytes
+
+
+def make_bot(tmp_path, **config):
+    config_file = tmp_path / "model_config.json"
+    config_file.write_text(json.dumps(dict({"backend": "cpu", "cpu_dtype": "fp32"}, **config)))
+    return ChatBot(model_config_file=str(config_file), chat_dir=None, lazy=True)
+
+
+def test_models_are_validated_against_the_backend(tmp_path):
+    bot = make_bot(tmp_path, model_name="HuggingFaceTB/SmolLM2-135M-Instruct")
+    with pytest.raises(ValueError, match="cpu backend"):
+        bot.update_model_config({"model_name": "meta-llama/Llama-3.3-70B-Instruct"}, save=False)
+    with pytest.raises(ValueError, match="cuda backend"):
+        bot.update_model_config({"backend": "cuda"}, save=False)
+    with pytest.raises(ValueError, match="draft_model_name"):
+        bot.update_model_config({"draft_model_name": "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"}, save=False)
+    assert bot.backend == "cpu" and bot.model_name == "HuggingFaceTB/SmolLM2-135M-Instruct"
+
+
+def test_a_configured_local_model_keeps_accepting_other_settings(tmp_path):
+    bot = make_bot(tmp_path, model_name=str(tmp_path / "checkpoint"))
+    assert bot.update_model_config({"temperature": 0.2}, save=False)["temperature"] == 0.2
+
+
+def test_memory_of_an_int8_model_counts_its_packed_weights(tiny_model):
+    quantized = torch.ao.quantization.quantize_dynamic(tiny_model.model, {torch.nn.Linear}, dtype=torch.qint8)
+    linears = [module for module in tiny_model.model.modules() if isinstance(module, torch.nn.Linear)]
+    int8_weights = sum(module.weight.numel() for module in linears)
+    embeddings = tiny_model.model.get_input_embeddings().weight
+    assert model_memory_bytes(quantized) >= int8_weights + embeddings.numel() * embeddings.element_size()
+    assert model_memory_bytes(quantized) < model_memory_bytes(tiny_model.model)
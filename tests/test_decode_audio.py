@@ -0,0 +1,53 @@
+import io
+import shutil
+import subprocess
+import wave
+
+import numpy as np
+import pytest
+
+import transcribe
+from transcribe import SAMPLING_RATE, decode_audio
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+
+
+def wav_bytes(samples, rate=SAMPLING_RATE):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes((samples * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def test_audio_goes_through_pipes(monkeypatch):
+    calls = []
+
+    def run(command, input, capture_output, check):
+        calls.append((command, input))
+        return subprocess.CompletedProcess(command, 0, stdout=np.arange(4, dtype=np.float32).tobytes(), stderr=b"")
+
+    monkeypatch.setattr(transcribe.subprocess, "run", run)
+    audio = decode_audio(b"encoded")
+    assert audio.dtype == np.float32 and list(audio) == [0, 1, 2, 3]
+    command, data = calls[0]
+    assert data == b"encoded" and "pipe:0" in command and command[-1] == "pipe:1"
+
+
+def test_undecodable_audio_raises_value_error(monkeypatch):
+    def run(command, input, capture_output, check):
+        raise subprocess.CalledProcessError(1, command, stderr=b"Invalid data found when processing input")
+
+    monkeypatch.setattr(transcribe.subprocess, "run", run)
+    with pytest.raises(ValueError, match="Invalid data"):
+        decode_audio(b"garbage")
+
+
+@requires_ffmpeg
+def test_wav_is_resampled_to_16_khz():
+    tone = np.sin(2 * np.pi * 440 * np.arange(8000) / 8000).astype(np.float32) * 0.5
+    audio = decode_audio(wav_bytes(tone, rate=8000))
+    assert abs(len(audio) - SAMPLING_RATE) < 100
+    assert 0.4 < np.abs(audio).max() < 0.6
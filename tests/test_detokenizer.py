@@ -0,0 +1,63 @@
+from detokenizer import ResponseDetokenizer, StreamingDetokenizer
+
+
+class ByteTokenizer:
+    """One token per UTF-8 byte, so multi-byte characters span several tokens."""
+
+    def encode(self, text):
+        return list(text.encode('utf-8'))
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return bytes(token_ids).decode('utf-8', errors='replace')
+
+
+class PieceTokenizer:
+    """SentencePiece-like: a word-initial space is part of the token and dropped at the start of a decode."""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return "".join(self.pieces[i] for i in token_ids).replace("▁", " ").removeprefix(" ")
+
+
+def stream(detokenizer, token_ids):
+    pieces = [detokenizer.push(token_id) for token_id in token_ids]
+    pieces.append(detokenizer.flush())
+    return pieces
+
+
+def test_multi_byte_characters_are_never_split():
+    text = "naïve café — 東京 🎉 ok"
+    tokenizer = ByteTokenizer()
+    pieces = stream(StreamingDetokenizer(tokenizer), tokenizer.encode(text))
+    assert "".join(pieces) == text
+    assert not any("�" in piece for piece in pieces)
+
+
+def test_text_is_emitted_once_the_character_completes():
+    tokenizer = ByteTokenizer()
+    detokenizer = StreamingDetokenizer(tokenizer)
+    first, second, third, fourth = "🎉".encode('utf-8')
+    assert detokenizer.push(ord("a")) == "a"
+    assert [detokenizer.push(first), detokenizer.push(second), detokenizer.push(third)] == ["", "", ""]
+    assert detokenizer.push(fourth) == "🎉"
+
+
+def test_incomplete_character_at_the_end_is_flushed():
+    tokenizer = ByteTokenizer()
+    detokenizer = StreamingDetokenizer(tokenizer)
+    detokenizer.push(ord("x"))
+    assert detokenizer.push("é".encode('utf-8')[0]) == ""
+    assert detokenizer.flush() == "�"
+
+
+def test_spaces_merged_into_tokens_survive_streaming():
+    tokenizer = PieceTokenizer(["▁Hello", "▁wor", "ld", "!"])
+    assert "".join(stream(StreamingDetokenizer(tokenizer), [0, 1, 2, 3])) == "Hello world!"
+
+
+def test_response_detokenizer_strips_a_leading_role_name():
+    tokenizer = ByteTokenizer()
+    pieces = stream(ResponseDetokenizer(tokenizer), tokenizer.encode("assistant\n\nSure: ünïcode"))
+    assert "".join(pieces) == "Sure: ünïcode"
@@ -0,0 +1,30 @@
+from streaming import ChatStream, EmitPacer
+
+
+def message(role, content):
+    return {"role": role, "content": content, "sibling_info": (1, 1)}
+
+
+def test_pacer_counts_only_the_streamed_message():
+    stream = ChatStream('delta', EmitPacer(interval_ms=1000, max_chars=10))
+    history = [message("user", "x" * 500), message("assistant", "")]
+    stream.begin_turn(history)
+    assert stream.due(history[:1] + [message("assistant", "first")])  # the first text goes out at once
+    assert not stream.due(history[:1] + [message("assistant", "first bit")])
+    assert stream.due(history[:1] + [message("assistant", "first bit and more")])
+
+
+def test_pacer_begin_forgets_unacknowledged_emits():
+    pacer = EmitPacer()
+    pacer.unacked = pacer.max_unacked
+    pacer.begin(0)
+    assert pacer.unacked == 0
+    assert pacer.due(5)
+
+
+def test_turn_without_text_reports_no_first_visible_time():
+    stream = ChatStream('delta')
+    history = [message("user", "Hi"), message("assistant", "")]
+    stream.begin_turn(history)
+    assert not stream.due(history)
+    assert stream.end_turn(history)["first_visible_ms"] is None
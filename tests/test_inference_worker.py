@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from multiprocessing import Pipe
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+import inference_worker
+from conftest import EOS_TOKEN_ID, FakeBot, greedy, make_tiny_model
+from inference_worker import InferenceWorkers, RemoteModel, serve
+from scheduler import BatchScheduler
+
+
+class WorkerBot:
+    """The parts of a ChatBot an inference worker serves, on a tiny model; also loadable with --bot-class."""
+
+    def __init__(self, model_config_file=None, chat_dir=None):
+        model = make_tiny_model("tiny", seed=0)
+        self.current_model = model
+        self.model_pool = SimpleNamespace(
+            get=lambda name: model if name == model.name else None,
+            stats=lambda: {"models": [{"model_name": model.name}]},
+        )
+        self.scheduler = BatchScheduler(FakeBot(model))
+        self.prefix_cache = self.scheduler.bot.prefix_cache
+        self.on_model_switch = None
+        self.configs = []
+
+    def get_model_status(self):
+        return {"serving": self.current_model.name}
+
+    def update_model_config(self, config, save=True):
+        self.configs.append(config)
+
+
+def expected(model, prompt_ids, max_new_tokens):
+    return [t for t in greedy(model, prompt_ids, max_new_tokens) if t != EOS_TOKEN_ID]
+
+
+def receive_until_done(conn, request_id, n=1):
+    tokens, done = [[] for _ in range(n)], {}
+    while len(done) < n:
+        message = conn.recv()
+        if message[0] == "token" and message[1] == request_id:
+            tokens[message[2]].append(message[3])
+        elif message[0] == "done" and message[1] == request_id:
+            done[message[2]] = message[4]
+    return tokens, done
+
+
+def test_serve_streams_tokens_and_reports_done(monkeypatch):
+    # No periodic status reports, which would outlive the connection closed at the end
+    monkeypatch.setattr(inference_worker, "STATUS_INTERVAL", 3600)
+    bot = WorkerBot()
+    conn, worker_conn = Pipe()
+    threading.Thread(target=serve, args=(worker_conn, bot), daemon=True).start()
+    kind, status = conn.recv()
+    assert kind == "ready" and status["serving"] == "tiny" and status["models"] == ["tiny"]
+
+    sampling = dict(max_new_tokens=12, temperature=0.0, top_p=1.0)
+    conn.send(("generate", 0, "tiny", [1, 2, 3], sampling, 1, False))
+    tokens, done = receive_until_done(conn, 0)
+    assert tokens[0] == expected(bot.current_model, [1, 2, 3], 12) and done == {0: None}
+
+    conn.send(("generate", 1, "missing", [1, 2, 3], sampling, 2, False))
+    tokens, done = receive_until_done(conn, 1, n=2)
+    assert "not loaded" in done[0] and "not loaded" in done[1]
+
+    conn.send(("config", {"temperature": 0.5}))
+    conn.send(("generate", 2, "tiny", [1, 2, 3], sampling, 1, False))
+    receive_until_done(conn, 2)
+    assert bot.configs == [{"temperature": 0.5}]
+    conn.close()
+
+
+def test_a_crashed_worker_fails_its_requests_and_is_restarted(tmp_path, monkeypatch):
+    # The worker process imports WorkerBot from this file
+    monkeypatch.setenv("PYTHONPATH", os.path.dirname(os.path.abspath(__file__)))
+    config_file = tmp_path / "model_config.json"
+    config_file.write_text("{}")
+    workers = InferenceWorkers(str(config_file), bot_class="test_inference_worker:WorkerBot")
+    workers.start()
+    try:
+        workers.wait_ready(timeout=60)
+        model = RemoteModel("tiny", SimpleNamespace(eos_token_id=EOS_TOKEN_ID))
+        request = workers.submit(torch.tensor([[1, 2, 3]]), 10000, 0.0, 1.0, {EOS_TOKEN_ID}, model=model)
+        while not request.generated_ids and not request.done:
+            time.sleep(0.01)
+        worker = workers.workers[0]
+        worker.process.kill()
+        with pytest.raises(RuntimeError, match="exited"):
+            list(request)
+
+        deadline = time.monotonic() + 60
+        while not (worker.state == "ready" and worker.restarts == 1) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert worker.state == "ready" and workers.stats()["restarts"] == 1
+        retried = workers.submit(torch.tensor([[1, 2, 3]]), 8, 0.0, 1.0, {EOS_TOKEN_ID}, model=model)
+        assert list(retried) == expected(make_tiny_model("tiny", seed=0), [1, 2, 3], 8)
+    finally:
+        workers.close()
@@ -0,0 +1,62 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from model_pool import ModelPool
+
+
+class Loader:
+    """Loads a tiny linear layer per name; a name in `blocked` waits until it is released."""
+
+    def __init__(self):
+        self.loaded = []
+        self.release = threading.Event()
+        self.blocked = set()
+
+    def __call__(self, name):
+        if name in self.blocked:
+            self.release.wait()
+        if name == "broken":
+            raise OSError("no such model")
+        self.loaded.append(name)
+        return torch.nn.Linear(4, 4), SimpleNamespace(eos_token_id=0)
+
+
+def test_least_recently_used_inactive_model_is_evicted():
+    evicted = []
+    loader = Loader()
+    pool = ModelPool(loader, max_models=2, on_evict=evicted.append)
+    pool.set_active(pool.load("a"))
+    pool.load("b")
+    assert pool.load("a") is pool.active and loader.loaded == ["a", "b"]
+    pool.load("c")
+    assert [model["model_name"] for model in pool.stats()["models"]] == ["a", "c"]
+    assert pool.stats()["evictions"] == 1 and evicted == ["b"]
+
+
+def test_background_load_keeps_serving_and_calls_back_once():
+    loader = Loader()
+    loader.blocked.add("b")
+    pool = ModelPool(loader, max_models=2)
+    pool.set_active(pool.load("a"))
+    ready = []
+    done = threading.Event()
+    pool.load_async("b", on_ready=lambda entry: ready.append(entry.name))
+    pool.load_async("b", on_ready=lambda entry: (ready.append(entry.name), done.set()))
+    assert pool.is_loading("b") and pool.stats()["active"] == "a"
+    loader.release.set()
+    assert done.wait(5)
+    assert ready == ["b", "b"] and loader.loaded == ["a", "b"]
+    assert not pool.is_loading("b")
+
+
+def test_failed_background_load_is_reported():
+    pool = ModelPool(Loader())
+    failed = threading.Event()
+    pool.load_async("broken", on_error=lambda name, error: failed.set())
+    assert failed.wait(5)
+    assert "no such model" in pool.stats()["errors"]["broken"]
+    with pytest.raises(OSError):
+        pool.load("broken")
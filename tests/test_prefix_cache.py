@@ -0,0 +1,83 @@
+import torch
+
+from prefix_cache import PrefixCache, cache_to_layers, layers_to_cache
+
+LAYERS = 2
+HEADS = 2
+HEAD_DIM = 4
+BYTES_PER_TOKEN = LAYERS * 2 * HEADS * HEAD_DIM * 4  # keys and values, float32
+
+
+def make_cache(length, batch=1, fill=0.0):
+    return layers_to_cache([
+        (torch.full((batch, HEADS, length, HEAD_DIM), fill), torch.full((batch, HEADS, length, HEAD_DIM), fill))
+        for _ in range(LAYERS)
+    ])
+
+
+def test_bytes_count_only_the_stored_tokens():
+    cache = PrefixCache(max_bytes=1 << 20)
+    # A longer cache than the tokens, as when the last sampled token was never fed back
+    cache.store([1, 2, 3, 4, 5], make_cache(8), model="m")
+    assert cache.stats()["bytes"] == 5 * BYTES_PER_TOKEN
+
+
+def test_stored_entries_do_not_share_storage_with_the_batch():
+    cache = PrefixCache(max_bytes=1 << 20)
+    batch = cache_to_layers(make_cache(6, batch=3))
+    row = [(k[1:2, :, -4:], v[1:2, :, -4:]) for k, v in batch]
+    cache.store([1, 2, 3, 4], layers_to_cache(row), model="m")
+    batch[0][0].fill_(7.0)
+    _, past_key_values = cache.lookup([1, 2, 3, 4, 9], model="m")
+    assert cache_to_layers(past_key_values)[0][0].abs().sum().item() == 0
+
+
+def test_lookup_returns_the_longest_shared_prefix_of_the_same_model():
+    cache = PrefixCache(max_bytes=1 << 20)
+    cache.store([1, 2, 3], make_cache(3), model="m")
+    cache.store([1, 2, 7, 8, 9], make_cache(5), model="m")
+    length, past_key_values = cache.lookup([1, 2, 7, 8, 10, 11], model="m")
+    assert length == 4
+    assert cache_to_layers(past_key_values)[0][0].shape[2] == 4
+    # The last prompt token is never served, its logits are needed
+    assert cache.lookup([1, 2, 3], model="m")[0] == 2
+    assert cache.lookup([1, 2, 3, 4], model="other") == (0, None)
+
+
+def test_storing_a_longer_sequence_replaces_its_prefix():
+    cache = PrefixCache(max_bytes=1 << 20)
+    cache.store([1, 2], make_cache(2), model="m")
+    cache.store([1, 2, 3, 4], make_cache(4), model="m")
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["bytes"] == 4 * BYTES_PER_TOKEN
+
+
+def test_least_recently_used_entries_are_evicted_to_fit():
+    cache = PrefixCache(max_bytes=10 * BYTES_PER_TOKEN)
+    cache.store([1, 2, 3, 4], make_cache(4), model="m")
+    cache.store([5, 6, 7, 8], make_cache(4), model="m")
+    cache.lookup([1, 2, 3, 4, 0], model="m")  # now the most recently used
+    cache.store([9, 10, 11, 12], make_cache(4), model="m")
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 8 * BYTES_PER_TOKEN <= stats["max_bytes"]
+    assert cache.lookup([5, 6, 7, 8, 0], model="m") == (0, None)
+    assert cache.lookup([1, 2, 3, 4, 0], model="m")[0] == 4
+
+
+def test_entries_over_the_budget_are_not_stored():
+    cache = PrefixCache(max_bytes=3 * BYTES_PER_TOKEN)
+    cache.store([1, 2, 3, 4], make_cache(4), model="m")
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_clear_one_model_keeps_the_byte_count_right():
+    cache = PrefixCache(max_bytes=1 << 20)
+    cache.store([1, 2, 3], make_cache(3), model="a")
+    cache.store([4, 5], make_cache(2), model="b")
+    cache.clear("a")
+    assert cache.stats()["bytes"] == 2 * BYTES_PER_TOKEN
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
@@ -0,0 +1,56 @@
+from chatbot import ChatTree
+from conftest import chat_model
+from prompt_builder import PromptBuilder
+
+
+def chat():
+    tree = ChatTree()
+    tree.add_message("user", "Hi")
+    tree.add_message("assistant", "Hello! How can I help?")
+    tree.add_message("user", "Tell me a story")
+    return tree
+
+
+def full_encode(pooled, tree):
+    text = pooled.tokenizer.apply_chat_template(tree.get_chat_history(), tokenize=False, add_generation_prompt=True)
+    return [ord(c) for c in text]
+
+
+def test_prompt_matches_a_full_encode():
+    tree, pooled = chat(), chat_model()
+    assert PromptBuilder().build(tree.get_active_path(), pooled) == full_encode(pooled, tree)
+
+
+def test_only_new_messages_are_encoded_on_the_next_turn():
+    tree, pooled = chat(), chat_model()
+    builder = PromptBuilder(verify_every=1000)
+    builder.build(tree.get_active_path(), pooled)
+    assert builder.segments_encoded == 4
+
+    reply = tree.add_message("assistant", "Once")
+    tree.append_content(reply, " upon a time")
+    tree.add_message("user", "Go on")
+    encoded = pooled.tokenizer.encoded
+    assert builder.build(tree.get_active_path(), pooled) == full_encode(pooled, tree)
+    assert builder.segments_encoded == 6
+    assert pooled.tokenizer.encoded - encoded == len("<|assistant|>Once upon a time\n<|user|>Go on\n")
+
+
+def test_segments_are_memoized_per_model():
+    tree = chat()
+    builder = PromptBuilder(verify_every=1000)
+    builder.build(tree.get_active_path(), chat_model("a"))
+    builder.build(tree.get_active_path(), chat_model("b"))
+    builder.build(tree.get_active_path(), chat_model("a"))
+    assert builder.segments_encoded == 8
+
+
+def test_templates_that_do_not_split_fall_back_to_full_encodes():
+    tree, pooled = chat(), chat_model()
+    render = pooled.tokenizer.apply_chat_template
+    # A template that numbers the messages: a message's text depends on how many come before it
+    pooled.tokenizer.apply_chat_template = lambda messages, **kwargs: f"{len(messages)} " + render(messages, **kwargs)
+    builder = PromptBuilder()
+    ids = builder.build(tree.get_active_path(), pooled)
+    assert pooled.name in builder.unsupported
+    assert ids == [ord(c) for c in pooled.tokenizer.apply_chat_template(tree.get_chat_history(), add_generation_prompt=True)]
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from readiness import Readiness, WarmingUp
+
+
+def test_components_become_ready_independently():
+    readiness = Readiness()
+    statuses = []
+    readiness.listeners.append(statuses.append)
+    release = threading.Event()
+    done = threading.Event()
+    readiness.listeners.append(lambda status: "slow" in status["components"] and status["ready"] and done.set())
+    readiness.load("fast", lambda: "fast model")
+    readiness.load("slow", lambda: release.wait() and "slow model")
+
+    with pytest.raises(WarmingUp) as error:
+        readiness.get("slow")
+    assert error.value.state == "loading"
+    with pytest.raises(WarmingUp) as error:
+        readiness.get("missing")
+    assert error.value.state == "pending"
+
+    release.set()
+    assert done.wait(5)
+    assert readiness.get("fast") == "fast model" and readiness.get("slow") == "slow model"
+    assert readiness.status()["components"]["slow"]["load_time"] is not None
+    assert statuses[0]["components"]["fast"]["state"] == "loading"
+
+
+def test_a_failed_component_reports_its_error():
+    readiness = Readiness()
+    failed = threading.Event()
+    readiness.listeners.append(lambda status: status["components"]["llm"]["state"] == "failed" and failed.set())
+
+    def load():
+        raise OSError("out of memory")
+
+    readiness.load("llm", load)
+    assert failed.wait(5)
+    assert readiness.status()["components"]["llm"]["error"] == "out of memory"
+    assert not readiness.is_ready()
+    with pytest.raises(WarmingUp, match="failed to load"):
+        readiness.get("llm")
+
+
+def test_first_byte_is_recorded_once():
+    readiness = Readiness(started=0.0)
+    readiness.mark_first_byte()
+    first = readiness.first_byte_time
+    readiness.mark_first_byte()
+    assert readiness.status()["first_byte_time"] == first > 0
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+from chatbot import ChatTree, Conversation
+from streaming import ChatStream
+
+
+def answered_tree():
+    tree = ChatTree()
+    tree.add_message("user", "Hi")
+    tree.add_message("assistant", "Hello")
+    return tree
+
+
+def test_regenerate_returns_the_new_siblings_and_shows_the_first():
+    tree = answered_tree()
+    old = tree.current_node
+    nodes = tree.regenerate_message(0, n=3)
+    assert [node.content for node in nodes] == ["", "", ""]
+    assert old.parent.children == [old] + nodes
+    assert tree.current_node is nodes[0]
+
+
+def test_regenerate_of_a_user_message_returns_none():
+    tree = answered_tree()
+    children = list(tree.current_node.parent.children)
+    assert tree.regenerate_message(1, n=2) is None
+    assert tree.current_node.parent.children == children
+
+
+def test_alternatives_are_the_samples_off_the_active_path():
+    tree = answered_tree()
+    nodes = tree.regenerate_message(0, n=3)
+    nodes[1].append_content("Hey")
+    nodes[2].append_content("Howdy")
+    conversation = SimpleNamespace(chat_tree=tree, alternatives=nodes)
+    assert Conversation.alternative_texts(conversation) == ["Hey", "Howdy"]
+
+
+def test_delta_appends_to_each_alternative_and_clears_them_at_the_end():
+    history = {"messages": [{"role": "assistant", "content": "", "sibling_info": (2, 4)}]}
+    stream = ChatStream('delta')
+    stream.snapshot(history)
+    assert stream.update(history, alternatives=["He", "Ho"])[1] == {"seq": 2, "alternatives": ["He", "Ho"]}
+    assert stream.update(history, alternatives=["Hey", "Ho"])[1] == {"seq": 3, "alternatives_append": ["y", ""]}
+    assert stream.update(history, alternatives=["Hey", "Ho"])[1] == {"seq": 4}
+    assert stream.update(history, alternatives=[])[1] == {"seq": 5, "alternatives": []}
+
+
+def test_full_mode_sends_the_alternatives_with_the_history():
+    history = {"messages": []}
+    stream = ChatStream('full')
+    assert stream.update(history, alternatives=["a", "b"])[1]["alternatives"] == ["a", "b"]
+    assert "alternatives" not in stream.update(history)[1]
@@ -0,0 +1,51 @@
+import time
+
+import torch
+
+from conftest import EOS_TOKEN_ID, FakeBot, greedy
+from scheduler import BatchScheduler
+
+
+def submit(scheduler, prompt_ids, max_new_tokens):
+    return scheduler.submit(torch.tensor([prompt_ids]), max_new_tokens, 0.0, 1.0, {EOS_TOKEN_ID})
+
+
+def expected(model, prompt_ids, max_new_tokens):
+    return [t for t in greedy(model, prompt_ids, max_new_tokens) if t != EOS_TOKEN_ID]
+
+
+def test_rows_of_different_lengths_decode_like_single_sequences(tiny_model):
+    scheduler = BatchScheduler(FakeBot(tiny_model))
+    prompts = [[1, 3, 5], [1, 8, 13, 21, 34, 55, 2, 9, 4], [1, 60]]
+    # Held off so all three are prefilled together and left-padded into one batch
+    with scheduler._condition:
+        requests = [submit(scheduler, prompt_ids, 20) for prompt_ids in prompts]
+    for request, prompt_ids in zip(requests, prompts):
+        assert list(request) == expected(tiny_model, prompt_ids, 20)
+    assert scheduler.stats()["mean_batch_size"] > 1
+
+
+def test_join_and_leave_mid_batch(tiny_model):
+    scheduler = BatchScheduler(FakeBot(tiny_model))
+    first = submit(scheduler, [1, 4, 4, 4, 7, 11], 60)
+    while len(first.generated_ids) < 5 and not first.done:
+        time.sleep(0.001)
+    # Joins a batch whose padded length differs from its own prompt, then leaves it first
+    second = submit(scheduler, [1, 30, 31], 8)
+    third = submit(scheduler, [1, 12, 50, 49, 48, 47, 46, 45, 44, 43, 42, 41], 30)
+    assert list(second) == expected(tiny_model, [1, 30, 31], 8)
+    assert list(third) == expected(tiny_model, [1, 12, 50, 49, 48, 47, 46, 45, 44, 43, 42, 41], 30)
+    assert list(first) == expected(tiny_model, [1, 4, 4, 4, 7, 11], 60)
+    assert scheduler.stats()["active"] == 0
+
+
+def test_cancelled_request_leaves_the_batch(tiny_model):
+    scheduler = BatchScheduler(FakeBot(tiny_model))
+    with scheduler._condition:
+        kept = submit(scheduler, [1, 2, 3, 4], 40)
+        cancelled = submit(scheduler, [1, 5, 6], 200)
+    cancelled.cancel()
+    assert list(kept) == expected(tiny_model, [1, 2, 3, 4], 40)
+    list(cancelled)
+    assert cancelled.done and len(cancelled.generated_ids) < 200
+    assert scheduler.stats()["cancelled"] == 1
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from chat_store import ChatStore
+from chatbot import ChatTree
+from sessions import SessionManager
+
+
+def make_sessions(tmp_path, idle_timeout=30 * 60):
+    bot = SimpleNamespace(chat_store=ChatStore(str(tmp_path), ChatTree))
+    return SessionManager(bot, idle_timeout=idle_timeout)
+
+
+def contents(session):
+    return [message["content"] for message in session.get_chat_history()[1:]]
+
+
+def test_each_connection_has_its_own_chat(tmp_path):
+    sessions = make_sessions(tmp_path)
+    first, second = sessions.get("a"), sessions.get("b")
+    assert sessions.get("a") is first
+    first.chat_tree.add_message("user", "Hello")
+    assert contents(first) == ["Hello"] and contents(second) == []
+    assert first.get_chat_id() != second.get_chat_id()
+
+    second.chat_tree.add_message("user", "Other")
+    first.reset_chat()
+    assert contents(first) == [] and contents(second) == ["Other"]
+
+
+def test_idle_sessions_are_saved_and_restored(tmp_path):
+    sessions = make_sessions(tmp_path, idle_timeout=0)
+    session = sessions.get("a")
+    session.chat_tree.add_message("user", "Hello")
+    chat_id = session.get_chat_id()
+    sessions.get("b")  # an empty chat is dropped without being saved
+
+    assert sessions.evict_idle() == 2
+    assert sessions.stats()["active"] == 0 and sessions.stats()["evicted"] == 1
+    restored = sessions.get("a")
+    assert restored is not session
+    assert restored.get_chat_id() == chat_id and contents(restored) == ["Hello"]
@@ -0,0 +1,34 @@
+import torch
+
+from conftest import EOS_TOKEN_ID, FakeBot, greedy
+from scheduler import BatchScheduler
+
+PROMPTS = [[1, 5, 9, 13, 17], [1, 40, 2, 33], [1, 7, 7, 7, 7, 7, 7, 21]]
+
+
+def generate(scheduler, prompt_ids, max_new_tokens=24):
+    request = scheduler.submit(torch.tensor([prompt_ids]), max_new_tokens, 0.0, 1.0, {EOS_TOKEN_ID})
+    return request, list(request)
+
+
+def test_speculative_greedy_matches_plain_greedy(tiny_model, tiny_draft):
+    scheduler = BatchScheduler(FakeBot(tiny_model, draft=tiny_draft))
+    for prompt_ids in PROMPTS:
+        request, tokens = generate(scheduler, prompt_ids)
+        expected = greedy(tiny_model, prompt_ids, 24)
+        assert tokens == [t for t in expected if t != EOS_TOKEN_ID]
+        assert request.draft_proposed > 0
+
+
+def test_speculative_skipped_when_batch_is_busy(tiny_model, tiny_draft):
+    scheduler = BatchScheduler(FakeBot(tiny_model, draft=tiny_draft))
+    # Submitted while the scheduler thread is held off, so both are admitted in the same pass
+    with scheduler._condition:
+        requests = [
+            scheduler.submit(torch.tensor([prompt_ids]), 24, 0.0, 1.0, {EOS_TOKEN_ID})
+            for prompt_ids in PROMPTS[:2]
+        ]
+    for request, prompt_ids in zip(requests, PROMPTS[:2]):
+        expected = greedy(tiny_model, prompt_ids, 24)
+        assert list(request) == [t for t in expected if t != EOS_TOKEN_ID]
+        assert request.draft_proposed == 0
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from sessions import ChatSession
+
+
+class Request:
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def running_turn(session, submit_delay=0.0):
+    """A handler holding the session's turn until its request is stopped, like stream_response."""
+    started = threading.Event()
+    requests = []
+
+    def run():
+        with session.turn_lock:
+            started.set()
+            time.sleep(submit_delay)
+            request = Request()
+            requests.append(request)
+            session.generating = [request]
+            request.cancelled.wait(5)
+            session.generating = []
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait(5)
+    return thread, requests
+
+
+def test_stop_without_a_response_is_a_no_op():
+    assert not ChatSession(bot=None, sid="a").stop_generation()
+
+
+def test_a_new_turn_stops_the_running_one_and_waits_for_it():
+    session = ChatSession(bot=None, sid="a")
+    thread, requests = running_turn(session)
+    with session.exclusive_turn():
+        # The running turn was cancelled and finished before this one got the session
+        assert requests[0].cancelled.is_set() and session.generating == []
+    thread.join(5)
+
+
+def test_a_turn_that_had_not_submitted_yet_is_stopped_too():
+    session = ChatSession(bot=None, sid="a")
+    thread, requests = running_turn(session, submit_delay=0.2)
+    assert not session.stop_generation()  # nothing to stop yet
+    with session.exclusive_turn():
+        assert requests[0].cancelled.is_set() and session.generating == []
+    thread.join(5)
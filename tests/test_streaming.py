@@ -0,0 +1,52 @@
+from streaming import ChatStream
+
+
+def message(role, content, sibling_info=(1, 1)):
+    return {"role": role, "content": content, "sibling_info": sibling_info}
+
+
+HISTORY = [message("user", "root"), message("user", "Hi"), message("assistant", "")]
+
+
+def test_full_mode_sends_the_whole_history():
+    stream = ChatStream('full')
+    event, payload = stream.update({"messages": HISTORY, "id": "c"})
+    assert event == 'chat_update'
+    assert payload["messages"] == HISTORY and payload["seq"] == 1
+
+
+def test_delta_appends_to_the_streamed_message():
+    stream = ChatStream('delta')
+    stream.snapshot({"messages": HISTORY})
+    event, payload = stream.update({"messages": HISTORY[:2] + [message("assistant", "Hel")]})
+    assert event == 'chat_delta'
+    assert payload == {"seq": 2, "index": 2, "append": "Hel"}
+    _, payload = stream.update({"messages": HISTORY[:2] + [message("assistant", "Hello")]}, type='stop')
+    assert payload == {"seq": 3, "index": 2, "append": "lo", "type": "stop"}
+
+
+def test_delta_without_changes_only_advances_the_sequence():
+    stream = ChatStream('delta')
+    stream.snapshot({"messages": HISTORY})
+    assert stream.update({"messages": HISTORY})[1] == {"seq": 2}
+
+
+def test_delta_resends_from_the_first_changed_message():
+    stream = ChatStream('delta')
+    stream.snapshot({"messages": HISTORY[:2] + [message("assistant", "Old answer")]})
+    # A regenerated sibling replaces the text rather than extending it
+    changed = HISTORY[:2] + [message("assistant", "New", sibling_info=(2, 2))]
+    assert stream.update({"messages": changed})[1] == {"seq": 2, "start": 2, "messages": changed[2:]}
+    edited = [HISTORY[0], message("user", "Hey"), message("assistant", "")]
+    assert stream.update({"messages": edited})[1] == {"seq": 3, "start": 1, "messages": edited[1:]}
+
+
+def test_resync_snapshot_resets_the_delta_baseline():
+    stream = ChatStream('delta')
+    stream.snapshot({"messages": HISTORY})
+    stream.update({"messages": HISTORY[:2] + [message("assistant", "Hel")]})
+    # The client saw a gap and asked for the whole history
+    resync = stream.snapshot({"messages": HISTORY[:2] + [message("assistant", "Hello")], "type": "resync"})
+    assert resync["seq"] == 3 and resync["messages"][2]["content"] == "Hello"
+    assert stream.update({"messages": HISTORY[:2] + [message("assistant", "Hello!")]})[1] == \
+        {"seq": 4, "index": 2, "append": "!"}
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from transcription_cache import TranscriptionCache, audio_digest
+
+
+def test_repeated_audio_is_transcribed_once(tmp_path):
+    cache = TranscriptionCache(str(tmp_path))
+    calls = []
+    digest = audio_digest(b"audio")
+    assert cache.get_or_transcribe(digest, "whisper", lambda: calls.append(1) or "hello") == ("hello", False)
+    assert cache.get_or_transcribe(digest, "whisper", lambda: calls.append(1) or "other") == ("hello", True)
+    # Another model transcribes the same audio separately
+    assert cache.get_or_transcribe(digest, "whisper-large", lambda: "bonjour") == ("bonjour", False)
+    assert len(calls) == 1 and cache.stats()["memory_hits"] == 1
+
+
+def test_transcripts_survive_a_restart(tmp_path):
+    TranscriptionCache(str(tmp_path)).get_or_transcribe("abc", "openai/whisper-base", lambda: "hello")
+    cache = TranscriptionCache(str(tmp_path))
+    assert cache.get_or_transcribe("abc", "openai/whisper-base", lambda: "again") == ("hello", True)
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_concurrent_requests_for_the_same_audio_wait_for_one_transcription(tmp_path):
+    cache = TranscriptionCache(str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "hello"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_transcribe("abc", "m", slow))) for _ in range(3)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1 and sorted(results) == [("hello", False), ("hello", True), ("hello", True)]
+
+
+def test_a_failed_transcription_is_not_cached(tmp_path):
+    cache = TranscriptionCache(str(tmp_path))
+
+    def fail():
+        raise RuntimeError("decoder crashed")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_transcribe("abc", "m", fail)
+    assert cache.get_or_transcribe("abc", "m", lambda: "hello") == ("hello", False)
+
+
+def test_disk_cache_drops_the_least_recently_used_files(tmp_path):
+    cache = TranscriptionCache(str(tmp_path), max_entries=1, max_disk_mb=0.0003)
+    for digest in ["a", "b", "c", "d", "e"]:
+        cache.get_or_transcribe(digest, "m", lambda: "x" * 50)
+    stats = cache.stats()
+    assert stats["evictions"] > 0 and stats["disk_bytes"] <= cache.max_disk_bytes
+    assert stats["memory_entries"] == 1
@@ -0,0 +1,58 @@
+import threading
+
+import numpy as np
+
+import transcription_worker
+from transcribe import SAMPLING_RATE, split_windows
+from transcription_worker import TranscriptionWorker
+
+
+class FakeTranscriber:
+    """Transcribes each window as the number of its first sample, one batch at a time."""
+
+    vad = None
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+
+    def speech_windows(self, audio):
+        return split_windows(audio), {}
+
+    def transcribe_windows(self, windows):
+        self.release.wait()
+        self.batches.append(len(windows))
+        return [str(int(window[0])) for window in windows], {"features": 0.0, "generate": 0.0}
+
+    def timings(self, audio, start_time):
+        return {"audio_seconds": len(audio) / SAMPLING_RATE}
+
+    def log_timings(self, timings):
+        pass
+
+
+def recording(value, seconds=1):
+    return np.full(seconds * SAMPLING_RATE, value, dtype=np.float32).tobytes()
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_text(monkeypatch):
+    monkeypatch.setattr(transcription_worker, "decode_audio", lambda data: np.frombuffer(data, dtype=np.float32))
+    transcriber = FakeTranscriber()
+    worker = TranscriptionWorker(transcriber, max_batch_size=8, max_wait_ms=200)
+    requests = [worker.submit(recording(value)) for value in (1, 2, 3)]
+    transcriber.release.set()
+
+    assert [request.result()[0] for request in requests] == ["1", "2", "3"]
+    assert transcriber.batches == [3]
+    stats = worker.stats()
+    assert stats["batches"] == 1 and stats["completed"] == 3 and stats["batch_size_histogram"] == {3: 1}
+    assert requests[0].result()[1]["batch_size"] == 3
+
+
+def test_a_recording_longer_than_the_batch_runs_on_its_own(monkeypatch):
+    monkeypatch.setattr(transcription_worker, "decode_audio", lambda data: np.frombuffer(data, dtype=np.float32))
+    transcriber = FakeTranscriber()
+    transcriber.release.set()
+    worker = TranscriptionWorker(transcriber, max_batch_size=2, max_wait_ms=0)
+    text, timings = worker.transcribe(recording(7, seconds=80))
+    assert text == "7" and timings["windows"] == 3 and transcriber.batches == [3]
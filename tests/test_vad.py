@@ -0,0 +1,34 @@
+import numpy as np
+
+from vad import EnergyVAD
+
+RATE = 16000
+
+
+def noise(seconds, level=1e-3, seed=0):
+    return (np.random.default_rng(seed).standard_normal(int(seconds * RATE)) * level).astype(np.float32)
+
+
+def tone(seconds, amplitude=0.3):
+    t = np.arange(int(seconds * RATE)) / RATE
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def test_silence_around_speech_is_cut_with_padding():
+    audio = np.concatenate([noise(2), tone(1), noise(2, seed=1)])
+    speech = EnergyVAD().trim(audio)
+    # One second of speech plus up to 200 ms of padding on either side
+    assert RATE <= len(speech) <= 1.5 * RATE
+
+
+def test_short_clicks_are_dropped():
+    audio = np.concatenate([noise(1), tone(0.06), noise(1, seed=1), tone(1), noise(1, seed=2)])
+    regions = EnergyVAD().speech_regions(audio)
+    assert len(regions) == 1 and regions[0][0] > 1.5 * RATE  # only the tone after the second pause
+
+
+def test_continuous_speech_is_kept_whole_and_silence_is_empty():
+    vad = EnergyVAD()
+    speech = tone(3)
+    assert len(vad.trim(speech)) == len(speech)
+    assert len(vad.trim(noise(3, level=1e-5))) == 0
@@ -0,0 +1,37 @@
+import numpy as np
+
+from transcribe import OVERLAP_SECONDS, SAMPLING_RATE, WINDOW_SECONDS, split_windows, stitch_texts
+
+
+def test_short_audio_is_one_window():
+    audio = np.zeros(10 * SAMPLING_RATE, dtype=np.float32)
+    assert len(split_windows(audio)) == 1
+
+
+def test_long_audio_is_covered_by_overlapping_windows():
+    audio = np.arange(70 * SAMPLING_RATE, dtype=np.float32)
+    windows = split_windows(audio)
+    assert len(windows) == 3
+    assert all(len(window) <= WINDOW_SECONDS * SAMPLING_RATE for window in windows)
+    step = (WINDOW_SECONDS - OVERLAP_SECONDS) * SAMPLING_RATE
+    assert [int(window[0]) for window in windows] == [0, step, 2 * step]
+    assert int(windows[-1][-1]) == len(audio) - 1
+    # Each window starts inside the previous one
+    assert all(int(b[0]) + OVERLAP_SECONDS * SAMPLING_RATE == int(a[-1]) + 1 for a, b in zip(windows, windows[1:]))
+
+
+def test_overlapping_transcripts_are_joined_once():
+    texts = ["the quick brown fox jumps", "fox jumps over the lazy", "the lazy dog."]
+    assert stitch_texts(texts) == "the quick brown fox jumps over the lazy dog."
+
+
+def test_words_cut_at_a_window_edge_may_differ():
+    texts = ["the quick brown fox jum", "own fox jumps over the lazy dog."]
+    assert stitch_texts(texts) == "the quick brown fox jumps over the lazy dog."
+    # Punctuation and case do not stop the overlap from matching
+    assert stitch_texts(["we went to the Market,", "the market to buy bread"]) == "we went to the Market, to buy bread"
+
+
+def test_unrelated_transcripts_are_concatenated():
+    assert stitch_texts(["hello there", "general kenobi"]) == "hello there general kenobi"
+    assert stitch_texts([]) == ""
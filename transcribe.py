@@ -1,49 +1,196 @@
+import logging
+import subprocess
+import threading
+import time
+
+import numpy as np
 import torch
 from transformers import WhisperProcessor, WhisperForConditionalGeneration
-import librosa
-import soundfile as sf
-from pydub import AudioSegment
-import os
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000  # what the Whisper feature extractor expects
+WINDOW_SECONDS = 30  # Whisper only looks at the first 30 s of its input
+OVERLAP_SECONDS = 5  # shared by neighbouring windows, so no word is only ever seen cut in half
+MAX_OVERLAP_WORDS = 30
+
+
+def decode_audio(data, sampling_rate=SAMPLING_RATE):
+    """
+    Decode an audio file held in memory (WebM/Opus from the browser, WAV, MP3, OGG, ...)
+    to mono float32 samples at `sampling_rate`. ffmpeg reads from stdin and writes
+    raw samples to stdout, so nothing touches the disk.
+    """
+    command = [
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sampling_rate),
+        "pipe:1",
+    ]
+    try:
+        process = subprocess.run(command, input=data, capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"Could not decode audio: {e.stderr.decode(errors='replace').strip()}") from e
+    return np.frombuffer(process.stdout, dtype=np.float32)
+
+
+def split_windows(audio, window_seconds=WINDOW_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """Cut audio into windows of at most `window_seconds`, each overlapping the previous one."""
+    window = window_seconds * SAMPLING_RATE
+    step = (window_seconds - overlap_seconds) * SAMPLING_RATE
+    if len(audio) <= window:
+        return [audio]
+    starts = range(0, len(audio) - overlap_seconds * SAMPLING_RATE, step)
+    return [audio[start:start + window] for start in starts]
+
+
+def _normalize(word):
+    return "".join(c for c in word.lower() if c.isalnum())
+
+
+def stitch_texts(texts, max_overlap_words=MAX_OVERLAP_WORDS):
+    """
+    Join the transcripts of overlapping windows. The overlap is transcribed twice, so
+    the longest run of words that ends one text and starts the next is kept once; the
+    word at either edge may be cut off mid-word and is allowed to differ.
+    """
+    words = texts[0].split() if texts else []
+    for text in texts[1:]:
+        new_words = text.split()
+        tail = [_normalize(w) for w in words[-(max_overlap_words + 1):]]
+        head = [_normalize(w) for w in new_words[:max_overlap_words + 1]]
+        best = None  # (length, words to drop from the end of `words`, words to skip in `new_words`)
+        for length in range(min(len(tail), len(head)), 0, -1):
+            for drop in (0, 1):
+                for skip in (0, 1):
+                    end = len(tail) - drop
+                    if end - length >= 0 and skip + length <= len(head) and tail[end - length:end] == head[skip:skip + length]:
+                        best = (length, drop, skip)
+                        break
+                if best:
+                    break
+            if best:
+                break
+        if best:
+            length, drop, skip = best
+            words = words[:len(words) - drop] + new_words[skip + length:]
+        else:
+            words += new_words
+    return " ".join(words)
+
 
 class Transcriber:
-    def __init__(self, model_id="openai/whisper-base"):
+    """
+    Whisper speech recognition. Audio longer than one 30 s window is split into
+    overlapping windows that go through `generate` together, up to `batch_size`
+    windows per call, and the window transcripts are stitched at the overlaps.
+
+    With a `vad` (see vad.EnergyVAD), silence is cut out before feature extraction
+    and clips without any speech never reach the model.
+    """
+
+    def __init__(self, model_id="openai/whisper-base", batch_size=8, vad=None):
+        self.model_id = model_id
+        self.batch_size = batch_size
+        self.vad = vad
+        self.window_time = None  # running mean of inference seconds per window, to price the windows VAD saves
+        self.vad_totals = {"clips": 0, "skipped_clips": 0, "audio_seconds": 0.0, "removed_seconds": 0.0, "saved_seconds": 0.0}
+        self._stats_lock = threading.Lock()  # request threads of the TranscriptionWorker update the totals concurrently
         self.processor = WhisperProcessor.from_pretrained(model_id)
         self.model = WhisperForConditionalGeneration.from_pretrained(model_id)
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model = self.model.to(self.device)
+        self.last_timings = {}
         print(f"Model loaded and running on {self.device}")
 
-    @staticmethod
-    def convert_webm_to_wav(webm_path, wav_path):
-        audio = AudioSegment.from_file(webm_path, format="webm")
-        audio.export(wav_path, format="wav")
-
     def transcribe_audio(self, audio_path):
-        # Convert WebM to WAV if necessary
-        file_extension = os.path.splitext(audio_path)[1].lower()
-        wav_path = None
-        if file_extension == '.webm':
-            wav_path = audio_path.rsplit('.', 1)[0] + '.wav'
-            self.convert_webm_to_wav(audio_path, wav_path)
-            audio_path = wav_path
-
-        try:
-            # Load the audio file
-            audio, sr = librosa.load(audio_path, sr=16000)
-
-            # Process the audio
-            input_features = self.processor(audio, sampling_rate=16000, return_tensors="pt").input_features
-            input_features = input_features.to(self.device)
-
-            # Generate token ids
-            predicted_ids = self.model.generate(input_features)
-
-            # Decode the token ids to text
-            transcription = self.processor.batch_decode(predicted_ids, skip_special_tokens=True)
-
-            return transcription[0]
-
-        finally:
-            # Clean up the temporary WAV file if it was created
-            if wav_path and os.path.exists(wav_path):
-                os.remove(wav_path)
\ No newline at end of file
+        with open(audio_path, 'rb') as f:
+            data = f.read()
+        text, _ = self.transcribe_bytes(data)
+        return text
+
+    def transcribe_bytes(self, data):
+        """Transcribe an encoded audio file held in memory; returns (text, per-stage timings in seconds)."""
+        start_time = time.perf_counter()
+        audio = decode_audio(data)
+        decoded_time = time.perf_counter()
+
+        windows, vad_timings = self.speech_windows(audio)
+        transcriptions, stage_timings = self.transcribe_windows(windows) if windows else ([], {"features": 0.0, "generate": 0.0})
+        text = stitch_texts(transcriptions)
+
+        timings = dict(self.timings(audio, start_time), windows=len(windows), decode=decoded_time - start_time,
+                       **vad_timings, **stage_timings)
+        self.log_timings(timings)
+        return text, timings
+
+    def speech_windows(self, audio):
+        """
+        Split audio into windows, after cutting out silence if there is a VAD; returns
+        (windows, VAD timings). No windows means there is no speech to transcribe.
+        """
+        if self.vad is None:
+            return split_windows(audio), {}
+        start_time = time.perf_counter()
+        speech = self.vad.trim(audio)
+        windows = split_windows(speech) if len(speech) else []
+        saved_windows = len(split_windows(audio)) - len(windows)
+        timings = {
+            "vad": time.perf_counter() - start_time,
+            "vad_removed_seconds": (len(audio) - len(speech)) / SAMPLING_RATE,
+            # Every window costs a full 30 s encoder pass, so the saving is counted in windows
+            "vad_saved_seconds": saved_windows * (self.window_time or 0.0),
+        }
+        with self._stats_lock:
+            totals = self.vad_totals
+            totals["clips"] += 1
+            totals["skipped_clips"] += not windows
+            totals["audio_seconds"] += len(audio) / SAMPLING_RATE
+            totals["removed_seconds"] += timings["vad_removed_seconds"]
+            totals["saved_seconds"] += timings["vad_saved_seconds"]
+        return windows, timings
+
+    def vad_stats(self):
+        with self._stats_lock:
+            totals = dict(self.vad_totals)
+        totals["removed_fraction"] = totals["removed_seconds"] / totals["audio_seconds"] if totals["audio_seconds"] else 0.0
+        return totals
+
+    def transcribe_windows(self, windows):
+        """Run windows of at most 30 s through Whisper, `batch_size` per generate call; returns (texts, timings)."""
+        start_time = time.perf_counter()
+        # Process the audio, one 30 s window per batch row
+        input_features = self.processor(windows, sampling_rate=SAMPLING_RATE, return_tensors="pt").input_features
+        input_features = input_features.to(self.device)
+        features_time = time.perf_counter()
+
+        # Generate token ids, `batch_size` windows per call
+        transcriptions = []
+        with torch.inference_mode():
+            for start in range(0, len(windows), self.batch_size):
+                predicted_ids = self.model.generate(input_features[start:start + self.batch_size])
+                # Decode the token ids to text
+                transcriptions += self.processor.batch_decode(predicted_ids, skip_special_tokens=True)
+        generated_time = time.perf_counter()
+        window_time = (generated_time - start_time) / len(windows)
+        self.window_time = window_time if self.window_time is None else 0.9 * self.window_time + 0.1 * window_time
+        timings = {"features": features_time - start_time, "generate": generated_time - features_time}
+        return [t.strip() for t in transcriptions], timings
+
+    def timings(self, audio, start_time):
+        audio_seconds = len(audio) / SAMPLING_RATE
+        total = time.perf_counter() - start_time
+        return {
+            "audio_seconds": audio_seconds,
+            "total": total,
+            "real_time_factor": total / audio_seconds if audio_seconds else 0.0,
+        }
+
+    def log_timings(self, timings):
+        self.last_timings = timings
+        logger.info(
+            f"Transcribed {timings['audio_seconds']:.1f}s of audio in {timings['windows']} windows in {timings['total']:.3f}s "
+            f"(decode {timings['decode']:.3f}s, features {timings['features']:.3f}s, generate {timings['generate']:.3f}s, "
+            f"real-time factor {timings['real_time_factor']:.3f})"
+            + (f", VAD removed {timings['vad_removed_seconds']:.1f}s of silence" if "vad" in timings else "")
+        )
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def audio_digest(data):
+    """Content hash of an uploaded audio file; identical uploads get the same one."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class TranscriptionCache:
+    """
+    Transcripts keyed by (audio content hash, Whisper model id).
+
+    Up to `max_entries` live in an in-memory LRU; every entry is also written to
+    `cache_dir` as a small JSON file, and the least recently used files are deleted
+    once they take more than `max_disk_mb`. A request for a key that is already being
+    transcribed waits for that transcription instead of starting its own.
+    """
+
+    def __init__(self, cache_dir, max_entries=1000, max_disk_mb=64):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        os.makedirs(cache_dir, exist_ok=True)
+        self._entries = OrderedDict()  # (digest, model_id) -> text
+        self._in_flight = {}  # (digest, model_id) -> threading.Event
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._disk_bytes = sum(os.path.getsize(path) for path in self._files())
+
+    def get_or_transcribe(self, digest, model_id, transcribe_fn):
+        """
+        Return (text, cached) for the audio with `digest`, calling `transcribe_fn()`,
+        which must return the text, only on a miss.
+        """
+        key = (digest, model_id)
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return self._entries[key], True
+                waiting = self._in_flight.get(key)
+                if waiting is None:
+                    self._in_flight[key] = threading.Event()
+                    break
+            # The same audio is being transcribed right now; its result lands in memory,
+            # and if it fails this request takes over
+            waiting.wait()
+
+        try:
+            text = self._read(key)
+            if text is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, text)
+                return text, True
+            with self._lock:
+                self.misses += 1
+            text = transcribe_fn()
+            self._remember(key, text)
+            self._write(key, text)
+            return text, False
+        finally:
+            self._release(key)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._entries),
+                "memory_bytes": sum(len(text.encode()) for text in self._entries.values()),
+                "disk_entries": len(self._files()),
+                "disk_bytes": self._disk_bytes,
+                "evictions": self.evictions,
+            }
+
+    def _release(self, key):
+        with self._lock:
+            event = self._in_flight.pop(key)
+        event.set()
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        digest, model_id = key
+        return os.path.join(self.cache_dir, f"{digest}-{model_id.replace('/', '--')}.json")
+
+    def _files(self):
+        return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = json.load(f)['text']
+            os.utime(path)  # the file's mtime is its place in the disk LRU
+            return text
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write(self, key, text):
+        path = self._path(key)
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({"digest": key[0], "model_id": key[1], "text": text}, f)
+        except OSError as e:
+            logger.warning(f"Could not cache transcription {path}: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_files()
+
+    def _evict_files(self):
+        files = sorted(self._files(), key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in files)
+        for path in files:
+            if total <= self.max_disk_bytes:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+        self._disk_bytes = total
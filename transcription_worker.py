@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+
+from transcribe import decode_audio, stitch_texts
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionRequest:
+    """One recording waiting for the TranscriptionWorker; `result()` blocks until it is transcribed."""
+
+    def __init__(self, audio, windows, submit_time, decode_time, vad_timings):
+        self.audio = audio
+        self.windows = windows
+        self.submit_time = submit_time
+        self.decode_time = decode_time
+        self.vad_timings = vad_timings
+        self.start_time = None
+        self.batch_size = None
+        self.text = None
+        self.timings = None
+        self.error = None
+        self._done = threading.Event()
+
+    def result(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.text, self.timings
+
+    def _finish(self, text=None, timings=None, error=None):
+        self.text = text
+        self.timings = timings
+        self.error = error
+        self._done.set()
+
+
+class TranscriptionWorker:
+    """
+    Batches transcriptions from concurrent HTTP requests.
+
+    Audio is decoded on the caller's thread; the 30 s windows then wait for a single
+    background thread. After the first request arrives it keeps collecting for up to
+    `max_wait_ms` or until `max_batch_size` windows are waiting, and runs them all
+    through one padded Whisper batch. Each caller gets back its own stitched text.
+    """
+
+    def __init__(self, transcriber, max_batch_size=8, max_wait_ms=10):
+        self.transcriber = transcriber
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self.batches = 0
+        self.completed = 0
+        self.queue_depth_histogram = Counter()  # requests waiting when a batch starts -> batches
+        self.batch_size_histogram = Counter()  # requests in a batch -> batches
+        self._thread = threading.Thread(target=self._run, name="transcription-worker", daemon=True)
+        self._thread.start()
+
+    def transcribe(self, data):
+        """Transcribe an encoded audio file held in memory; returns (text, timings) like `Transcriber.transcribe_bytes`."""
+        return self.submit(data).result()
+
+    def submit(self, data):
+        start_time = time.perf_counter()
+        audio = decode_audio(data)
+        decode_time = time.perf_counter() - start_time
+        windows, vad_timings = self.transcriber.speech_windows(audio)
+        request = TranscriptionRequest(audio, windows, start_time, decode_time, vad_timings)
+        if not windows:
+            # Nothing but silence: answer right away without queueing
+            request._finish("", self._timings(request, {"features": 0.0, "generate": 0.0}))
+            return request
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify()
+        return request
+
+    def stats(self):
+        with self._condition:
+            stats = {
+                "queued": len(self._pending),
+                "batches": self.batches,
+                "completed": self.completed,
+                "mean_batch_size": self.completed / self.batches if self.batches else 0.0,
+                "queue_depth_histogram": dict(sorted(self.queue_depth_histogram.items())),
+                "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            }
+        stats["vad"] = self.transcriber.vad_stats() if self.transcriber.vad else None
+        return stats
+
+    def _collect(self):
+        """Wait for a first request, then gather more until the batch is full or `max_wait_ms` has passed."""
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while sum(len(r.windows) for r in self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            self.queue_depth_histogram[len(self._pending)] += 1
+            batch, windows = [], 0
+            # A recording longer than the batch still goes through, on its own
+            while self._pending and (not batch or windows + len(self._pending[0].windows) <= self.max_batch_size):
+                request = self._pending.popleft()
+                batch.append(request)
+                windows += len(request.windows)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start_time = time.perf_counter()
+            for request in batch:
+                request.start_time = start_time
+                request.batch_size = len(batch)
+            try:
+                texts, stage_timings = self.transcriber.transcribe_windows([w for r in batch for w in r.windows])
+            except Exception as e:
+                logger.error(f"Transcription batch failed: {e}", exc_info=True)
+                for request in batch:
+                    request._finish(error=e)
+                continue
+            # Counted under the lock stats() reads them with
+            with self._condition:
+                self.batches += 1
+                self.completed += len(batch)
+                self.batch_size_histogram[len(batch)] += 1
+            offset = 0
+            for request in batch:
+                request_texts = texts[offset:offset + len(request.windows)]
+                offset += len(request.windows)
+                request._finish(stitch_texts(request_texts), self._timings(request, stage_timings))
+
+    def _timings(self, request, stage_timings):
+        timings = dict(
+            self.transcriber.timings(request.audio, request.submit_time),
+            windows=len(request.windows),
+            decode=request.decode_time,
+            queue=request.start_time - request.submit_time - request.decode_time if request.start_time else 0.0,
+            batch_size=request.batch_size,
+            **request.vad_timings,
+            **stage_timings,
+        )
+        self.transcriber.log_timings(timings)
+        return timings
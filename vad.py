@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class EnergyVAD:
+    """
+    Voice activity detection from frame energy, on CPU with numpy only.
+
+    A frame counts as speech when its RMS level is `margin_db` above the clip's noise
+    floor (its quietest frames) and above `floor_db` overall. Speech runs shorter than
+    `min_speech_ms` are dropped, pauses shorter than `max_pause_ms` are kept, and every
+    kept region gets `padding_ms` of context on both sides so word edges survive.
+
+    A clip whose loud frames are less than `margin_db` above its quiet ones has no
+    pauses to tell apart from speech; it is kept whole unless it is all below
+    `floor_db`.
+    """
+
+    def __init__(self, frame_ms=30, floor_db=-50, margin_db=12, min_speech_ms=150, max_pause_ms=500, padding_ms=200,
+                 sampling_rate=16000):
+        self.sampling_rate = sampling_rate
+        self.frame_ms = frame_ms
+        self.floor_db = floor_db
+        self.margin_db = margin_db
+        self.min_speech_ms = min_speech_ms
+        self.max_pause_ms = max_pause_ms
+        self.padding_ms = padding_ms
+
+    def frame_levels(self, audio):
+        """RMS level of each frame in dBFS."""
+        frame = int(self.sampling_rate * self.frame_ms / 1000)
+        count = len(audio) // frame
+        if count == 0:
+            return np.empty(0)
+        frames = audio[:count * frame].reshape(count, frame).astype(np.float64)
+        rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        return 20 * np.log10(np.maximum(rms, 1e-10))
+
+    def speech_regions(self, audio):
+        """Sample ranges [(start, end), ...] that contain speech, padded and merged."""
+        levels = self.frame_levels(audio)
+        if len(levels) == 0:
+            return []
+        quiet, loud = np.percentile(levels, [10, 90])
+        if loud - quiet < self.margin_db:
+            # Continuous speech (or continuous silence): nothing to cut out
+            return [(0, len(audio))] if loud > self.floor_db else []
+        threshold = max(self.floor_db, quiet + self.margin_db)
+        speech = levels > threshold
+
+        # Runs of speech frames, with short pauses bridged
+        regions = []
+        for index in np.flatnonzero(speech):
+            if regions and index - regions[-1][1] <= self.max_pause_ms / self.frame_ms:
+                regions[-1][1] = index + 1
+            else:
+                regions.append([index, index + 1])
+        regions = [r for r in regions if (r[1] - r[0]) * self.frame_ms >= self.min_speech_ms]
+
+        frame = int(self.sampling_rate * self.frame_ms / 1000)
+        padding = int(self.sampling_rate * self.padding_ms / 1000)
+        padded = []
+        for start, end in regions:
+            start, end = max(0, int(start) * frame - padding), min(len(audio), int(end) * frame + padding)
+            if padded and start <= padded[-1][1]:
+                padded[-1] = (padded[-1][0], end)
+            else:
+                padded.append((start, end))
+        return padded
+
+    def trim(self, audio):
+        """Return only the speech in `audio`, which is empty if there is none."""
+        regions = self.speech_regions(audio)
+        if not regions:
+            return audio[:0]
+        return np.concatenate([audio[start:end] for start, end in regions])